@@ -0,0 +1,29 @@
+/*
+Event lists only show their first events. The "more events" link at the
+end of a list asks the reader for the next ones, which then calls
+append_events() with their HTML. The link is followed automatically when
+it is scrolled into view.
+*/
+
+function append_events(html) {
+    var more = document.getElementById('more-events');
+    var list = more.parentNode;
+    list.removeChild(more);
+    list.insertAdjacentHTML('beforeend', html);
+}
+
+function follow_more_link() {
+    var more = document.getElementById('more-events');
+    if (more === null || more.getAttribute('data-loading')) {
+        return;
+    }
+    if (more.getBoundingClientRect().top < window.innerHeight + 200) {
+        more.setAttribute('data-loading', 'true');
+        var click = document.createEvent('MouseEvents');
+        click.initMouseEvent('click', true, true, window, 0, 0, 0, 0, 0,
+                             false, false, false, false, 0, null);
+        more.dispatchEvent(click);
+    }
+}
+
+window.addEventListener('scroll', follow_more_link, false);
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from helpers import capitalize
+from spatial_index import parse_coords
 
 ###################################
 #----GENERIC ATTRIBUTE GETTERS----#
@@ -11,32 +12,87 @@ everything = the main dictionary containing everything
 a_type = The category, e.g. 'historical_figures'
 
 Given these, will return an element from the database, accounting for the possible offset.
+In lazy loading mode, the element is read from the file the first time it is asked for.
 '''
 def get_element(an_id, a_type, everything):  
     return everything[a_type][an_id - everything[a_type + '_offset']]
 
 '''
-Return the name of an element for a given ID and type.
+Return the name of an element for a given ID and type. Names are
+capitalized once per element and then kept in the world's display cache.
 '''
 def get_name(an_id, a_type, everything):
-    try:
-        return capitalize(get_element(an_id, a_type, everything)['name'])
-    except Exception:
-        return capitalize(get_element(an_id, a_type, everything)['animated_string'])
+    cache = everything.get('display_cache')
+    if cache is not None:
+        name = cache.get_name(a_type, an_id)
+        if name is not None:
+            return name
+
+    name = get_display_name(an_id, a_type, everything)
+    if cache is not None:
+        cache.put_name(a_type, an_id, name)
+    return name
+
+'''
+Return the capitalized name of an element, or its animated_string if it
+has no name. Elements with neither, like events and underground regions,
+are named by their type. Names are read from the *_names dict when
+possible, so in lazy loading mode the element is not parsed just for its
+name.
+'''
+def get_display_name(an_id, a_type, everything):
+    name = everything.get(a_type + '_names', {}).get(an_id)
+    if name is not None:
+        return capitalize(name)
+    element = get_element(an_id, a_type, everything)
+    #unimplemented events are not loaded
+    if element is None:
+        return "Unnamed"
+    for field in ('name', 'animated_string', 'type'):
+        if field in element and element[field] is not None:
+            return capitalize(str(element[field]))
+    return "Unnamed"
+
+'''
+Return the ids of the events an element takes part in, in chronological
+order. Works for historical figures, entities, sites, artifacts, regions
+and world constructions, and for historical eras, whose events are those
+of their years. Other element types have no events.
+'''
+def get_element_events(an_id, a_type, everything):
+    if a_type == 'historical_eras':
+        return everything['timeline'].era_events(an_id)
+    return everything['participant_index'].events_for(a_type, an_id)
+
+'''
+Return the ids of the events from first_year to last_year (both
+included), in chronological order.
+'''
+def get_events_between(first_year, last_year, everything):
+    return everything['timeline'].between_years(first_year, last_year)
+
+'''
+Return every (element type, ID) pair with the given name, using the name
+index built when the world was loaded.
+'''
+def get_ids_and_types(name, everything):
+    return everything['name_index'].lookup(name)
 
 '''
-Return an ID and element type for a given element name.
+Return an ID and element type for a given element name. When several
+elements share the name, the first one in the file is returned, and the
+others are reported; use get_ids_and_types to get all of them.
 '''
 def get_id_and_type(name, everything):
-    name = name.lower()
-    for tag in everything.keys():
-        if not tag.endswith("_names"):
-            continue
-        for element_id in everything[tag]:
-            if everything[tag][element_id] == name:
-                return tag.replace("_names", ""), element_id
-    print("Could not find name: " + name)
-    return "", 0000
+    matches = get_ids_and_types(name, everything)
+    if not matches:
+        print("Could not find name: " + name)
+        return "", 0000
+    if len(matches) > 1:
+        print("Name " + name + " is shared by " + str(len(matches)) + " elements: " +
+              ", ".join(a_type + " " + str(an_id) for a_type, an_id in matches))
+    a_type, an_id = matches[0]
+    return a_type, an_id
 
 ####################################
 #----SPECIFIC ATTRIBUTE GETTERS----#
@@ -45,7 +101,8 @@ def get_id_and_type(name, everything):
 # (In alphabetical order...)
 
 '''
-Return an event dictionary given its ID
+Return an event given its ID. Events are stored in columns, so this is
+a read-only EventView that behaves like the event's dictionary.
 '''
 def get_event(event_id, everything):
     return everything['historical_events'][int(event_id) - everything['historical_events_offset']]
@@ -99,13 +156,17 @@ def get_hf_race(an_id, everything):
 Return a site name given its ID.
 '''
 def get_site_name(site_id, everything):
-    return capitalize(get_name(site_id, 'sites', everything))
+    return get_name(site_id, 'sites', everything)
     
 '''
-Return a site dictionary given its ID.
+Return the ID and name of the site at the given coordinates ("x,y"),
+or (-1, "") if there is none.
 '''
 def get_site_data(site_coords, everything):
-    for site in everything['sites']:
-        if site['coords'] == site_coords:
-            return (site['id'], capitalize(site['name']))
-    return (-1, "")
+    coords = parse_coords(site_coords)
+    if coords is None:
+        return (-1, "")
+    site_id = everything['site_index'].exact(coords[0], coords[1])
+    if site_id == -1:
+        return (-1, "")
+    return (site_id, get_site_name(site_id, everything))
@@ -1,43 +1,41 @@
-from attribute_getters import *
+from name_index import build_name_index
+from name_search import build_name_search_index
+from spatial_index import build_site_index, build_region_index
+from timeline import build_timeline
 
 '''
-Add a historical event ID to a given historical figure's event list.
+Link historical events to the elements that take part in them. The edges
+from participants to events were collected while parsing, see
+participant_index.py, so all that is left is to link the events that only
+have coordinates to their sites, and to group the edges by element, with
+each element's events in chronological order.
 '''
-def add_event_link_to_hf(hfid, event_id, everything):
-    get_element(hfid, 'historical_figures', everything)['events'].append(event_id)
-        
+def parse_historical_events(everything):
+    if not 'participant_index' in everything:
+        return
+
+    everything['site_index'] = build_site_index(everything)
+    everything['timeline'] = build_timeline(everything)
+    link_coordinate_events(everything)
+    everything['participant_index'].build(everything['timeline'])
+
 '''
-Add a historical event ID to a given site's event list.
+Link each event that has coordinates but no site_id to the site at
+those coordinates, if there is one.
 '''
-def add_event_link_to_site(event, event_id, everything):
-    try:
-        #add event based on site_id
-        get_element(event['site_id'], 'sites', everything)['events'].append(event_id)
-    except KeyError:
-        #must use coords instead
-        site_data = get_site_data(event['coords'], everything)
+def link_coordinate_events(everything):
+    participant_index = everything['participant_index']
+    site_index = everything['site_index']
+    for event_id, x, y in participant_index.edges.coordinate_events():
+        site_id = site_index.exact(x, y)
+        if site_id != -1:
+            participant_index.edges.add('coords', site_id, event_id)
 
 '''
-Process all historical events and add links to historical figures and sites.
+Build the lookup indexes of a loaded world. This runs once per load,
+after the events are linked, and the indexes are saved in snapshots.
 '''
-def parse_historical_events(everything):
-    if not 'historical_events' in everything:
-        return
-
-    hfid_set = ['hfid', 'slayer_hfid', 'group_hfid', 'group_1_hfid', 'group_2_hfid', 'woundee_hfid',
-                           'wounder_hfid', 'trickster_hfid', 'cover_hfid', 'hist_fig_id', 'target_hfid', 
-                           'snatcher_hfid', 'changee_hfid', 'changer_hfid', 'hist_figure_id', 'hfid_target']
-    siteid_set = ['site_id', 'coords']
-    
-    for event_data in everything['historical_events']:
-        #We store None for unimplemented events
-        #such as creature devoured
-        if event_data == None:
-            continue
-            
-        for key in event_data.keys():
-            if key in hfid_set:
-                add_event_link_to_hf(event_data[key], event_data['id'], everything)
-            elif key in siteid_set:
-                add_event_link_to_site(event_data, event_data['id'], everything)
-                break
+def build_indexes(everything):
+    everything['name_index'] = build_name_index(everything)
+    everything['name_search'] = build_name_search_index(everything)
+    everything['region_index'] = build_region_index(everything)
@@ -1,80 +1,100 @@
 from lxml import etree
 from multiprocessing import Lock, Array
 import io
+import mmap
 import time
 import sys
 
-TAG_MAP = {'region': 'regions', \
-           'underground_region': 'underground_regions', \
-           'site': 'sites', \
-           'world_construction': 'world_constructions', \
-           'artifact':'artifacts', \
-           'historical_figure': 'historical_figures', \
-           'entity_population': 'entity_populations',\
-           'entity': 'entities',\
-           'historical_event': 'historical_events',\
-           'historical_event_collection': 'historical_event_collections',\
-           'historical_era':'historical_eras'}
+from global_vars import TAG_MAP
+from event_store import EventStore
+from participant_index import ParticipantIndex, collect_edges
+from records import HistFigure
+from section_scan import scan_file, split_section
+from xml_stream import transcode
+
+#Event types that are not loaded
+UNIMPLEMENTED_EVENT_TYPES = ['add hf entity link', 'add hf site link', 'create entity position', 'creature devoured',
+                             'hf new pet', 'item stolen', 'remove hf site link', 'remove hf entity link']
+
+#Each worker process maps the file being parsed once, when the pool is
+#created, and then only receives byte ranges to parse.
+MAPPED_FILE = None
+XML_ENCODING = None
                
 '''
 Used when not running in multithreaded mode. Parses the 
 exported XML file using lxml and loads its data into the 
-dictionary.
+dictionary. The file is parsed one byte range at a time, in
+the same way the worker processes do in multithreaded mode.
 '''
-def parse_file(filename):
+def parse_file(filename, encoding, chunk_size, profiler):
     #Dictionary that stores all world information
-    everything = {}
+    everything = new_everything()
     
-    element_array = []
-    names_dict = {}
-    offset = -1
+    open_mapped_file(filename, encoding)
     
-    #The tags to search for
-    lower_level_tags = TAG_MAP.keys()
-    upper_level_tags = TAG_MAP.values()
+    with profiler.phase('pre-scan'):
+        sections = scan_file(MAPPED_FILE, chunk_size)
+        profiler.add_bytes_read(len(MAPPED_FILE))
     
-    #Parse the file
-    for _, element in etree.iterparse(filename):
-        #Look for the lower-level elements
-        if element.tag in lower_level_tags:
-            if element.tag == 'historical_figure':
-                #Smarter loading is needed for the historical figures,
-                #as they have nested tags. TODO determine which other
-                #elements need smarter loading and make functions for them.
-                element_data, element_name, element_id = load_hist_figure_data(element)
-            else:
-                element_data, element_name, element_id = load_generic_element_data(element)
-        
-            #If we haven't stored an offset yet, store the first id we see
-            if offset == -1:
-                offset = element_id
-                
-            #Store element
-            element_array.append(element_data)
-            
-            #Store the element's name
-            if not element_name == "":
-                names_dict[element_id] = element_name
-            
-        elif element.tag in upper_level_tags:
-            
-            #Store the elements in the everything dict
-            everything[element.tag] = element_array
-            everything[element.tag + "_names"] = names_dict
-            everything[element.tag + "_offset"] = offset
-            
-            #Close the element
-            close_element(element)
-            
-            #Reset for the next upper level tag
-            element_array = []
-            names_dict = {}
-            offset = -1
+    with profiler.phase('parse'):
+        for upper_level_tag, chunks in sections:
+            start_section(upper_level_tag, everything)
+            for start, end in chunks:
+                loaded_range, busy_seconds = load_range_timed(upper_level_tag, start, end)
+                add_timed_range(loaded_range, end - start, busy_seconds, profiler, everything)
+    
+    close_mapped_file()
             
     return everything
+
+'''
+Return an empty everything dict, before any section is added.
+'''
+def new_everything():
+    return {'quarantine': [], 'participant_index': ParticipantIndex()}
+
+'''
+Add an empty entry for a top-level section to the everything dict.
+Historical events are kept in a columnar EventStore, everything else
+in a list.
+'''
+def start_section(upper_level_tag, everything):
+    if upper_level_tag == 'historical_events':
+        everything[upper_level_tag] = EventStore()
+    else:
+        everything[upper_level_tag] = []
+    everything[upper_level_tag + "_names"] = {}
+    everything[upper_level_tag + "_offset"] = -1
+
+'''
+Add the elements of a loaded byte range to the everything dict.
+Ranges must be added in file order.
+'''
+def add_range(loaded_range, everything):
+    upper_level_tag, offset, element_array, element_names, quarantine, edges = loaded_range
+    
+    #the offset is the id of the first element in the section
+    if everything[upper_level_tag + "_offset"] == -1:
+        everything[upper_level_tag + "_offset"] = offset
+    everything[upper_level_tag].extend(element_array)
+    everything[upper_level_tag + "_names"].update(element_names)
+    everything['quarantine'].extend(quarantine)
+    if edges is not None:
+        everything['participant_index'].add_edges(edges)
     
 '''
-Load a given element. This is only called in multithreaded mode.
+Add a loaded byte range to the everything dict, and record it and the
+time taken to merge it in the profiler.
+'''
+def add_timed_range(loaded_range, num_bytes, busy_seconds, profiler, everything):
+    start_time = time.perf_counter()
+    add_range(loaded_range, everything)
+    profiler.add_merge_time(time.perf_counter() - start_time)
+    profiler.add_range(loaded_range[0], len(loaded_range[2]), num_bytes, busy_seconds)
+
+'''
+Load a given element. This is used for each byte range of the file.
 
 '''
 def load_element(element_string, high_level_tag):
@@ -90,6 +110,10 @@ def load_element(element_string, high_level_tag):
     #everything[element_type][id - offset]
     offset = -1
     
+    #Malformed elements that could not be loaded
+    quarantine = []
+    next_id = -1
+    
     #create a file object around the element
     #for the iterparse
     f = io.BytesIO(element_string)
@@ -97,15 +121,20 @@ def load_element(element_string, high_level_tag):
     lower_level_tags = TAG_MAP.keys()
     
     #iterparse through the element
-    for _, element in etree.iterparse(f):
+    context = etree.iterparse(f, recover=True)
+    for _, element in context:
         #ignore tags within the lower level tag
         if not element.tag in lower_level_tags:
             continue
             
-        if element.tag == 'historical_figure':
-            element_data, element_name, element_id = load_hist_figure_data(element)
-        else:
-            element_data, element_name, element_id = load_generic_element_data(element)
+        element_data, element_name, element_id = load_lower_level_element(element, next_id, quarantine)
+        #an element without an id is taken to be the one after the
+        #previous, so only real ids set the id expected next. Sections
+        #without ids, like historical_eras, are numbered from 0
+        if element_id is None:
+            element_id = max(next_id, 0)
+        if element_id != -1:
+            next_id = element_id + 1
 
         #if we haven't stored an offset yet, store the first id we see
         if offset == -1:
@@ -118,23 +147,140 @@ def load_element(element_string, high_level_tag):
         if not element_name == "":
             names_dict[element_id] = element_name
     
+    for entry in context.error_log:
+        quarantine.append(('xml', None, "line " + str(entry.line) + ": " + entry.message))
+    
     #callback to the main thread
     #which will add to main everything dict
-    return (high_level_tag, offset, temp_element_array, names_dict)
+    return (high_level_tag, offset, temp_element_array, names_dict, quarantine)
 
 '''
-Returns an element data dictionary with the following structure:
-    { 'events': [12521, 3462, 123, 733, 1324...],
-      'hf_links': [ {'type':'mother', 'id':12415}, {'type':'father', 'id':1235}...],
-      'entity_links' : [ {'type':'something', 'id':12415}, {'type':'somethingelse', 'id':1235}...],
-    }
+Map the given file into this process. This is used as the
+initializer of the parsing pool.
+'''
+def open_mapped_file(filename, encoding):
+    global MAPPED_FILE, XML_ENCODING
+    XML_ENCODING = encoding
+    with open(filename, 'rb') as f:
+        MAPPED_FILE = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def close_mapped_file():
+    global MAPPED_FILE
+    MAPPED_FILE.close()
+    MAPPED_FILE = None
+
+'''
+Load the elements in the byte range [start, end) of the mapped file.
+The range holds whole elements of one top-level section, without the
+section's own tags, so they are added back before parsing. The range
+is transcoded to UTF-8 from the file's real encoding first. For
+historical events, the edges from each event's participants to the
+event are collected here too, see participant_index.py.
+
+The parser recovers from malformed XML, but an unclosed tag swallows
+every element after it. So if the parser reports any errors, the range
+is loaded again one element at a time, and only the broken elements
+are quarantined.
+'''
+def load_range(high_level_tag, start, end):
+    loaded_range = load_element(wrap_range(high_level_tag, start, end), high_level_tag)
+    quarantine = loaded_range[4]
+    if not any(tag == 'xml' for tag, _, _ in quarantine):
+        return loaded_range + (range_edges(high_level_tag, loaded_range[2]),)
+    
+    lower_level_tag = [lower for lower, upper in TAG_MAP.items() if upper == high_level_tag][0]
+    
+    offset = -1
+    next_id = -1
+    element_array = []
+    names_dict = {}
+    quarantine = []
+    for element_start, element_end in split_section(MAPPED_FILE, lower_level_tag, start, end, 1):
+        _, element_offset, elements, names, element_quarantine = \
+            load_element(wrap_range(high_level_tag, element_start, element_end), high_level_tag)
+        #an element too broken to find its id gets the id after the previous one
+        if element_offset == -1:
+            element_offset = next_id
+        if offset == -1:
+            offset = element_offset
+        if element_offset != -1:
+            next_id = element_offset + len(elements)
+        element_array.extend(elements)
+        names_dict.update(names)
+        for tag, element_id, message in element_quarantine:
+            if tag == 'xml':
+                message = "at byte " + str(element_start) + ", " + message
+            elif element_id == -1:
+                element_id = element_offset
+            quarantine.append((tag, element_id, message))
+    
+    return (high_level_tag, offset, element_array, names_dict, quarantine,
+            range_edges(high_level_tag, element_array))
+
+'''
+Return the participant edges of a range of historical events, or None
+for other sections.
+'''
+def range_edges(high_level_tag, element_array):
+    if high_level_tag != 'historical_events':
+        return None
+    return collect_edges(element_array)
+
+'''
+Load a byte range as load_range does, and also return the CPU time it
+took, which the profiler uses to measure how busy the workers are.
+'''
+def load_range_timed(high_level_tag, start, end):
+    start_time = time.process_time()
+    loaded_range = load_range(high_level_tag, start, end)
+    return loaded_range, time.process_time() - start_time
+
+'''
+Return the transcoded bytes of a range of the mapped file, wrapped in
+the tags of its top-level section.
+'''
+def wrap_range(high_level_tag, start, end):
+    return wrap_bytes(high_level_tag, MAPPED_FILE[start:end], XML_ENCODING)
+
+'''
+Transcode raw bytes from the file to UTF-8 and wrap them in the tags of
+their top-level section.
+'''
+def wrap_bytes(high_level_tag, data, encoding):
+    tag = high_level_tag.encode()
+    return b'<' + tag + b'>' + transcode(data, encoding) + b'</' + tag + b'>'
+
+'''
+Load a lower-level element with the loader for its tag. A malformed
+element does not abort the load: it is stored as None, so that the ids
+of the elements after it still line up with their indices, and the
+problem is recorded in the quarantine list as (tag, id, message).
+expected_id is the id the element should have, or -1 if unknown.
+'''
+def load_lower_level_element(element, expected_id, quarantine):
+    try:
+        if element.tag == 'historical_figure':
+            #Smarter loading is needed for the historical figures,
+            #as they have nested tags. TODO determine which other
+            #elements need smarter loading and make functions for them.
+            return load_hist_figure_data(element)
+        return load_generic_element_data(element)
+    except Exception as e:
+        try:
+            element_id = int(element.findtext('id'))
+        except (TypeError, ValueError):
+            element_id = expected_id
+        quarantine.append((element.tag, element_id, repr(e)))
+        close_element(element)
+        return None, "", element_id
+
+'''
+Returns a HistFigure record for a historical figure element. Its links
+are packed into integer arrays, see records.py.
 '''
 def load_hist_figure_data(element):
     #sys.intern is used to cache strings to save memory
-    element_data = {}
-    element_data[sys.intern('events')] = []
-    element_data[sys.intern('hf_links')] = []
-    element_data[sys.intern('entity_links')] = []
+    element_data = HistFigure()
     
     for attribute in element:
         #should not be saved
@@ -142,18 +288,16 @@ def load_hist_figure_data(element):
             close_element(attribute)
             continue
         #These tags have tags nested within them, and there are multiple for each historical figure,
-        #Here, we parse them separately and store their information in subdictionaries within lists.
-        if attribute.tag in ['hf_link', 'entity_link']:
+        #Here, we parse them separately and pack them into the figure's link arrays.
+        if attribute.tag == 'hf_link':
             children = attribute.getchildren()
-            
-            attribute_dict = {}
-            attribute_dict[sys.intern('type')] = sys.intern(children[0].text)
-            attribute_dict[sys.intern('id')] = int(children[1].text)
-            
-            if attribute.tag == 'entity_link' and len(children) > 2:
-                attribute_dict[sys.intern('strength')] = int(children[2].text)
-                
-            element_data[sys.intern(attribute.tag + 's')].append(attribute_dict)
+            element_data.add_hf_link(children[0].text, int(children[1].text))
+        elif attribute.tag == 'entity_link':
+            children = attribute.getchildren()
+            strength = -1
+            if len(children) > 2:
+                strength = int(children[2].text)
+            element_data.add_entity_link(children[0].text, int(children[1].text), strength)
         else: #other hf_fig attribute
         
             #Attributes such as death year for hf_figs still alive
@@ -193,7 +337,7 @@ def load_hist_figure_data(element):
     try:
         element_id = int(element_data['id'])
     except KeyError:
-        element_id = 0
+        element_id = None
             
     return element_data, element_name, element_id
      
@@ -202,11 +346,7 @@ Returns a processed generic element
 '''
 def load_generic_element_data(element):
     element_data = {}
-    
-    #some elements have events
-    #TODO: narrow this down
-    if element.tag in ['historical_figure', 'site']:
-        element_data['events'] = []
+    element_id = None
     
     #Add the element attributes to a dictionary representing the generic element
     for attribute in element.getchildren():
@@ -218,7 +358,9 @@ def load_generic_element_data(element):
         
         if element.tag == "historical_event":
             #Unimplemented events
-            if attribute.tag == 'type' and attribute.text in ['add hf entity link', 'add hf site link', 'create entity position', 'creature devoured', 'hf new pet', 'item stolen', 'remove hf site link', 'remove hf entity link']:
+            if attribute.tag == 'type' and attribute.text in UNIMPLEMENTED_EVENT_TYPES:
+                #keep the id, which comes before the type
+                element_id = element_data.get('id')
                 close_element(attribute)
                 element_data = None
                 close_element(attribute)
@@ -257,11 +399,11 @@ def load_generic_element_data(element):
     except (KeyError, TypeError):
         element_name = ""
         
-    #find the element's id
-    try:
-        element_id = int(element_data['id'])
-    except (KeyError, TypeError):
-        element_id = 0
+    #find the element's id, or None if it has none
+    if element_data is not None:
+        element_id = element_data.get('id')
+    if not isinstance(element_id, int):
+        element_id = None
                 
     return element_data, element_name, element_id
     
@@ -0,0 +1,54 @@
+'''
+Caches for the names and links shown on pages.
+
+A page can mention the same few hundred figures, sites and entities
+thousands of times, so each element's display name (its capitalized name)
+is computed once and kept in a table, and the HTML links to elements are
+kept in a bounded LRU cache. A DisplayCache belongs to one loaded world,
+as everything['display_cache'].
+'''
+
+from helpers import LRUCache
+
+class DisplayCache():
+
+    def __init__(self, link_cache_size):
+        #display names, by element type and id
+        self.names = {}
+        self.name_hits = 0
+        self.name_misses = 0
+
+        #HTML links, by (page code, id)
+        self.links = LRUCache(link_cache_size)
+
+    '''
+    Return the display name of an element, or None if it is not known yet.
+    '''
+    def get_name(self, a_type, an_id):
+        name = self.names.get(a_type, {}).get(an_id)
+        if name is None:
+            self.name_misses += 1
+        else:
+            self.name_hits += 1
+        return name
+
+    def put_name(self, a_type, an_id, name):
+        if a_type not in self.names:
+            self.names[a_type] = {}
+        self.names[a_type][an_id] = name
+
+    def clear(self):
+        self.names.clear()
+        self.links.clear()
+
+    '''
+    Return the number of entries, hits, misses and hit rate of the name
+    table and of the link cache.
+    '''
+    def stats(self):
+        lookups = self.name_hits + self.name_misses
+        names = {'entries': sum(len(names) for names in self.names.values()),
+                 'hits': self.name_hits,
+                 'misses': self.name_misses,
+                 'hit_rate': self.name_hits / lookups if lookups else 0.0}
+        return {'names': names, 'links': self.links.stats()}
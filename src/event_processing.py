@@ -1,79 +1,70 @@
 #!/usr/bin/env python3
+import re
+
 from attribute_getters import *
 from link_creator import *
 
 '''
-Given an event ID, dispatch to the appropriate function to handle 
-that event type and return a string describing the event.
+Given an event ID, dispatch to the appropriate renderer for that event
+type and return a string describing the event.
 '''
 def event_type_dispatcher(event_id, everything):
-    #Probably could have avoided this with string replacing and reflection magic,
-    #but it is nice to have them all here for reference. This dictionary 
-    #maps strings to function names.
-    types = { 'add hf entity link' : add_hf_entity_link,
-              'add hf hf link' : add_hf_hf_link,
-              'add hf site link' : add_hf_site_link,
-              'artifact created' : artifact_created,
-              'attacked site' : attacked_site,
-              'body abused' : body_abused,
-              'change hf job' : change_hf_job,
-              'change hf state' : change_hf_state,
-              'changed creature type' : changed_creature_type,
-              'create entity position' : create_entity_position,
-              'created site' : created_site,
-              'created structure' : created_structure,
-              'created world construction' : created_world_construction,
-              'creature devoured' : creature_devoured,
-              'destroyed site' : destroyed_site,
-              'diplomat lost' : diplomat_lost,
-              'entity created' : entity_created,
-              'entity law' : entity_law,
-              'field battle' : field_battle,
-              'hf abducted' : hf_abducted,
-              'hf confronted' : hf_confronted,
-              'hf died' : hf_died,
-              'hf does interaction' : hf_does_interaction,
-              'hf gains secret goal' : hf_gains_secret_goal,
-              'hf new pet' : hf_new_pet,
-              'hf profaned structure' : hf_profaned_structure,
-              'hf razed structure' : hf_razed_structure,
-              'hf reunion' : hf_reunion,
-              'hf revived' : hf_revived,
-              'hf simple battle event' : hf_simple_battle_event,
-              'hf travel' : hf_travel,
-              'hf wounded' : hf_wounded,
-              'impersonate hf' : impersonate_hf,
-              'item stolen' : item_stolen,
-              'masterpiece arch constructed' : masterpiece_arch_constructed,
-              'masterpiece arch design' : masterpiece_arch_design,
-              'masterpiece engraving' : masterpiece_engraving,
-              'masterpiece food' : masterpiece_food,
-              'masterpiece item' : masterpiece_item,
-              'masterpiece item improvement' : masterpiece_item_improvement,
-              'masterpiece lost' : masterpiece_lost,
-              'merchant' : merchant,
-              'new site leader' : new_site_leader,
-              'peace accepted' : peace_accepted,
-              'peace rejected' : peace_rejected,
-              'razed structure' : razed_structure,
-              'reclaim site' : reclaim_site,
-              'remove hf site link' : remove_hf_site_link,
-              'remove hf entity link' : remove_hf_entity_link,
-              'replaced structure' : replaced_structure,
-              'site abandoned' : site_abandoned,
-              'site died' : site_died,
-              'site taken over' : site_taken_over,
-    }
-    
-    event_data = get_event(event_id, everything)
-    event_type = event_data['type']
-    
-    if event_type in types.keys():
-        #This might look confusing, but it's just a function call to 
-        #whatever function matches up in the above dictionary.
-        return date_string(event_data) + " " + types[event_type](event_data, everything)
-    else:
-        return "Event type " + event_type + " is not implemented. Data: " + str(event_data)
+    return render_events([event_id], everything)[0]
+
+'''
+Return the strings describing a list of events. Every figure, site,
+entity... is only looked up and linked once for the whole list, however
+many of the events refer to it.
+'''
+def render_events(event_ids, everything):
+    fragment = fragment_resolver(everything)
+    output = []
+    for event_id in event_ids:
+        event_data = get_event(event_id, everything)
+        event_type = event_data['type']
+        renderer = EVENT_RENDERERS.get(event_type)
+        if renderer is None:
+            output.append("Event type " + event_type + " is not implemented. Data: " + str(event_data))
+            continue
+        text = renderer(event_data, fragment)
+        if text is None:
+            text = str(event_data)
+        output.append(date_string(event_data) + " " + text)
+    return output
+
+'''
+Return the plain text descriptions of a list of events, without dates or
+HTML, as used by the full-text index. Events whose type has no template,
+or that match none of their type's templates, have an empty description.
+'''
+def render_event_texts(event_ids, everything):
+    fragment = fragment_resolver(everything, TEXT_FRAGMENT_KINDS)
+    output = []
+    for event_id in event_ids:
+        event_data = get_event(event_id, everything)
+        renderer = EVENT_RENDERERS.get(event_data['type'])
+        text = renderer(event_data, fragment) if renderer is not None else None
+        output.append(text if text is not None else "")
+    return output
+
+'''
+Return a function fragment(kind, value) that returns the HTML for a
+template field, such as the link to a historical figure, and remembers
+it for the next events of the same batch. kinds can be TEXT_FRAGMENT_KINDS
+for plain text instead of HTML.
+'''
+def fragment_resolver(everything, kinds=None):
+    if kinds is None:
+        kinds = FRAGMENT_KINDS
+    fragments = {}
+    def fragment(kind, value):
+        key = (kind, value)
+        text = fragments.get(key)
+        if text is None:
+            text = kinds[kind](value, everything)
+            fragments[key] = text
+        return text
+    return fragment
 
 '''
 Format the year and date to be consistent
@@ -97,8 +88,16 @@ Will return a string that looks like:
 '15th of Granite'
 '2nd of Timber'
 etc.
+
+There are only 336 days in a year, so their strings are made once, in
+DAY_STRINGS.
 '''
 def time_string(seconds):
+    if 0 <= seconds < 403200:
+        return DAY_STRINGS[seconds // 1200]
+    return day_string(seconds)
+
+def day_string(seconds):
     #There are 403200 seconds in a DF year.
     months = ['Granite','Slate','Felsite','Hematite','Malachite','Galena','Limestone','Sandstone','Timber','Moonstone','Opal','Obsidian']
     #33600 = seconds in a DF month (403200 / 12)
@@ -123,185 +122,221 @@ def suffix_date(date):
 
 #========>--EVENTS--<==========
 
-def add_hf_entity_link(data, everything):
-    #NOT IMPLEMENTED
-    return "" + str(data)
-
-def add_hf_hf_link(data, everything):
+'''
+One template for each event type. A field is written {kind:field_name},
+where kind is one of FRAGMENT_KINDS and says how to show the field's
+value; {place} is the site an event happened in, from its site_id or
+coords. An event type can have a list of templates, and the first one
+whose fields are all in the event is used. Events that match none of
+their templates are shown as their raw data.
+'''
+EVENT_TEMPLATES = {
+    'add hf entity link': "{hf:histfig} became a member of {entity:civ_id}",
     #TODO: lookup proper relationship
-    return(create_hf_link(data['hfid'], everything) + " married/worshipped/imprisoned " + create_hf_link(data['hfid_target'], everything))
-
-def add_hf_site_link(data, everything):
-    #NOT IMPLEMENTED
-    return "" + str(data)
-
-def artifact_created(data, everything):
-    return "" + str(data)
-
-def attacked_site(data, everything):
-    return "" + str(data)
-
-def body_abused(data, everything):
-    return "" + str(data)
-
-def change_hf_job(data, everything):
-    return(create_hf_link(data['hfid'], everything) + " changed their job " + 
-            create_site_link(data, everything))
-
-def change_hf_state(data, everything):
-    return(create_hf_link(data['hfid'], everything) + " started " + data['state'] + 
-            " " +  create_site_link(data, everything))
-
-
-def changed_creature_type(data, everything):
-    return(create_hf_link(data['changer_hfid'], everything) + ' transformed ' + 
-          create_hf_link(data['changee_hfid'], everything) + ' from a ' + str(data['old_caste']) + 
-          ' ' + str(data['old_race']) + ' to a ' + str(data['new_caste']) + ' ' +
-          data['new_race'])
-
-def create_entity_position(data, everything):
-    return "" + str(data)
-
-def created_site(data, everything):
-    return create_entity_link(data['site_civ_id'], everything) + " of the " + create_entity_link(data['civ_id'], everything) + " created " + create_site_link(data, everything)
-
-def created_structure(data, everything):
-    return "" + str(data)
-
-def created_world_construction(data, everything):
-    return "" + str(data)
-
-def creature_devoured(data, everything):
-    #NOT IMPLEMENTED
-    return "" + str(data)
-
-def destroyed_site(data, everything):
-    return "" + str(data)
-
-def diplomat_lost(data, everything):
-    return "" + str(data)
-
-def entity_created(data, everything):
-    return "" + str(data)
-
-def entity_law(data, everything):
-    return create_hf_link(data['hist_figure_id'], everything) + " created a " + data['law_add'] + " law for " + create_entity_link(data['entity_id'], everything)
-
-def field_battle(data, everything):
-    return "" + str(data)
-
-def hf_abducted(data, everything):
-    return create_hf_link(data['snatcher_hfid'], everything) + " abducted " + create_hf_link(data['target_hfid'], everything)+ " " + create_site_link(data, everything)
-
-def hf_confronted(data, everything):
-    return create_hf_link(data['hfid'], everything) + " was confronted with " + data['situation'] + " about " + data['reason'] + " in " + create_site_link(data, everything)
-
-def hf_died(data, everything):
+    'add hf hf link': "{hf:hfid} married/worshipped/imprisoned {hf:hfid_target}",
+    'add hf site link': ["{hf:histfig} settled {site:site_id}",
+                         "A historical figure settled {site:site_id}"],
+    'artifact created': "{hf:hist_figure_id} created {artifact:artifact_id} {site:site_id}",
+    'attacked site': "{entity:attacker_civ_id} attacked {entity:defender_civ_id} {site:site_id}",
+    'body abused': "A body was abused {place}",
+    'change hf job': "{hf:hfid} changed their job {place}",
+    'change hf state': "{hf:hfid} started {text:state} {place}",
+    'changed creature type': "{hf:changer_hfid} transformed {hf:changee_hfid} from a {text:old_caste} "
+                             "{text:old_race} to a {text:new_caste} {text:new_race}",
+    'create entity position': ["{hf:histfig} of {entity:civ} created the position of {text:position}",
+                               "{entity:civ} created the position of {text:position}"],
+    'created site': "{entity:site_civ_id} of the {entity:civ_id} created {place}",
+    'created structure': "{entity:site_civ_id} of the {entity:civ_id} built structure "
+                         "{text:structure_id} {site:site_id}",
+    'created world construction': "{entity:site_civ_id} of the {entity:civ_id} built {construction:wc_id} "
+                                  "between {site_name:site_id1} and {site_name:site_id2}",
+    'creature devoured': ["{hf:eater} devoured {hf:victim} {place}",
+                          "A creature was devoured {place}"],
+    'destroyed site': "{entity:attacker_civ_id} destroyed {site_name:site_id}",
+    'diplomat lost': ["{entity:entity} lost a diplomat to {entity:involved} {site:site_id}",
+                      "A diplomat was lost {place}"],
+    'entity created': "{entity:entity_id} was founded {place}",
+    'entity law': ["{hf:hist_figure_id} created a {text:law_add} law for {entity:entity_id}",
+                   "{hf:hist_figure_id} removed a {text:law_remove} law from {entity:entity_id}"],
+    'field battle': ["{entity:attacker_civ_id} fought {entity:defender_civ_id} in {region:subregion_id}",
+                     "{entity:attacker_civ_id} fought {entity:defender_civ_id} {place}"],
+    'hf abducted': "{hf:snatcher_hfid} abducted {hf:target_hfid} {place}",
+    'hf confronted': "{hf:hfid} was confronted with {text:situation} about {text:reason} {place}",
     #TODO: get proper cause of death
-    if 'slayer_hfid' not in data.keys():
-        return create_hf_link(data['hfid'], everything) + " died of old age " + create_site_link(data, everything)
-        
-    return create_hf_link(data['slayer_hfid'], everything) + " " + data['cause'] + " " + create_hf_link(data['hfid'], everything) + " " + create_site_link(data, everything)
-
-def hf_does_interaction(data, everything):
-    return create_hf_link(data['target_hfid'], everything) + " was " + get_interaction_string(data['interaction']) + " by " + create_hf_link(data['doer_hfid'], everything)
-
-def hf_gains_secret_goal(data, everything):
-    return create_hf_link(data['hfid'], everything) + " achieved " + data['secret_goal']
-    
-def hf_profaned_structure(data, everything):
-     #TODO: link structure data?
-     return create_hf_link(data['hist_fig_id'], everything) + " profaned structure " + str(data['structure_id']) + " in " + create_site_link(data['site_id'], everything)
-
-def hf_new_pet(data, everything):
-    return "" + str(data)
-
-def hf_razed_structure(data, everything):
-    return "" + str(data)
-
-def hf_reunion(data, everything):
-    return "" + str(data)
-
-def hf_revived(data, everything):
-    return "" + str(data)
-
-def hf_simple_battle_event(data, everything):
-    return  create_hf_link(data['group_1_hfid'], everything) + " " +\
-            grammarify_battle_verb(data['subtype']) + " " + \
-            create_hf_link(data['group_2_hfid'], everything) + " " + \
-            create_site_link(data, everything)
-
-def hf_travel(data, everything):
-    return "" + str(data)
-
-def hf_wounded(data, everything):
-        return create_hf_link(data['wounder_hfid'], everything) + \
-               " wounded " + create_hf_link(data['woundee_hfid'], everything) + \
-               " " + create_site_link(data, everything)
-
-def impersonate_hf(data, everything):
-    return "" + str(data)
-
-def item_stolen(data, everything):
-    return "" + str(data)
-
-def masterpiece_arch_constructed(data, everything):
-    return "" + str(data)
-
-def masterpiece_arch_design(data, everything):
-    return "" + str(data)
-
-def masterpiece_engraving(data, everything):
-    return "" + str(data)
-
-def masterpiece_food(data, everything):
-    return "" + str(data)
+    'hf died': ["{hf:slayer_hfid} {text:cause} {hf:hfid} {place}",
+                "{hf:hfid} died of old age {place}"],
+    'hf does interaction': "{hf:target_hfid} was {interaction:interaction} by {hf:doer_hfid}",
+    'hf gains secret goal': "{hf:hfid} achieved {text:secret_goal}",
+    'hf new pet': ["{hf:group_hfid} tamed {text:pets} {place}",
+                   "{hf:group_hfid} tamed a creature {place}"],
+    #TODO: link structure data?
+    'hf profaned structure': "{hf:hist_fig_id} profaned structure {text:structure_id} {site:site_id}",
+    'hf razed structure': "{hf:histfig} razed structure {text:structure_id} {site:site_id}",
+    'hf reunion': "{hf:group_1_hfid} was reunited with {hf:group_2_hfid} {place}",
+    'hf revived': "{hf:hfid} came back from the dead {place}",
+    'hf simple battle event': "{hf:group_1_hfid} {battle_verb:subtype} {hf:group_2_hfid} {place}",
+    'hf travel': "{hf:group_hfid} journeyed, arriving {place}",
+    'hf wounded': "{hf:wounder_hfid} wounded {hf:woundee_hfid} {place}",
+    'impersonate hf': "{hf:trickster_hfid} fooled {entity:target_enid} by impersonating {hf:cover_hfid}",
+    'item stolen': ["{hf:histfig} stole {text:item_type} from {entity:entity} {place}",
+                    "An item was stolen {place}"],
+    'masterpiece arch constructed': "{hf:hfid} of {entity:entity_id} constructed a masterful building {site:site_id}",
+    'masterpiece arch design': "{hf:hfid} of {entity:entity_id} designed a masterful building {site:site_id}",
+    'masterpiece engraving': "{hf:hfid} of {entity:entity_id} created a masterful engraving {site:site_id}",
+    'masterpiece food': "{hf:hfid} of {entity:entity_id} prepared a masterful meal {site:site_id}",
+    'masterpiece item': "{hf:hfid} of {entity:entity_id} created a masterful item {site:site_id}",
+    'masterpiece item improvement': "{hf:hfid} of {entity:entity_id} masterfully improved an item {site:site_id}",
+    'masterpiece lost': "A masterpiece was lost {place}",
+    'merchant': "Merchants from {entity:source} visited {entity:destination} {site:site_id}",
+    'new site leader': "{hf:new_leader_hfid} became the leader of {site_name:site_id} for {entity:new_site_civ_id}",
+    'peace accepted': "{entity:destination} accepted an offer of peace from {entity:source} {site:site_id}",
+    'peace rejected': "{entity:destination} rejected an offer of peace from {entity:source} {site:site_id}",
+    'razed structure': "{entity:civ_id} razed structure {text:structure_id} {site:site_id}",
+    'reclaim site': "{entity:site_civ_id} of the {entity:civ_id} reclaimed {site_name:site_id}",
+    'remove hf site link': ["{hf:histfig} left {site_name:site_id}",
+                            "A historical figure left {site_name:site_id}"],
+    'remove hf entity link': "{hf:histfig} left {entity:civ_id}",
+    'replaced structure': "{entity:site_civ_id} of the {entity:civ_id} replaced structure {text:old_ab_id} "
+                          "with structure {text:new_ab_id} {site:site_id}",
+    'site abandoned': ["{entity:site_civ_id} of the {entity:civ_id} abandoned {site_name:site_id}",
+                       "{site_name:site_id} was abandoned"],
+    'site died': ["{entity:site_civ_id} of the {entity:civ_id} died out {site:site_id}",
+                  "The settlement {site:site_id} died out"],
+    'site taken over': "{entity:attacker_civ_id} took over {site_name:site_id} from {entity:defender_civ_id}",
+}
 
-def masterpiece_item(data, everything):
-    return "" + str(data)
-
-def masterpiece_item_improvement(data, everything):
-    return "" + str(data)
-
-def masterpiece_lost(data, everything):
-    return "" + str(data)
-
-def merchant(data, everything):
-    return "" + str(data)
-
-def new_site_leader(data, everything):
-    return "" + str(data)
-
-def peace_accepted(data, everything):
-    return "" + str(data)
-
-def peace_rejected(data, everything):
-    return "" + str(data)
-
-def razed_structure(data, everything):
-    return "" + str(data)
-
-def reclaim_site(data, everything):
-    return "" + str(data)
+'''
+Return the link to the site given by a (site_id, coords) pair, or "" if
+there is none.
+'''
+def create_place_link(place, everything):
+    site_id, coords = place
+    if site_id is not None and site_id >= 0:
+        return create_site_link(site_id, everything)
+    if coords is not None:
+        return create_site_link({'coords': coords}, everything)
+    return ""
+
+#How to show each kind of template field, given its value
+FRAGMENT_KINDS = {
+    'hf': create_hf_link,
+    'entity': create_entity_link,
+    #"in <site>"
+    'site': create_site_link,
+    'site_name': lambda site_id, everything: create_element_link('sites', site_id, everything),
+    'artifact': lambda artifact_id, everything: create_element_link('artifacts', artifact_id, everything),
+    'construction': lambda wc_id, everything: create_element_link('world_constructions', wc_id, everything),
+    'region': lambda region_id, everything: create_element_link('regions', region_id, everything),
+    'place': create_place_link,
+    'text': lambda value, everything: str(value),
+    'interaction': lambda interaction, everything: get_interaction_string(interaction),
+    'battle_verb': lambda subtype, everything: grammarify_battle_verb(subtype),
+}
 
-def remove_hf_site_link(data, everything):
-    return "" + str(data)
+'''
+Return the name of the site given by a (site_id, coords) pair, as "in
+<site>", or "" if there is none.
+'''
+def get_place_text(place, everything):
+    site_id, coords = place
+    if site_id is not None and site_id >= 0:
+        return "in " + get_site_name(site_id, everything)
+    if coords is not None:
+        site_id, site_name = get_site_data(coords, everything)
+        if site_id != -1:
+            return "in " + site_name
+    return ""
+
+#The same as FRAGMENT_KINDS, as plain text
+TEXT_FRAGMENT_KINDS = dict(FRAGMENT_KINDS,
+    hf=lambda hf_id, everything: get_hf_name(hf_id, everything),
+    entity=lambda entity_id, everything: get_ent_name(entity_id, everything),
+    site=lambda site_id, everything: "in " + get_site_name(site_id, everything),
+    site_name=lambda site_id, everything: get_site_name(site_id, everything),
+    artifact=lambda artifact_id, everything: get_name(artifact_id, 'artifacts', everything),
+    construction=lambda wc_id, everything: get_name(wc_id, 'world_constructions', everything),
+    region=lambda region_id, everything: get_name(region_id, 'regions', everything),
+    place=get_place_text,
+)
+
+#Kinds whose value is the id of an element; -1 means there is none
+ID_KINDS = {'hf', 'entity', 'site', 'site_name', 'artifact', 'construction', 'region'}
+
+TEMPLATE_FIELD = re.compile(r'\{(\w+)(?::(\w+))?\}')
 
-def remove_hf_entity_link(data, everything):
-    return "" + str(data)
+'''
+Compile a template into a function render(data, fragment) that returns
+the text of an event, or None if the event lacks one of the template's
+fields.
+'''
+def compile_template(template):
+    #literal strings, and (kind, field) pairs for the fields (then
+    #(kind, index in fields) pairs, see below)
+    parts = []
+    position = 0
+    for match in TEMPLATE_FIELD.finditer(template):
+        kind, field = match.groups()
+        if kind not in FRAGMENT_KINDS:
+            raise ValueError("Unknown field kind '" + kind + "' in template: " + template)
+        if (field is None) != (kind == 'place'):
+            raise ValueError("Bad field '" + match.group(0) + "' in template: " + template)
+        parts.append(template[position:match.start()])
+        parts.append((kind, field))
+        position = match.end()
+    parts.append(template[position:])
+    parts = [part for part in parts if part != ""]
+
+    #each field is read from the event once, in this order
+    fields = []
+    for i, part in enumerate(parts):
+        if isinstance(part, tuple) and part[1] is not None:
+            if part[1] not in fields:
+                fields.append(part[1])
+            parts[i] = (part[0], fields.index(part[1]))
+    id_fields = tuple(index for kind, index in (part for part in parts if isinstance(part, tuple))
+                      if kind in ID_KINDS)
+    parts = tuple(parts)
+
+    def render(data, fragment):
+        try:
+            values = [data[field] for field in fields]
+        except KeyError:
+            return None
+        for index in id_fields:
+            if not isinstance(values[index], int) or values[index] < 0:
+                return None
+        output = []
+        for part in parts:
+            if isinstance(part, str):
+                output.append(part)
+            elif part[0] == 'text':
+                output.append(str(values[part[1]]))
+            elif part[0] == 'place':
+                output.append(fragment('place', (data.get('site_id'), data.get('coords'))))
+            else:
+                output.append(fragment(part[0], values[part[1]]))
+        return "".join(output)
+
+    return render
 
-def replaced_structure(data, everything):
-    return "" + str(data)
+'''
+Compile the templates of an event type into one renderer, which returns
+None when no template fits the event.
+'''
+def compile_event_type(templates):
+    if isinstance(templates, str):
+        templates = [templates]
+    compiled = [compile_template(template) for template in templates]
 
-def site_abandoned(data, everything):
-    return "" + str(data)
+    def render(data, fragment):
+        for template in compiled:
+            text = template(data, fragment)
+            if text is not None:
+                return text
+        return None
 
-def site_died(data, everything):
-    return "" + str(data)
+    return render
 
-def site_taken_over(data, everything):
-    return "" + str(data)
-    
 #====>--HELPERS--<==== 
 
 '''
@@ -328,4 +363,11 @@ def grammarify_battle_verb(subtype):
                  "happen upon" : "happened upon",
                  "confront" : "confronted",
                  }
-    return corrected[subtype]
+    return corrected.get(subtype, subtype)
+
+#Each event type's templates, compiled once
+EVENT_RENDERERS = {event_type: compile_event_type(templates)
+                   for event_type, templates in EVENT_TEMPLATES.items()}
+
+#The string of each day of the year, see time_string
+DAY_STRINGS = [day_string(day * 1200) for day in range(336)]
@@ -0,0 +1,321 @@
+'''
+Columnar storage for historical events.
+
+Big worlds have millions of historical events, and a Python dict per
+event is most of the memory a loaded world uses. Instead, events are
+kept in one table per event type, and each table holds one column per
+field:
+
+    integer fields  -> array('i'), with a sentinel for missing values
+    text fields     -> array('I') of codes into a shared string table
+                       (type, cause, state, subtype, race...)
+    anything else   -> a plain list
+
+Indexing the store returns an EventView, a read-only mapping over one
+event's row, so code written against event dicts keeps working. Whole
+columns can also be scanned at once, by event type, year or participant.
+'''
+
+from array import array
+from collections.abc import Mapping
+
+#Marks a missing value in an integer column
+INT_MISSING = -2**31
+
+#Codes in a text column. 0 is a missing value and 1 is a tag with no text.
+CODE_MISSING = 0
+CODE_NONE = 1
+
+'''
+Marks a missing value in an object column. It pickles by name, so a
+store loaded from a snapshot still recognises it.
+'''
+class Missing():
+    def __reduce__(self):
+        return 'OBJECT_MISSING'
+
+    def __repr__(self):
+        return 'OBJECT_MISSING'
+
+OBJECT_MISSING = Missing()
+
+'''
+One column of an event table.
+kind is 'int', 'text' or 'object'.
+'''
+class Column():
+    __slots__ = ('kind', 'values')
+
+    def __init__(self, kind, values):
+        self.kind = kind
+        self.values = values
+
+'''
+The events of a single type. indices holds the store index of each row,
+and columns maps field names to Columns in the order the fields were
+first seen. The 'type' field is kept in the store, not in a column, so it
+maps to None.
+'''
+class EventTable():
+    __slots__ = ('indices', 'columns')
+
+    def __init__(self):
+        self.indices = array('I')
+        self.columns = {}
+
+'''
+A read-only view of one event's row, which behaves like the event's
+dictionary used to.
+'''
+class EventView(Mapping):
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.store.value(self.index, key)
+
+    def __iter__(self):
+        return self.store.fields(self.index)
+
+    #one pass over the row, rather than a lookup for each field
+    def items(self):
+        return list(self.store.items(self.index))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class EventStore():
+
+    def __init__(self):
+        #per event index: type code (0 for events that were not stored) and row in its table
+        self.types = array('H')
+        self.rows = array('I')
+
+        #type names and their tables, by type code
+        self.type_names = [None]
+        self.type_codes = {}
+        self.tables = [None]
+
+        #shared string table for text columns
+        self.strings = ['', None]
+        self.string_codes = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+        if self.types[index] == 0:
+            return None
+        return EventView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+
+    #==============BUILDING=============
+
+    '''
+    Add an event dictionary (or None, for events that are not stored) to
+    the end of the store.
+    '''
+    def append(self, event):
+        if event is None:
+            self.types.append(0)
+            self.rows.append(0)
+            return
+
+        type_code = self.type_codes.get(event['type'])
+        if type_code is None:
+            type_code = len(self.type_names)
+            self.type_codes[event['type']] = type_code
+            self.type_names.append(event['type'])
+            self.tables.append(EventTable())
+        table = self.tables[type_code]
+
+        row = len(table.indices)
+        self.types.append(type_code)
+        self.rows.append(row)
+        table.indices.append(len(self.types) - 1)
+
+        #fill every existing column, missing fields included
+        for name, column in table.columns.items():
+            if column is None:
+                continue
+            self.append_value(table, name, column, event.get(name, OBJECT_MISSING))
+
+        #new fields get a column of missing values for the earlier rows
+        for name, value in event.items():
+            if name == 'type':
+                table.columns.setdefault(name, None)
+            elif name not in table.columns:
+                column = self.new_column(value, row)
+                table.columns[name] = column
+                self.append_value(table, name, column, value)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    def new_column(self, value, num_rows):
+        if isinstance(value, int):
+            return Column('int', array('i', [INT_MISSING]) * num_rows)
+        if isinstance(value, str) or value is None:
+            return Column('text', array('I', [CODE_MISSING]) * num_rows)
+        return Column('object', [OBJECT_MISSING] * num_rows)
+
+    def append_value(self, table, name, column, value):
+        if column.kind == 'int':
+            if value is OBJECT_MISSING:
+                column.values.append(INT_MISSING)
+                return
+            if isinstance(value, int) and INT_MISSING < value < 2**31:
+                column.values.append(value)
+                return
+        elif column.kind == 'text':
+            if value is OBJECT_MISSING:
+                column.values.append(CODE_MISSING)
+                return
+            if isinstance(value, str) or value is None:
+                column.values.append(self.string_code(value))
+                return
+        else:
+            column.values.append(value)
+            return
+
+        #the value does not fit the column, so fall back to a list
+        self.make_object_column(column)
+        column.values.append(value)
+
+    def string_code(self, string):
+        if string is None:
+            return CODE_NONE
+        code = self.string_codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.string_codes[string] = code
+            self.strings.append(string)
+        return code
+
+    def make_object_column(self, column):
+        column.values = [self.column_value(column, row) for row in range(len(column.values))]
+        column.kind = 'object'
+
+    #==============ACCESS=============
+
+    '''
+    Return the value stored in a column for a row, or OBJECT_MISSING.
+    '''
+    def column_value(self, column, row):
+        value = column.values[row]
+        if column.kind == 'int':
+            return OBJECT_MISSING if value == INT_MISSING else value
+        if column.kind == 'text':
+            return OBJECT_MISSING if value == CODE_MISSING else self.strings[value]
+        return value
+
+    '''
+    Return one field of an event, raising KeyError if the event does
+    not have it.
+    '''
+    def value(self, index, key):
+        type_code = self.types[index]
+        if key == 'type':
+            return self.type_names[type_code]
+        column = self.tables[type_code].columns.get(key)
+        if column is not None:
+            value = self.column_value(column, self.rows[index])
+            if value is not OBJECT_MISSING:
+                return value
+        raise KeyError(key)
+
+    '''
+    Iterate over the names of the fields an event has.
+    '''
+    def fields(self, index):
+        table = self.tables[self.types[index]]
+        row = self.rows[index]
+        for name, column in table.columns.items():
+            if column is None or self.column_value(column, row) is not OBJECT_MISSING:
+                yield name
+
+    '''
+    Iterate over the (name, value) pairs of the fields an event has.
+    '''
+    def items(self, index):
+        type_code = self.types[index]
+        table = self.tables[type_code]
+        row = self.rows[index]
+        for name, column in table.columns.items():
+            if column is None:
+                yield name, self.type_names[type_code]
+                continue
+            value = self.column_value(column, row)
+            if value is not OBJECT_MISSING:
+                yield name, value
+
+    def event_type(self, index):
+        return self.type_names[self.types[index]]
+
+    #==============BULK SCANS=============
+
+    '''
+    Return the store indices of every event of a type, in file order.
+    '''
+    def indices_of_type(self, event_type):
+        type_code = self.type_codes.get(event_type)
+        if type_code is None:
+            return array('I')
+        return self.tables[type_code].indices
+
+    '''
+    Iterate over (index, value) for every event that has the given field.
+    Events are grouped by type, and in file order within each type.
+    '''
+    def scan(self, field):
+        for table in self.tables[1:]:
+            column = table.columns.get(field)
+            if column is None:
+                continue
+            for row, index in enumerate(table.indices):
+                value = self.column_value(column, row)
+                if value is not OBJECT_MISSING:
+                    yield index, value
+
+    '''
+    Return the sorted store indices of every event that happened between
+    first_year and last_year, inclusive.
+    '''
+    def indices_in_years(self, first_year, last_year):
+        found = array('I')
+        for index, year in self.scan('year'):
+            if first_year <= year <= last_year:
+                found.append(index)
+        return array('I', sorted(found))
+
+    '''
+    Return the sorted store indices of every event where one of the given
+    fields (e.g. ['hfid', 'slayer_hfid']) is element_id. If fields is None,
+    every integer field except id, year and seconds72 is checked.
+    '''
+    def indices_with_participant(self, element_id, fields=None):
+        found = set()
+        for table in self.tables[1:]:
+            for name, column in table.columns.items():
+                if column is None or column.kind != 'int':
+                    continue
+                if fields is None and name in ('id', 'year', 'seconds72'):
+                    continue
+                if fields is not None and name not in fields:
+                    continue
+                for row, value in enumerate(column.values):
+                    if value == element_id:
+                        found.add(table.indices[row])
+        return array('I', sorted(found))
@@ -0,0 +1,279 @@
+'''
+Full-text index of the historical events of a world.
+
+Each event is indexed under the words of its description (as rendered by
+its template in event_processing.py, in plain text) and of its text
+fields, such as its type, cause of death or state. For every word the
+index keeps the sorted ids of the events that contain it and how many
+times they do:
+
+    terms    word -> (event ids, counts)
+    lengths  number of words of each event, by event id - offset
+
+Queries are words, which must all be in an event, "quoted phrases", and
+-words that must not be; OR between parts of a query matches events that
+match either part. Results are ranked with BM25. Phrases are found by
+looking up their words, then checking the candidate events' text, so the
+index does not store word positions.
+
+The index is built when the world is loaded, in parallel, by forking worker
+processes that each render a range of events, and is saved in snapshots with
+the rest of the world, so reopening the world does not build it again. In
+lazy loading mode, or if event_text_index is off in legend_reader.cfg, it is
+built by the first event search instead, in that process, and is not saved.
+'''
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import math
+import multiprocessing
+import re
+import threading
+
+from event_processing import render_event_texts
+
+WORD = re.compile(r'\w+')
+
+#Events rendered by a worker at a time
+CHUNK_SIZE = 20000
+
+#BM25 parameters
+K1 = 1.2
+B = 0.75
+
+#The world being indexed, inherited by the forked worker processes
+INDEXED_WORLD = None
+
+#Held while an index is built on demand, so it is built once
+BUILD_LOCK = threading.Lock()
+
+'''
+Return the lower case words of a text.
+'''
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+'''
+Return the words of an event: those of its description, then those of its
+text fields. Text fields have few distinct values, so their words can be
+kept in field_words, a dict from value to words.
+'''
+def event_words(event, description, field_words=None):
+    words = tokenize(description)
+    for field, value in event.items():
+        if isinstance(value, str) and field != 'coords':
+            if field_words is None:
+                words.extend(tokenize(value))
+                continue
+            value_words = field_words.get(value)
+            if value_words is None:
+                value_words = tokenize(value)
+                field_words[value] = value_words
+            words.extend(value_words)
+    return words
+
+class EventTextIndex():
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.terms = {}
+        self.lengths = array('H')
+        self.num_events = 0
+        self.total_length = 0
+
+    '''
+    Add the postings of a range of events, which must come after the
+    events already in the index.
+    '''
+    def add_range(self, start, lengths, terms):
+        missing = start - self.offset - len(self.lengths)
+        self.lengths.extend(array('H', [0]) * missing)
+        self.lengths.extend(lengths)
+        self.num_events += sum(1 for length in lengths if length)
+        self.total_length += sum(lengths)
+        for word, (events, counts) in terms.items():
+            if word in self.terms:
+                self.terms[word][0].extend(events)
+                self.terms[word][1].extend(counts)
+            else:
+                self.terms[word] = (events, counts)
+
+    def events_with(self, word):
+        postings = self.terms.get(word)
+        return postings[0] if postings is not None else array('i')
+
+    '''
+    Return how many times a word is in an event.
+    '''
+    def count(self, word, event_id):
+        postings = self.terms.get(word)
+        if postings is None:
+            return 0
+        events, counts = postings
+        i = bisect_left(events, event_id)
+        if i == len(events) or events[i] != event_id:
+            return 0
+        return counts[i]
+
+    def score(self, words, event_id):
+        average_length = self.total_length / max(self.num_events, 1)
+        length = self.lengths[event_id - self.offset]
+        score = 0.0
+        for word in words:
+            count = self.count(word, event_id)
+            if count == 0:
+                continue
+            matching = len(self.events_with(word))
+            idf = math.log(1 + (self.num_events - matching + 0.5) / (matching + 0.5))
+            score += idf * count * (K1 + 1) / (count + K1 * (1 - B + B * length / average_length))
+        return score
+
+'''
+Index a range of events. Returns (start, lengths, terms) for
+EventTextIndex.add_range.
+'''
+def index_range(everything, start, end):
+    events = everything['historical_events']
+    offset = everything['historical_events_offset']
+    event_ids = [event_id for event_id in range(start, end) if events[event_id - offset] is not None]
+    descriptions = dict(zip(event_ids, render_event_texts(event_ids, everything)))
+
+    lengths = array('H', [0]) * (end - start)
+    terms = {}
+    field_words = {}
+    for event_id in event_ids:
+        words = event_words(events[event_id - offset], descriptions[event_id], field_words)
+        lengths[event_id - start] = min(len(words), 65535)
+        for word, count in Counter(words).items():
+            postings = terms.get(word)
+            if postings is None:
+                postings = (array('i'), array('B'))
+                terms[word] = postings
+            postings[0].append(event_id)
+            postings[1].append(count if count < 256 else 255)
+    return start, lengths, terms
+
+def index_range_worker(event_range):
+    return index_range(INDEXED_WORLD, event_range[0], event_range[1])
+
+'''
+Build the full-text index of the events of a world, with num_workers
+forked processes (or in this process if num_workers is 0, or if the
+platform can't fork).
+'''
+def build_event_text_index(everything, num_workers=0):
+    global INDEXED_WORLD
+    offset = max(everything.get('historical_events_offset', 0), 0)
+    index = EventTextIndex(offset)
+    if 'historical_events' not in everything:
+        return index
+
+    end = offset + len(everything['historical_events'])
+    ranges = [(start, min(start + CHUNK_SIZE, end)) for start in range(offset, end, CHUNK_SIZE)]
+
+    if num_workers > 0 and len(ranges) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        INDEXED_WORLD = everything
+        try:
+            with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+                for result in pool.imap(index_range_worker, ranges):
+                    index.add_range(*result)
+        finally:
+            INDEXED_WORLD = None
+    else:
+        for start, range_end in ranges:
+            index.add_range(*index_range(everything, start, range_end))
+    return index
+
+#==============QUERIES=============
+
+'''
+Parse a query into a list of alternatives (separated by OR), each a list
+of (words, excluded) parts. A part with several words is a phrase.
+'''
+def parse_query(query):
+    alternatives = [[]]
+    for match in re.finditer(r'(-?)"([^"]*)"?|(\S+)', query):
+        if match.group(3) == 'OR':
+            alternatives.append([])
+            continue
+        if match.group(3) is not None:
+            text = match.group(3)
+            excluded = text.startswith('-') and len(text) > 1
+            words = tokenize(text[1:] if excluded else text)
+        else:
+            excluded = match.group(1) == '-'
+            words = tokenize(match.group(2))
+        if words:
+            alternatives[-1].append((words, excluded))
+    return [parts for parts in alternatives if any(not excluded for _, excluded in parts)]
+
+'''
+Return True if the words of phrase follow each other in words.
+'''
+def contains_phrase(words, phrase):
+    for i in range(len(words) - len(phrase) + 1):
+        if words[i:i + len(phrase)] == phrase:
+            return True
+    return False
+
+'''
+Return the ids of the events that match one alternative of a query.
+'''
+def match_alternative(index, parts, everything):
+    required = [words for words, excluded in parts if not excluded]
+    #the rarest word first, so that the candidate set starts small
+    words = sorted({word for phrase in required for word in phrase},
+                   key=lambda word: len(index.events_with(word)))
+    candidates = set(index.events_with(words[0]))
+    for word in words[1:]:
+        if not candidates:
+            break
+        candidates.intersection_update(index.events_with(word))
+
+    for words, excluded in parts:
+        if excluded and len(words) == 1:
+            candidates.difference_update(index.events_with(words[0]))
+
+    phrases = [(words, excluded) for words, excluded in parts if len(words) > 1]
+    if phrases and candidates:
+        event_ids = sorted(candidates)
+        events = everything['historical_events']
+        offset = everything['historical_events_offset']
+        for event_id, description in zip(event_ids, render_event_texts(event_ids, everything)):
+            event = events[event_id - offset]
+            texts = [tokenize(description)] + [tokenize(value) for field, value in event.items()
+                                               if isinstance(value, str) and field != 'coords']
+            for words, excluded in phrases:
+                if any(contains_phrase(text, words) for text in texts) == excluded:
+                    candidates.discard(event_id)
+                    break
+    return candidates
+
+'''
+Return the (event id, score) pairs of the events that match a query, best
+first. At most limit results are returned, if limit is given.
+'''
+def search_events(query, everything, limit=None):
+    index = get_event_text_index(everything)
+    scores = {}
+    for parts in parse_query(query):
+        words = [word for phrase, excluded in parts if not excluded for word in phrase]
+        for event_id in match_alternative(index, parts, everything):
+            score = index.score(words, event_id)
+            if score > scores.get(event_id, -1.0):
+                scores[event_id] = score
+
+    results = sorted(scores.items(), key=lambda result: (-result[1], result[0]))
+    return results[:limit] if limit is not None else results
+
+'''
+Return the full-text index of a world, building it (in this process) the
+first time if it was not built when the world was loaded.
+'''
+def get_event_text_index(everything):
+    if everything.get('event_text_index') is None:
+        with BUILD_LOCK:
+            if everything.get('event_text_index') is None:
+                everything['event_text_index'] = build_event_text_index(everything)
+    return everything['event_text_index']
@@ -0,0 +1,206 @@
+'''
+Secondary indexes on the categorical fields of figures, sites and entities,
+for searches like "race:dwarf associated_type:vampire" or "type:tower".
+
+For every indexed (section, field), the index keeps the sorted ids of the
+elements with each value of the field, and of all the elements that have
+the field at all (deity, for one, is a flag without a value):
+
+    values   (section, field) -> {value: array of ids}
+    present  (section, field) -> array of ids
+
+Values are lower case, with underscores for spaces, so that a value is one
+word of a query: "type:dark_fortress". A facet with no value, like
+"deity:", matches the elements that have the field. The facets of a query
+must all hold, so their id arrays are intersected, smallest first, and the
+rest of the query is a name substring the elements' names must contain.
+
+In lazy loading mode the index is built by the first faceted search, on the
+search thread, since building it reads every figure, site and entity.
+'''
+
+from array import array
+import threading
+
+from attribute_getters import get_name
+from name_index import normalize_name
+from name_search import intersect
+
+#Facet names, and the (section, field) each one is an index of
+FACET_FIELDS = {'race': [('historical_figures', 'race'), ('entities', 'race')],
+                'caste': [('historical_figures', 'caste')],
+                'deity': [('historical_figures', 'deity')],
+                'associated_type': [('historical_figures', 'associated_type')],
+                'sphere': [('historical_figures', 'sphere')],
+                'type': [('sites', 'type'), ('entities', 'type')]}
+
+#Sections with facets, in the order their results are listed
+FACET_SECTIONS = ['historical_figures', 'sites', 'entities']
+
+#Held while a facet index is built on demand, so it is built once
+BUILD_LOCK = threading.Lock()
+
+'''
+Return the form of a value used as an index key.
+'''
+def normalize_value(value):
+    return '_'.join(str(value).lower().split())
+
+'''
+Return the values of a field of an element, as a tuple. Figures can have
+several spheres, and a flag field has the single value None.
+'''
+def field_values(element, field):
+    if field == 'sphere' and hasattr(element, 'spheres'):
+        return element.spheres or ()
+    if field not in element:
+        return ()
+    return (element[field],)
+
+class FacetIndex():
+
+    def __init__(self):
+        self.values = {}
+        self.present = {}
+
+    '''
+    Index an element of a section, which must have a higher id than the
+    elements of the section already in the index.
+    '''
+    def add(self, section, an_id, element):
+        for fields in FACET_FIELDS.values():
+            for fields_section, field in fields:
+                if fields_section != section:
+                    continue
+                values = field_values(element, field)
+                if not values:
+                    continue
+                key = (section, field)
+                self.present.setdefault(key, array('i')).append(an_id)
+                value_ids = self.values.setdefault(key, {})
+                for value in set(values):
+                    if value is not None:
+                        value_ids.setdefault(normalize_value(value), array('i')).append(an_id)
+
+    '''
+    Return the sorted ids of the elements of a section with a value of a
+    field, or that have the field if value is empty.
+    '''
+    def ids(self, section, field, value):
+        if not value:
+            return self.present.get((section, field), array('i'))
+        return self.values.get((section, field), {}).get(normalize_value(value), array('i'))
+
+    '''
+    Return the sorted values of a facet, e.g. every race in the world.
+    '''
+    def facet_values(self, facet):
+        values = set()
+        for key in FACET_FIELDS[facet]:
+            values.update(self.values.get(key, {}))
+        return sorted(values)
+
+    '''
+    Return the sorted ids of the elements of a section that match every
+    (facet, value) pair, or None if a facet does not apply to the section.
+    '''
+    def matching_ids(self, section, facets):
+        id_arrays = []
+        for facet, value in facets:
+            fields = [field for fields_section, field in FACET_FIELDS[facet] if fields_section == section]
+            if not fields:
+                return None
+            id_arrays.append(self.ids(section, fields[0], value))
+        id_arrays.sort(key=len)
+        ids = id_arrays[0]
+        for other_ids in id_arrays[1:]:
+            if not ids:
+                break
+            ids = intersect(ids, other_ids)
+        return ids
+
+'''
+Build the facet index of a world.
+'''
+def build_facet_index(everything):
+    index = FacetIndex()
+    for section in FACET_SECTIONS:
+        if section not in everything:
+            continue
+        offset = everything[section + '_offset']
+        #a lazy section parses its elements without caching them
+        for i, element in enumerate(everything[section]):
+            if element is not None:
+                index.add(section, i + offset, element)
+    return index
+
+'''
+Return the facet index of a world, building it the first time if it was
+not built when the world was loaded.
+'''
+def get_facet_index(everything):
+    if everything.get('facet_index') is None:
+        with BUILD_LOCK:
+            if everything.get('facet_index') is None:
+                everything['facet_index'] = build_facet_index(everything)
+    return everything['facet_index']
+
+#==============QUERIES=============
+
+'''
+Split a query into its (facet, value) pairs and the rest of its text, e.g.
+'race:dwarf urist' into ([('race', 'dwarf')], 'urist'). Words with a colon
+that are not facets are left in the text.
+'''
+def parse_facets(query):
+    facets = []
+    words = []
+    for word in query.split():
+        facet, colon, value = word.partition(':')
+        if colon and facet.lower() in FACET_FIELDS:
+            facets.append((facet.lower(), value))
+        else:
+            words.append(word)
+    return facets, ' '.join(words)
+
+'''
+Return the (type, id) of the elements that match every facet and whose
+name contains text, by section then id.
+'''
+def search_facets(facets, text, everything):
+    index = get_facet_index(everything)
+    text = normalize_name(text)
+    results = []
+    for section in FACET_SECTIONS:
+        if section not in everything:
+            continue
+        ids = index.matching_ids(section, facets)
+        if not ids:
+            continue
+        if text:
+            names = everything.get(section + '_names', {})
+            ids = [an_id for an_id in ids if text in normalize_name(names.get(an_id, ''))]
+        results.extend((section, an_id) for an_id in ids)
+    return results
+
+'''
+Return a page of the results of a search bar query, like
+NameSearchIndex.search_elements: (name, type, id) rows and whether there
+are more. A query with facets pages through elements rather than names.
+'''
+def search_elements(text, count, start, everything, cancelled=None):
+    facets, name_text = parse_facets(text)
+    if not facets:
+        return everything['name_search'].search_elements(text, count, start, cancelled)
+
+    matches = search_facets(facets, name_text, everything)
+    if cancelled is not None and cancelled():
+        return None
+    results = []
+    for a_type, an_id in matches[start:start + count]:
+        try:
+            name = get_name(an_id, a_type, everything)
+        except KeyError:
+            name = "Unnamed"
+        results.append((name, a_type, an_id))
+    return results, len(matches) > start + count
@@ -2,3 +2,17 @@ import os
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 RESOURCES_DIR = os.path.join(ROOT_DIR, 'resources')
+
+#Maps the tag of each kind of element to the tag of the top-level
+#section that holds them
+TAG_MAP = {'region': 'regions', \
+           'underground_region': 'underground_regions', \
+           'site': 'sites', \
+           'world_construction': 'world_constructions', \
+           'artifact':'artifacts', \
+           'historical_figure': 'historical_figures', \
+           'entity_population': 'entity_populations',\
+           'entity': 'entities',\
+           'historical_event': 'historical_events',\
+           'historical_event_collection': 'historical_event_collections',\
+           'historical_era':'historical_eras'}
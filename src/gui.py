@@ -3,10 +3,9 @@
 # Created: Sun Jul 28 18:59:29 2013
 #      by: pyside-uic 0.2.14 running on PySide 1.2.0
 
-import sys, os
-from link_creator import get_name_from_page_id
-import page_builders
-import xml_parsing
+import sys, os, json
+from link_creator import get_name_from_page_id, EVENT_SLICE_CODE
+from world import World
 from global_vars import *
 from PySide import QtCore, QtGui, QtWebKit
 from random import randint
@@ -15,8 +14,8 @@ from gui.SearchBar import SearchBar
 
 class UI(object):
     def setupUi(self, main_window):
-        #Dictionary has not been loaded yet.
-        self.everything = None
+        #World has not been loaded yet.
+        self.world = World(None)
 
         #Main window creation
         main_window.resize(800, 600)
@@ -52,6 +51,7 @@ class UI(object):
         #page_history will be a list of (int, list)s, where the tuple index
         #corresponds to the tab index (each tab has its own history), and the
         #int in the tuple is the current pointer in the history array for that tab.
+        #The history array holds (page link, number of event slices shown) tuples.
         self.page_history = []
 
         #Search bar
@@ -111,28 +111,41 @@ class UI(object):
             page_link = page_link.toString()
         except:
             pass
+        #"More events" links add to the current page instead
+        if page_link.startswith(EVENT_SLICE_CODE):
+            self.load_more_events(page_link)
+            return
         #Append the page to the page history
         current_index = self.tab_widget.currentIndex()
         historytuple = self.page_history[current_index]
         #slice off the page history list according to the history pointer, advance the pointer,
         #and add the new page link to the history list.
         new_history_list = historytuple[1][:historytuple[0] + 1]
-        new_history_list.append(page_link)
+        new_history_list.append((page_link, 1))
         self.page_history[current_index]=(historytuple[0] + 1, new_history_list)
         self.open_in_current_tab(page_link, tab_name)
 
-    def open_in_current_tab(self, page_link, tab_name = None):
+    def open_in_current_tab(self, page_link, tab_name = None, slices = 1):
         try:
             page_link = page_link.toString()
         except:
             pass
-        html = page_builders.dispatch_link(page_link, self.everything)
+        html = self.world.render(page_link, slices)
         self.tab_widget.currentWidget().setHtml(html)
         
         if tab_name == None:
-            tab_name = get_name_from_page_id(page_link, self.everything)
+            tab_name = get_name_from_page_id(page_link, self.world.everything)
         self.tab_widget.setTabText(self.tab_widget.currentIndex(), tab_name)
 
+    def load_more_events(self, slice_link):
+        html = self.world.render_event_slice(slice_link)
+        frame = self.tab_widget.currentWidget().page().mainFrame()
+        frame.evaluateJavaScript("append_events(" + json.dumps(html) + ");")
+        #Remember the shown slices, so going back to the page shows them again
+        pointer, history_list = self.page_history[self.tab_widget.currentIndex()]
+        page_link, slices = history_list[pointer]
+        history_list[pointer] = (page_link, slices + 1)
+
     def open_in_new_tab(self, page_link, tab_name):
         try:
             #If it is a URL object, convert to a string first.
@@ -145,8 +158,8 @@ class UI(object):
         self.handle_webview_events(next_tab)
         #Append a new QWebView to the browser array.
         #Set this page's HTML.
-        next_tab.setHtml(page_builders.dispatch_link(page_link, self.everything))
-        self.page_history.append((0,[page_link]))
+        next_tab.setHtml(self.world.render(page_link))
+        self.page_history.append((0,[(page_link, 1)]))
         
         self.tab_widget.addTab(next_tab, tab_name)
 
@@ -172,7 +185,7 @@ class UI(object):
         global_pos = self.tab_widget.currentWidget().mapToGlobal(pos)
 
         self.right_click_menu = QtGui.QMenu(self.tab_widget.currentWidget())
-        if not self.hit_url.isEmpty():
+        if not self.hit_url.isEmpty() and not self.hit_url.toString().startswith(EVENT_SLICE_CODE):
             self.right_click_menu.addAction(self.action_openinnewtab)
         self.right_click_menu.popup(global_pos) 
 
@@ -192,7 +205,7 @@ class UI(object):
             self.tab_widget.removeTab(index)
 
     def on_click_openinnewtab(self):
-        tab_name = get_name_from_page_id(self.hit_url.toString(), self.everything)
+        tab_name = get_name_from_page_id(self.hit_url.toString(), self.world.everything)
         self.open_in_new_tab(self.hit_url, tab_name)
         
     def on_click_backbutton(self):
@@ -201,7 +214,8 @@ class UI(object):
         newtuple = (new_pointer_val, current_tuple[1])
         if(newtuple[0] >= 0):
             self.page_history[self.tab_widget.currentIndex()] = newtuple
-            self.open_in_current_tab(newtuple[1][newtuple[0]])
+            page_link, slices = newtuple[1][newtuple[0]]
+            self.open_in_current_tab(page_link, slices = slices)
             
     def on_click_forwardbutton(self):
         current_tuple = self.page_history[self.tab_widget.currentIndex()]
@@ -209,7 +223,8 @@ class UI(object):
         newtuple = (new_pointer_val, current_tuple[1])
         if(newtuple[0] < len(current_tuple[1])):
             self.page_history[self.tab_widget.currentIndex()] = newtuple
-            self.open_in_current_tab(newtuple[1][newtuple[0]])
+            page_link, slices = newtuple[1][newtuple[0]]
+            self.open_in_current_tab(page_link, slices = slices)
 
     def on_open_file_dialog(self):
         self.file_dialog = QtGui.QFileDialog()
@@ -220,22 +235,19 @@ class UI(object):
         self.page_history = []
         selected = self.file_dialog.selectedFiles()[0]
         
-        try:
-            self.everything = xml_parsing.load_dict(selected)
-        except Exception as e:
-            self.everything = None
-            
-        if self.everything == None:
-            new_selected = xml_parsing.handle_invalid_file(selected)
-            self.everything = xml_parsing.load_dict(new_selected)
+        self.world = World.load(selected)
             
         self.page_history.append((-1,[]))
         self.open_in_current_tab_with_history('hif6666')
-        self.search_bar.load_name_list(self.everything)
-
-app = QtGui.QApplication(sys.argv)
-wid = QtGui.QMainWindow()
-window = UI()
-window.setupUi(wid)
-wid.show()
-sys.exit(app.exec_())
+        self.search_bar.load_name_list(self.world.everything)
+
+def main():
+    app = QtGui.QApplication(sys.argv)
+    wid = QtGui.QMainWindow()
+    window = UI()
+    window.setupUi(wid)
+    wid.show()
+    sys.exit(app.exec_())
+
+if __name__ == '__main__':
+    main()
@@ -2,62 +2,58 @@
 from PySide import QtCore, QtGui, QtWebKit
 from attribute_getters import *
 from link_creator import *
-from gui.SearchBar_Worker import *
-from multiprocessing import Pool, cpu_count
+from gui.SearchResultModel import SearchResultModel
+from search_service import SearchService
 
 class SearchBar(QtGui.QLineEdit):
+    #results of the search service, sent from its thread: generation,
+    #text, first name of the page, (name, type, id) rows, whether there
+    #are more
+    results_ready = QtCore.Signal(int, str, int, object, bool)
+
     def __init__(self, main_window, open_fcn):
         QtGui.QLineEdit.__init__(self, "", main_window)
-        self.autocomplete = QtGui.QListWidget(self)
+        #only the best results are shown, more are fetched
+        #a page at a time when the list is scrolled down
+        self.results_per_page = 100
+        self.results = SearchResultModel(self, self.results_per_page)
+        self.autocomplete = QtGui.QListView(self)
+        self.autocomplete.setModel(self.results)
         self.autocomplete.hide()
 
-        #create pool for worker processes
-        #create pool with num CPUs minus one if available
-        if cpu_count() > 1:
-            self.pool_size = cpu_count() -1
-        else:
-            self.pool_size = cpu_count()
-            
-        #worker pool to handle search queries
-        self.pool = Pool(self.pool_size)
-        
         #set the fcn to open links in the main GUI
         self.open_fcn = open_fcn
         
-        #fast typing should only send one search query
+        #fast typing should only send one search query:
+        #the timer restarts on every keystroke
         #string to search for
-        self.search_grace_period = 0.4
+        self.search_grace_period = 150
         self.search_text = ''
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.search_grace_period)
+        self.search_timer.timeout.connect(self.send_search_command)
         
-        #this process will handle waiting for the grace period
-        self.wait_thread = None
-        self.wait_thread_running = False
+        #searches the names in a background thread,
+        #created when a world is loaded
+        self.search_service = None
+        self.results_ready.connect(self.show_results)
         
-        #create the object to handle searching
-        self.worker = SearchBar_Worker(self.search_grace_period)
-        
-    #kill pool when this object is destroyed
+    #stop the search thread when this object is destroyed
     def __del__(self):
-        self.pool.terminate()
-        self.wait_thread.terminate()
+        if self.search_service is not None:
+            self.search_service.stop()
         
     def load_name_list(self, everything):
         #need everything for tab creation
         self.everything = everything
         
-        self.name_list = []
-        for tag in everything.keys():
-            if not tag.endswith("_names"):
-                continue
-                
-            #this is mapping from id->name
-            #so grab all the names
-            for name in everything[tag].values():
-                self.name_list.append(name.lower())
-               
-        self.name_list.sort()
-       
-        self.worker.load_name_list(self.name_list)
+        #search indexes of the names and facets, built when the world was loaded
+        if self.search_service is not None:
+            self.search_service.stop()
+        self.search_service = SearchService(everything, self.results_ready.emit, self.results_per_page)
+        #the model fetches more results through the service too
+        self.results.load_world(self.search_service)
         
         self.load_autocomplete()
     
@@ -70,61 +66,58 @@ class SearchBar(QtGui.QLineEdit):
 
         #set watchers
         self.textChanged.connect(self.textWatcher)
-        self.autocomplete.itemDoubleClicked.connect(self.clickWatcher)
+        self.autocomplete.doubleClicked.connect(self.clickWatcher)
 
     def textWatcher(self, text):
         self.search_text = text.lower()
         
-        self.autocomplete.clear()
+        self.results.clear()
         
-        if self.wait_thread_running:
-            self.wait_thread.terminate()
+        #nothing to search before a world is loaded
+        if self.search_service is None:
+            return
+        
+        #results of the previous text are no longer wanted
+        self.search_service.cancel()
+        self.search_timer.stop()
             
         if len(self.search_text) == 0:
             self.autocomplete.hide()
             return
 
-        #start a new Process that will callback when the grace period is over
-        #cannot be done with a Timer (which does the callback in the child thread)
-        self.wait_thread = Pool(1)
-        self.wait_thread.apply_async(self.worker.wait_for_timeout, callback = self.send_search_command)
-        self.wait_thread_running = True
+        #search when the grace period is over
+        self.search_timer.start()
         
         #move and make visible
         self.autocomplete.move(self.mapToGlobal(QtCore.QPoint(0, self.height())))
         if not self.autocomplete.isVisible():
             self.autocomplete.show()
 
-    def send_search_command(self, dummy):
-        
-        #stop the waiting process
-        self.wait_thread_running = False
-        self.wait_thread.terminate()
-        
+    def send_search_command(self):
         if len(self.search_text) == 0:
             return
             
-        #send commands to search the name array
-        for i in range(0, self.pool_size):
-            self.pool.apply_async(self.worker.search, args = (self.search_text, i, self.pool_size), callback = self.addItem)
-        
+        self.search_service.submit(self.search_text)
 
-    #actually add items to the list
-    #this is a bottleneck
-    #but the list can't be pickled and sent to
-    #the processes, so I don't have a better idea
-    def addItem(self, names_found):
-        for name in names_found:
-            self.autocomplete.addItem(name)
+    #called in the GUI thread. results of a query that was
+    #superseded while they were on their way are dropped
+    def show_results(self, generation, text, start, results, more):
+        if not self.search_service.is_current(generation):
+            return
+        #the view only asks the model for the rows it shows
+        if start == 0:
+            self.results.set_results(generation, text, results, more)
+        else:
+            self.results.add_results(generation, start, results, more)
             
-    #tell GUI to open page for this name
-    def select(self, selected_name):
+    #tell GUI to open page for the element of this row
+    def select(self, row):
         self.autocomplete.hide()
-        element_link = create_page_id(selected_name, self.everything)
-        self.open_fcn(element_link, selected_name)
+        name, a_type, an_id = self.results.result(row)
+        self.open_fcn(link_mapper[a_type] + str(an_id), name)
         
-    def clickWatcher(self, item):
-        self.select(item.text())
+    def clickWatcher(self, index):
+        self.select(index.row())
         
     def focusOutEvent(self, event):
         self.autocomplete.hide()
@@ -151,8 +144,7 @@ class SearchBar(QtGui.QLineEdit):
             
         elif key == QtCore.Qt.Key_Return or key == QtCore.Qt.Key_Return:
             if self.autocomplete.currentIndex().isValid():
-                selected_name = self.autocomplete.currentIndex().data()
-                self.select(selected_name)
+                self.select(self.autocomplete.currentIndex().row())
             
         else:
             #pass the key event through to parent
@@ -0,0 +1,88 @@
+from PySide import QtCore
+
+#the results of a search, for the list under the search bar.
+#rows are (name, type, id) tuples from facet_index.search_elements,
+#and only a page of them is fetched at a time: the view asks for
+#more (fetchMore) when it is scrolled to the end, and the next page
+#is searched by the search service, so the GUI never waits for it
+class SearchResultModel(QtCore.QAbstractListModel):
+
+    def __init__(self, parent, results_per_page):
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.results_per_page = results_per_page
+        self.search_service = None
+        self.generation = 0
+        self.text = ''
+        self.results = []
+        #names fetched so far, whether there are more, and whether
+        #the next page was asked for and has not arrived yet
+        self.names_fetched = 0
+        self.more = False
+        self.fetching = False
+
+    def load_world(self, search_service):
+        self.search_service = search_service
+
+    #show the first page of the results for text, as searched
+    #by the search service for the query of that generation
+    def set_results(self, generation, text, results, more):
+        self.beginResetModel()
+        self.generation = generation
+        self.text = text
+        self.results = results
+        self.more = more
+        self.fetching = False
+        self.names_fetched = self.results_per_page
+        self.endResetModel()
+
+    #add the next page of the results, unless they are not
+    #the page asked for (the results changed meanwhile)
+    def add_results(self, generation, start, results, more):
+        if generation != self.generation or start != self.names_fetched:
+            return
+        self.names_fetched += self.results_per_page
+        self.more = more
+        self.fetching = False
+        if not results:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.results), len(self.results) + len(results) - 1)
+        self.results.extend(results)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.text = ''
+        self.results = []
+        self.names_fetched = 0
+        self.more = False
+        self.fetching = False
+        self.endResetModel()
+
+    #(name, type, id) of a row
+    def result(self, row):
+        return self.results[row]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.results)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.results):
+            return None
+        name, a_type, an_id = self.results[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return name
+        #several elements can have the same name
+        if role == QtCore.Qt.ToolTipRole:
+            return a_type.replace('_', ' ')
+        return None
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.more and not self.fetching
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent) or self.search_service is None:
+            return
+        self.fetching = True
+        self.search_service.fetch_more(self.generation, self.text, self.names_fetched)
@@ -1,3 +1,5 @@
+import collections
+
 '''
 Capitalize a string using common English convention.
 '''
@@ -8,3 +10,62 @@ def capitalize(string):
             words[i] = words[i].capitalize()
     
     return ' '.join(words)
+
+'''
+A dictionary that holds at most maxsize entries, dropping the least
+recently used one when full. Counts hits and misses so the cache
+size can be tuned.
+
+If sizeof is given, maxsize is a limit on the total sizeof(value) of the
+entries instead, e.g. LRUCache(2**20, sys.getsizeof) holds at most a
+megabyte of values. A value larger than maxsize is not cached at all.
+'''
+class LRUCache():
+
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.size -= self.entry_size(self.entries.pop(key))
+        size = self.entry_size(value)
+        if size > self.maxsize:
+            return
+        self.entries[key] = value
+        self.size += size
+        while self.size > self.maxsize:
+            _, dropped = self.entries.popitem(last=False)
+            self.size -= self.entry_size(dropped)
+
+    def entry_size(self, value):
+        return 1 if self.sizeof is None else self.sizeof(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,273 @@
+'''
+Lazy loading of legends exports.
+
+Most sessions only look at a few hundred pages, so in lazy mode nothing
+is materialized up front. A quick first pass over the memory-mapped file
+records, for every element, the byte offset where it starts, along with
+the names needed for searching and the elements each event refers to.
+Each section then becomes a LazySection, which parses an element from
+the mapped file the first time it is indexed and keeps it in a bounded
+cache.
+'''
+
+from array import array
+import mmap
+import re
+import threading
+from xml.sax.saxutils import unescape
+
+from dict_loading import load_element, new_everything, wrap_bytes, UNIMPLEMENTED_EVENT_TYPES
+from global_vars import TAG_MAP
+from helpers import LRUCache
+from participant_index import EventEdges, PARTICIPANT_FIELDS, structure_key
+from section_scan import find_sections
+from spatial_index import COORDS_SECTIONS
+from timeline import event_key, NO_KEY
+from xml_stream import transcode
+
+#XML entities that may appear in names, besides the standard ones
+ENTITIES = {'&apos;': "'", '&quot;': '"'}
+
+#Marks a cache miss, since None is a valid (unloaded) element
+NOT_CACHED = object()
+
+'''
+The export file, mapped into memory once and shared by all the lazy
+sections of a world.
+'''
+class MappedFile():
+
+    def __init__(self, filename, encoding):
+        self.filename = filename
+        self.encoding = encoding
+        with open(filename, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+'''
+A list-like section of elements that are parsed from the mapped file on
+first use. starts holds the byte offset of each element, and an element
+runs until the next one starts, or to the end of the section.
+
+Sections are shared by the GUI and the search thread, so the cache is
+only used under the section's lock.
+'''
+class LazySection():
+
+    def __init__(self, upper_level_tag, mapped_file, starts, end, cache_size, quarantine):
+        self.upper_level_tag = upper_level_tag
+        self.mapped_file = mapped_file
+        self.starts = starts
+        self.end = end
+        self.cache = LRUCache(cache_size)
+        self.quarantine = quarantine
+        #indexes of the elements whose problems are in the quarantine
+        self.quarantined = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError(index)
+
+        with self.lock:
+            element = self.cache.get(index, NOT_CACHED)
+        if element is NOT_CACHED:
+            element = self.load(index)
+            with self.lock:
+                self.cache.put(index, element)
+        return element
+
+    '''
+    Iterate over every element, e.g. to build an index. The elements are
+    parsed without going through the cache, which would otherwise only
+    end up holding the last elements of the section.
+    '''
+    def __iter__(self):
+        for index in range(len(self.starts)):
+            yield self.load(index)
+
+    '''
+    Parse the element at the given index from the mapped file.
+    '''
+    def load(self, index):
+        start = self.starts[index]
+        if index + 1 < len(self.starts):
+            end = self.starts[index + 1]
+        else:
+            end = self.end
+
+        element_string = wrap_bytes(self.upper_level_tag, self.mapped_file.mapped[start:end],
+                                    self.mapped_file.encoding)
+        _, _, elements, _, quarantine = load_element(element_string, self.upper_level_tag)
+        #an element can be parsed many times, but is quarantined once
+        if quarantine:
+            with self.lock:
+                if index not in self.quarantined:
+                    self.quarantined.add(index)
+                    self.quarantine.extend(quarantine)
+
+        if not elements:
+            return None
+        return elements[0]
+
+'''
+Decode a name found by the first pass.
+'''
+def decode_name(raw_name, encoding):
+    return unescape(transcode(raw_name, encoding).decode('utf-8'), ENTITIES)
+
+'''
+Index the elements of a section. Returns an array of the byte offsets
+where elements start, the section offset (the first element's id), a
+dict mapping element ids to names and, for the sections in
+COORDS_SECTIONS, a dict mapping element ids to their coords string.
+'''
+def index_elements(mapped, lower_level_tag, start, end, encoding):
+    with_coords = TAG_MAP[lower_level_tag] in COORDS_SECTIONS
+    pattern = re.compile(rb'<' + lower_level_tag.encode() + rb'>(?:\s*<id>(-?\d+)</id>)?'
+                         rb'|<(name|animated_string)>([^<]*)</\2>'
+                         + (rb'|<coords>([^<]*)</coords>' if with_coords else b''))
+
+    starts = array('q')
+    names_dict = {}
+    coords_dict = {} if with_coords else None
+    offset = -1
+
+    element_id = -1
+    name_found = True
+    coords_found = True
+    for match in pattern.finditer(mapped, start, end):
+        if with_coords and match.lastindex == 4:
+            #only the element's own coords, not those of a nested tag
+            if not coords_found:
+                coords_dict[element_id] = match.group(4).decode('ascii', 'replace')
+                coords_found = True
+        elif match.group(2) is None:
+            #start of an element
+            starts.append(match.start())
+            #an element without an id is the one after the previous
+            element_id = int(match.group(1)) if match.group(1) is not None else element_id + 1
+            if offset == -1:
+                offset = element_id
+            name_found = False
+            coords_found = False
+        elif not name_found and match.group(3):
+            #the element's own name, not one of a nested tag. animated_string
+            #is only used by figures without a name.
+            names_dict[element_id] = decode_name(match.group(3), encoding)
+            name_found = (match.group(2) == b'name')
+
+    return starts, offset, names_dict, coords_dict
+
+'''
+Index the historical events section. Returns an array of the byte offsets
+where events start, the section offset and the timeline key of each event
+(see timeline.py), and adds the edges from each event's participants to
+the event to the participant index.
+'''
+def index_events(mapped, start, end, participant_index):
+    fields = [field.encode() for field in PARTICIPANT_FIELDS if field != 'coords']
+    unimplemented = {event_type.encode() for event_type in UNIMPLEMENTED_EVENT_TYPES}
+
+    pattern = re.compile(rb'<historical_event>\s*<id>(-?\d+)</id>'
+                         rb'|<type>([^<]*)</type>'
+                         rb'|<(' + b'|'.join(fields) + rb')>(-?\d+)</\3>'
+                         rb'|<coords>(-?\d+),(-?\d+)</coords>'
+                         rb'|<(year|seconds72)>(-?\d+)</\7>')
+
+    starts = array('q')
+    keys = array('q')
+    offset = -1
+    edges = EventEdges()
+
+    #Structures are keyed by their site, and events are only linked by
+    #their coordinates if they have no site, but the site may come after
+    #either, so both are added once the whole event has been seen.
+    event = {'id': None, 'skip': True, 'site_id': None, 'structure_id': None, 'coords': None,
+             'year': None, 'seconds72': None}
+
+    def finish_event():
+        if event['id'] is None:
+            return
+        if event['skip']:
+            keys.append(NO_KEY)
+            return
+        keys.append(event_key(event['year'], event['seconds72']))
+        if event['structure_id'] is not None and event['site_id'] is not None:
+            edges.add('structure_id', structure_key(event['site_id'], event['structure_id']), event['id'])
+        if event['coords'] is not None and event['site_id'] is None:
+            edges.add_coordinates(event['id'], event['coords'][0], event['coords'][1])
+
+    for match in pattern.finditer(mapped, start, end):
+        if match.group(1) is not None:
+            finish_event()
+            starts.append(match.start())
+            event_id = int(match.group(1))
+            if offset == -1:
+                offset = event_id
+            event = {'id': event_id, 'skip': False, 'site_id': None, 'structure_id': None, 'coords': None,
+                     'year': None, 'seconds72': None}
+        elif match.group(2) is not None:
+            #unimplemented events are not loaded, so don't link them
+            event['skip'] = match.group(2) in unimplemented
+        elif event['skip']:
+            continue
+        elif match.group(7) is not None:
+            value = int(match.group(8))
+            if value != -1:
+                event[match.group(7).decode()] = value
+        elif match.group(5) is not None:
+            coords = (int(match.group(5)), int(match.group(6)))
+            if coords != (-1, -1):
+                event['coords'] = coords
+        else:
+            element_id = int(match.group(4))
+            if element_id == -1:
+                continue
+            field = match.group(3).decode()
+            if field == 'structure_id':
+                event['structure_id'] = element_id
+                continue
+            if field == 'site_id':
+                event['site_id'] = element_id
+            edges.add(field, element_id, event['id'])
+    finish_event()
+
+    participant_index.add_edges(edges)
+    return starts, offset, keys
+
+'''
+Build the everything dict for lazy mode, with a LazySection for each
+top-level section. The participant edges are collected but not grouped
+yet, which parse_historical_events does just as after an eager load.
+'''
+def index_file(filename, encoding, cache_size):
+    mapped_file = MappedFile(filename, encoding)
+    mapped = mapped_file.mapped
+
+    everything = new_everything()
+    lower_level_tags = {upper: lower for lower, upper in TAG_MAP.items()}
+
+    for upper_level_tag, start, end in find_sections(mapped):
+        if upper_level_tag == 'historical_events':
+            starts, offset, everything['event_keys'] = index_events(mapped, start, end,
+                                                                     everything['participant_index'])
+            names_dict = {}
+        else:
+            starts, offset, names_dict, coords_dict = index_elements(mapped, lower_level_tags[upper_level_tag],
+                                                                     start, end, encoding)
+            #read by the spatial indexes, so that they do not parse every
+            #site and region
+            if coords_dict is not None:
+                everything[upper_level_tag + "_coords"] = coords_dict
+
+        everything[upper_level_tag] = LazySection(upper_level_tag, mapped_file, starts, end,
+                                                  cache_size, everything['quarantine'])
+        everything[upper_level_tag + "_names"] = names_dict
+        everything[upper_level_tag + "_offset"] = offset
+
+    return everything
@@ -17,6 +17,21 @@ link_mapper = {
                'historical_eras':'era'
                }
                         
+#The section of each page code
+page_types = {code: section for section, code in link_mapper.items() if code}
+
+#Code of the links that load more of an element's events into its page,
+#see create_more_events_link
+EVENT_SLICE_CODE = 'evl'
+
+#CSS classes of links to other kinds of element
+link_classes = {
+                'sites': 'site-link',
+                'artifacts': 'artifact-link',
+                'regions': 'region-link',
+                'world_constructions': 'construction-link',
+                }
+
 '''
 Given a name of something in the world, will return a properly-
 formatted page link.
@@ -37,11 +52,30 @@ def get_name_from_page_id(page_link, everything):
     element_id = int(page_link[3:])
     return get_name(element_id, element_type, everything)
     
+'''
+Return the cached HTML link to an element, building it with
+build_link(an_id, everything) if it is not cached. Links are kept in a
+bounded LRU cache of the world's display cache.
+'''
+def get_cached_link(code, an_id, build_link, everything):
+    cache = everything.get('display_cache')
+    if cache is None:
+        return build_link(an_id, everything)
+    key = (code, an_id)
+    link = cache.links.get(key)
+    if link is None:
+        link = build_link(an_id, everything)
+        cache.links.put(key, link)
+    return link
+
 '''
 Return an HTML link to a historical figure page given a historical
 figure ID.
 '''
 def create_hf_link(hf_id, everything):
+    return get_cached_link('hif', hf_id, build_hf_link, everything)
+
+def build_hf_link(hf_id, everything):
     return "<a href='hif" + str(hf_id) + "' class='hf-link' >" +\
         get_hf_name(hf_id, everything) + "</a>"
 
@@ -49,27 +83,50 @@ def create_hf_link(hf_id, everything):
 Return an HTML link to an entity page given an entity ID.
 '''
 def create_entity_link(entity_id, everything):
+    return get_cached_link('ent', entity_id, build_entity_link, everything)
+
+def build_entity_link(entity_id, everything):
     return "<a href='ent" + str(entity_id) + "' class='entity-link' >" +\
         get_ent_name(entity_id, everything) + "</a>"
                 
 '''
-Return an HTML link to a site page given a site ID.
+Return an HTML link to a site page given a site ID, or an event (or other
+dictionary) with a site_id or coords.
 '''
 def create_site_link(site, everything):
     if isinstance(site, int):
         site_id = site
-        site_name = get_site_name(site_id, everything)
     elif 'site_id' in site.keys():
         site_id = site['site_id']
-        site_name = get_site_name(site_id, everything)
     elif 'coords' in site.keys():
-        site_id, site_name = get_site_data(site['coords'], everything)
+        site_id, _ = get_site_data(site['coords'], everything)
         if site_id == -1:
             return ""
     else:
         return ""
         
+    return get_cached_link('sit', site_id, build_site_link, everything)
+
+def build_site_link(site_id, everything):
     return "<a href='sit" + str(site_id) + "' class='site-link' >" +\
-        "in " + site_name + "</a>"
-        
+        "in " + get_site_name(site_id, everything) + "</a>"
+
+'''
+Return an HTML link, with the element's name as its text, to the page of
+an element given its type (e.g. 'artifacts') and ID.
+'''
+def create_element_link(a_type, an_id, everything):
+    build_link = lambda an_id, everything: build_element_link(a_type, an_id, everything)
+    return get_cached_link(a_type, an_id, build_link, everything)
+
+def build_element_link(a_type, an_id, everything):
+    return "<a href='" + link_mapper[a_type] + str(an_id) + "' class='" + link_classes[a_type] + "' >" +\
+        get_name(an_id, a_type, everything) + "</a>"
 
+'''
+Return the link at the end of a partly shown event list, which asks for
+the events of the page page_link from start on.
+'''
+def create_more_events_link(page_link, start, remaining):
+    return "<a id='more-events' class='more-events' href='" + EVENT_SLICE_CODE + page_link + ":" +\
+        str(start) + "' >More events (" + str(remaining) + " left)</a>"
@@ -0,0 +1,168 @@
+'''
+Instrumentation for loading a world.
+
+A LoadProfiler follows a load through its phases (pre-scan, parse, link,
+snapshot...) and records, for each one, its wall-clock time and the peak
+of Python allocations during it, traced with tracemalloc when memory
+profiling is on. The operating system only reports the peak resident set
+size of a process over its whole life, so each phase also records that
+peak as of its end (cumulative_peak_rss_bytes, and the same for the
+finished worker processes), not the phase's own peak.
+
+During parsing the profiler also counts, for each top-level tag, the
+elements and bytes parsed and the CPU time the parser spent on them,
+which gives elements per second, and splits the main process's time
+between waiting for results from the workers (transfer) and adding them
+to the world (merge). Worker processes report how long they were busy,
+which gives the pool's utilization.
+
+The report is a plain dict, which load_dict prints or writes as JSON.
+A disabled profiler records nothing and costs next to nothing.
+'''
+
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows
+    resource = None
+
+'''
+Return the peak resident set size so far of this process and of its
+finished children (worker processes), in bytes, or None if it is
+unknown. These are lifetime peaks: they never go down.
+'''
+def peak_rss():
+    if resource is None:
+        return None, None
+    #ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+class LoadProfiler():
+
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.started_tracing = False
+        self.start_time = time.perf_counter()
+        self.report = {'file': None, 'file_bytes': 0, 'mode': None, 'workers': 0,
+                       'phases': {}, 'tags': {},
+                       'pipeline': {'worker_busy_seconds': 0.0, 'transfer_seconds': 0.0,
+                                    'merge_seconds': 0.0, 'worker_utilization': None},
+                       'bytes_read': 0, 'total_seconds': 0.0}
+
+    '''
+    Record the file being loaded and how it is loaded: 'parallel',
+    'serial', 'lazy' or 'snapshot'.
+    '''
+    def start_load(self, filename, mode, workers=0):
+        if not self.enabled:
+            return
+        self.report['file'] = filename
+        self.report['file_bytes'] = os.path.getsize(filename)
+        self.report['mode'] = mode
+        self.report['workers'] = workers
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    '''
+    Time a phase of the load, e.g.
+
+        with profiler.phase('link'):
+            parse_historical_events(everything)
+    '''
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = {'seconds': time.perf_counter() - start}
+            if self.trace_memory:
+                phase['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            phase['cumulative_peak_rss_bytes'], phase['cumulative_peak_worker_rss_bytes'] = peak_rss()
+            self.report['phases'][name] = phase
+
+    '''
+    Add bytes read from the file outside of parsing, e.g. by the pre-scan.
+    '''
+    def add_bytes_read(self, num_bytes):
+        if self.enabled:
+            self.report['bytes_read'] += num_bytes
+
+    '''
+    Record a parsed byte range: its tag, number of elements and bytes, and
+    the CPU time the parser (a worker, or the main process) spent on it.
+    '''
+    def add_range(self, tag, num_elements, num_bytes, busy_seconds):
+        if not self.enabled:
+            return
+        stats = self.report['tags'].setdefault(tag, {'elements': 0, 'bytes': 0, 'parse_seconds': 0.0})
+        stats['elements'] += num_elements
+        stats['bytes'] += num_bytes
+        stats['parse_seconds'] += busy_seconds
+        self.report['bytes_read'] += num_bytes
+        self.report['pipeline']['worker_busy_seconds'] += busy_seconds
+
+    def add_transfer_time(self, seconds):
+        if self.enabled:
+            self.report['pipeline']['transfer_seconds'] += seconds
+
+    def add_merge_time(self, seconds):
+        if self.enabled:
+            self.report['pipeline']['merge_seconds'] += seconds
+
+    '''
+    Finish the report and return it.
+    '''
+    def finish(self):
+        if not self.enabled:
+            return self.report
+
+        report = self.report
+        report['total_seconds'] = time.perf_counter() - self.start_time
+        for stats in report['tags'].values():
+            if stats['parse_seconds'] > 0:
+                stats['elements_per_second'] = stats['elements'] / stats['parse_seconds']
+
+        parse = report['phases'].get('parse')
+        pipeline = report['pipeline']
+        if parse is not None and parse['seconds'] > 0 and report['workers'] > 0:
+            pipeline['worker_utilization'] = \
+                pipeline['worker_busy_seconds'] / (report['workers'] * parse['seconds'])
+
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return report
+
+    '''
+    Write the finished report as JSON to a file, or print it if no
+    file is given.
+    '''
+    def emit(self, output_file=""):
+        if not self.enabled:
+            return
+        text = json.dumps(self.finish(), indent=2)
+        if output_file:
+            with open(output_file, 'w') as f:
+                f.write(text + "\n")
+            print("Wrote load profile: " + output_file)
+        else:
+            print(text)
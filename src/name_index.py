@@ -0,0 +1,88 @@
+'''
+Index from element names to the elements that have them.
+
+Names are normalized (lower case, single spaces) so that a name typed or
+capitalized for display still finds its element. Different elements can
+share a name, e.g. a figure named after a site, so a name maps to every
+(type, id) pair that has it, in the order of the sections in the file.
+Each pair is packed into one int, and a name with a single element (the
+usual case) stores that int directly rather than a list.
+'''
+
+#Number of bits for the element id in a packed (type, id) pair
+ID_BITS = 32
+
+'''
+Return the form of a name used as an index key.
+'''
+def normalize_name(name):
+    normalized = ' '.join(name.lower().split())
+    #keep the original string when it is already normalized, so that
+    #the index shares it with the *_names dicts
+    return name if normalized == name else normalized
+
+class NameIndex():
+
+    def __init__(self):
+        self.types = []
+        self.type_codes = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return normalize_name(name) in self.entries
+
+    def add(self, name, a_type, an_id):
+        type_code = self.type_codes.get(a_type)
+        if type_code is None:
+            type_code = len(self.types)
+            self.type_codes[a_type] = type_code
+            self.types.append(a_type)
+        packed = (type_code << ID_BITS) | (an_id & ((1 << ID_BITS) - 1))
+
+        key = normalize_name(name)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = packed
+        elif isinstance(entry, list):
+            entry.append(packed)
+        else:
+            self.entries[key] = [entry, packed]
+
+    def unpack(self, packed):
+        an_id = packed & ((1 << ID_BITS) - 1)
+        if an_id >= 1 << (ID_BITS - 1):
+            an_id -= 1 << ID_BITS
+        return self.types[packed >> ID_BITS], an_id
+
+    '''
+    Return every (type, id) pair with the given name, or an empty list.
+    '''
+    def lookup(self, name):
+        entry = self.entries.get(normalize_name(name))
+        if entry is None:
+            return []
+        if isinstance(entry, list):
+            return [self.unpack(packed) for packed in entry]
+        return [self.unpack(entry)]
+
+    '''
+    Return the sorted list of distinct normalized names, as used by search.
+    '''
+    def name_list(self):
+        return sorted(self.entries)
+
+'''
+Build the name index of a world from its *_names dicts.
+'''
+def build_name_index(everything):
+    index = NameIndex()
+    for tag in list(everything.keys()):
+        if not tag.endswith("_names"):
+            continue
+        a_type = tag[:-len("_names")]
+        for an_id, name in everything[tag].items():
+            index.add(name, a_type, an_id)
+    return index
@@ -0,0 +1,381 @@
+'''
+Substring search over the names of a world's elements.
+
+The names are the distinct normalized names of the NameIndex, sorted and
+numbered by position. Every bigram and trigram of each name, padded with a
+space at both ends, is indexed with the sorted numbers of the names that
+contain it:
+
+    postings  gram -> array of name numbers
+
+The candidates for a query are the names that contain all of its grams,
+found by intersecting their posting lists from the shortest, and each
+candidate is then checked for the query. Names where the query starts a
+word come first, as in the search bar. Queries of one character, which
+match most names anyway, check every name.
+
+The search bar only shows the best results, a page at a time, so the
+ranking stops as soon as the first results are known, and results are
+(name, type, id) rows of the elements with the names.
+
+The matches of the last few queries are cached, unless their search
+stopped early. As the user types, a query usually contains an earlier one
+("ur", then "uri", then "urist"), so only the earlier query's matches need
+to be checked, if they are fewer than the index's candidates. Deleting
+characters goes back to a cached query.
+
+When no name contains a query, the search falls back to approximate
+matching. The distinct words of the names have their own index from
+padded bigrams to word numbers, and the names that contain each word are
+kept too. A misspelled word shares most of its bigrams with the right word,
+and one typo changes at most three. So the words that share enough bigrams
+with a query word are its candidates. They are kept if they are within
+max_typos(word) edits of it, counting a swap of two letters as one edit.
+The names that have a close word for every query word are ranked by their
+total number of edits.
+'''
+
+from array import array
+from bisect import bisect_left
+import threading
+
+from helpers import capitalize, LRUCache
+
+#Stop intersecting posting lists once there are this few candidates left,
+#checking the names themselves is cheaper
+CHECK_CANDIDATES = 64
+
+#Names checked between two calls to the cancelled function of a search
+CANCEL_INTERVAL = 1024
+
+#Number of queries whose matches are kept
+REFINEMENT_CACHE_SIZE = 16
+
+#Bigrams that one edit changes at most (a swap of two letters)
+GRAMS_PER_EDIT = 3
+
+'''
+Return the distinct bigrams and trigrams of a name, padded with spaces.
+'''
+def name_grams(name):
+    padded = ' ' + name + ' '
+    grams = {padded[i:i + 3] for i in range(len(padded) - 2)}
+    grams.update(padded[i:i + 2] for i in range(len(padded) - 1))
+    return grams
+
+'''
+Return the grams a name must contain to contain the query: its trigrams,
+or its bigram if it is too short to have any.
+'''
+def query_grams(text):
+    if len(text) >= 3:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    if len(text) == 2:
+        return {text}
+    return set()
+
+'''
+Return the distinct bigrams of a word, padded with spaces.
+'''
+def word_grams(word):
+    padded = ' ' + word + ' '
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+'''
+Return how many typos a word of a fuzzy search can have.
+'''
+def max_typos(word):
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+'''
+Return the number of insertions, deletions, substitutions and swaps of two
+adjacent letters that turn a into b, or limit + 1 if it is more than limit.
+'''
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+'''
+Return the items of the sorted array candidates that are also in the sorted
+array postings.
+'''
+def intersect(candidates, postings):
+    found = array('I')
+    start = 0
+    for number in candidates:
+        start = bisect_left(postings, number, start)
+        if start == len(postings):
+            break
+        if postings[start] == number:
+            found.append(number)
+    return found
+
+class NameSearchIndex():
+
+    def __init__(self, name_index):
+        self.name_index = name_index
+        self.names = name_index.name_list()
+        names = self.names
+        self.postings = {}
+        for number, name in enumerate(names):
+            for gram in name_grams(name):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    postings = array('I')
+                    self.postings[gram] = postings
+                postings.append(number)
+        self.index_words()
+
+        #query -> numbers of the names that contain it. Searches run in
+        #the search service's thread and in the GUI's, hence the lock
+        self.refinements = LRUCache(REFINEMENT_CACHE_SIZE)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    '''
+    Index the distinct words of the names, for fuzzy searches.
+    '''
+    def index_words(self):
+        #word -> numbers of the names that have it
+        self.word_names = {}
+        for number, name in enumerate(self.names):
+            for word in set(name.split(' ')):
+                names = self.word_names.get(word)
+                if names is None:
+                    names = array('I')
+                    self.word_names[word] = names
+                names.append(number)
+
+        self.words = sorted(self.word_names)
+        #bigram -> numbers of the words that have it
+        self.word_postings = {}
+        for number, word in enumerate(self.words):
+            for gram in word_grams(word):
+                postings = self.word_postings.get(gram)
+                if postings is None:
+                    postings = array('I')
+                    self.word_postings[gram] = postings
+                postings.append(number)
+
+    #==============PICKLING=============
+
+    #The cached matches are not saved in snapshots, and locks can't be
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['refinements']
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.refinements = LRUCache(REFINEMENT_CACHE_SIZE)
+        self.lock = threading.Lock()
+
+    #==============SEARCHING=============
+
+    '''
+    Return the numbers of the names that may contain a lower case text, in
+    order. refined is the matches of a query that the text contains, if
+    there is one, used if they are fewer than the index's candidates.
+    '''
+    def candidates(self, text, refined=None):
+        #the rarest gram first, so that the candidates start few
+        grams = sorted(query_grams(text), key=lambda gram: len(self.postings.get(gram, ())))
+        if grams:
+            candidates = self.postings.get(grams[0], array('I'))
+        else:
+            candidates = range(len(self.names))
+        if refined is not None and len(refined) < len(candidates):
+            candidates = refined
+        for gram in grams[1:]:
+            if len(candidates) <= CHECK_CANDIDATES:
+                break
+            candidates = intersect(candidates, self.postings[gram])
+        return candidates
+
+    '''
+    Return the cached matches of the query with the fewest matches that
+    a text contains, or None.
+    '''
+    def refinable_matches(self, text):
+        queries = [query for query in self.refinements.entries if query in text]
+        if not queries:
+            return None
+        query = min(queries, key=lambda query: len(self.refinements.entries[query]))
+        return self.refinements.get(query)
+
+    '''
+    Return the numbers of the names that contain a lower case text, in
+    order, or None if the search was cancelled, see search_numbers.
+
+    If limit is given and the matches are not cached, the scan stops at
+    the limit-th name where the text starts a word, since the names after
+    it are not among the first limit results. Matches cut short like this
+    are not cached.
+    '''
+    def matches(self, text, cancelled=None, limit=None):
+        with self.lock:
+            found = self.refinements.get(text)
+            if found is not None:
+                return found
+            refined = self.refinable_matches(text)
+
+        names = self.names
+        word_start = ' ' + text
+        word_beginnings = 0
+        found = array('I')
+        for position, number in enumerate(self.candidates(text, refined)):
+            if cancelled is not None and position % CANCEL_INTERVAL == 0 and cancelled():
+                return None
+            name = names[number]
+            substr_index = name.find(text)
+            if substr_index == -1:
+                continue
+            found.append(number)
+            if substr_index == 0 or word_start in name:
+                word_beginnings += 1
+                if word_beginnings == limit:
+                    return found
+
+        with self.lock:
+            self.refinements.put(text, found)
+        return found
+
+    '''
+    Return the numbers of the names that contain a lower case text: those
+    where it starts a word, then the others, each in alphabetical order.
+    If there are none, the names that have words close to those of the
+    text are returned instead, see fuzzy_numbers. At most limit numbers
+    are returned, if limit is given.
+
+    If cancelled is given, it is called every CANCEL_INTERVAL names, and
+    the search is abandoned (returning None) as soon as it returns True.
+    '''
+    def search_numbers(self, text, limit=None, cancelled=None):
+        found = self.matches(text, cancelled, limit)
+        if found is None:
+            return None
+        if not found:
+            return self.fuzzy_numbers(text, limit, cancelled)
+
+        names = self.names
+        word_start = ' ' + text
+        word_beginning_results = []
+        other_results = []
+        for number in found:
+            name = names[number]
+            if name.startswith(text) or word_start in name:
+                word_beginning_results.append(number)
+                #later names come after these
+                if len(word_beginning_results) == limit:
+                    break
+            elif limit is None or len(other_results) < limit:
+                other_results.append(number)
+        return (word_beginning_results + other_results)[:limit]
+
+    '''
+    Return the words within max_typos(word) edits of a word, as a dict
+    from word to number of edits, or None if the search was cancelled.
+    '''
+    def similar_words(self, word, cancelled=None):
+        typos = max_typos(word)
+        if typos == 0:
+            return {word: 0} if word in self.word_names else {}
+
+        grams = word_grams(word)
+        shared = {}
+        for gram in grams:
+            for number in self.word_postings.get(gram, ()):
+                shared[number] = shared.get(number, 0) + 1
+
+        needed = len(grams) - GRAMS_PER_EDIT * typos
+        similar = {}
+        for position, (number, count) in enumerate(shared.items()):
+            if cancelled is not None and position % CANCEL_INTERVAL == 0 and cancelled():
+                return None
+            if count < needed:
+                continue
+            distance = edit_distance(word, self.words[number], typos)
+            if distance <= typos:
+                similar[self.words[number]] = distance
+        return similar
+
+    '''
+    Return the numbers of the names that have a word within a few typos
+    of each word of a lower case text, those with the fewest typos first,
+    then in alphabetical order. At most limit numbers are returned, if
+    limit is given, or None if the search was cancelled, see
+    search_numbers.
+    '''
+    def fuzzy_numbers(self, text, limit=None, cancelled=None):
+        distances = None
+        for query_word in text.split():
+            similar = self.similar_words(query_word, cancelled)
+            if similar is None:
+                return None
+            #the fewest typos of a word of each name for this query word
+            word_distances = {}
+            for word, distance in similar.items():
+                for number in self.word_names[word]:
+                    if distance < word_distances.get(number, distance + 1):
+                        word_distances[number] = distance
+            if distances is None:
+                distances = word_distances
+            else:
+                distances = {number: distances[number] + distance
+                             for number, distance in word_distances.items() if number in distances}
+            if not distances:
+                return []
+        if distances is None:
+            return []
+        return sorted(distances, key=lambda number: (distances[number], number))[:limit]
+
+    '''
+    Return the capitalized names that contain a text, with matches at the
+    start of a word first (or the closest names, see fuzzy_numbers, if no
+    name contains it).
+    '''
+    def search(self, text, limit=None):
+        return [capitalize(self.names[number]) for number in self.search_numbers(text.lower(), limit)]
+
+    '''
+    Return a page of the results of a search: the (capitalized name, type,
+    id) of the elements with the count names from the start-th on, and
+    whether there are more names after them, or None if the search was
+    cancelled, see search_numbers.
+    '''
+    def search_elements(self, text, count, start=0, cancelled=None):
+        numbers = self.search_numbers(text.lower(), start + count + 1, cancelled)
+        if numbers is None:
+            return None
+        results = []
+        for number in numbers[start:start + count]:
+            name = capitalize(self.names[number])
+            for a_type, an_id in self.name_index.lookup(self.names[number]):
+                results.append((name, a_type, an_id))
+        return results, len(numbers) > start + count
+
+'''
+Build the search index of a world's names from its NameIndex.
+'''
+def build_name_search_index(everything):
+    return NameSearchIndex(everything['name_index'])
@@ -2,10 +2,16 @@
 from attribute_getters import *
 from link_creator import *
 from global_vars import *
-from event_processing import time_string, event_type_dispatcher
+from event_processing import time_string, render_events
+from event_text_index import search_events
+import html
 import os
 
 CSS_STR = None
+EVENT_LIST_JS = None
+
+#How many events of an event list are rendered at a time
+EVENTS_PER_PAGE = 200
 
 '''
 Load the stylesheet from an external file
@@ -17,6 +23,16 @@ def load_css():
     CSS_STR = f.read()
     f.close()
 
+'''
+Load the script that loads the rest of long event lists
+'''
+def load_event_list_js():
+    global EVENT_LIST_JS
+    jsfile = os.path.join(RESOURCES_DIR, 'event_list.js')
+    f = open(jsfile)
+    EVENT_LIST_JS = f.read()
+    f.close()
+
 '''
 Return a CSS class name for a given event. All events of the same
 type will have the same CSS class. This allows us to grab
@@ -35,16 +51,47 @@ def get_footer():
     return "</body></html>"
     
 #==============PAGE ELEMENTS==========
+'''
+Return the event list of an element. Only the first EVENTS_PER_PAGE
+events are rendered; the list ends with a link to the next ones, which
+the GUI renders with build_event_slice and adds to the page.
+'''
 def print_events(element_id, element_type, everything):
+    events = get_element_events(element_id, element_type, everything)
+    page_link = link_mapper[element_type] + str(element_id)
+
+    output = "<div class='event-list'>" + print_event_slice(page_link, events, 0, everything) + "</div>"
+    if len(events) > EVENTS_PER_PAGE:
+        if EVENT_LIST_JS is None:
+            load_event_list_js()
+        output += "<script>" + EVENT_LIST_JS + "</script>"
+    return output
+
+'''
+Return the HTML of up to EVENTS_PER_PAGE events of an event list from
+start, followed by a link to the next ones if there are more.
+'''
+def print_event_slice(page_link, events, start, everything):
     output = ""
-   
-    events = get_element(element_id, element_type, everything)['events']
+    end = start + EVENTS_PER_PAGE
 
-    for event_id in events:
+    for event_string in render_events(events[start:end], everything):
         #event_class = css_classify_event
-        output += "<p>" + event_type_dispatcher(event_id, everything) + "</p>"
+        output += "<p>" + event_string + "</p>"
+    if end < len(events):
+        output += create_more_events_link(page_link, end, len(events) - end)
     return output
 
+'''
+Given a link created by create_more_events_link, return the HTML of the
+events it asks for.
+'''
+def build_event_slice(slice_link, everything):
+    page_link, start = slice_link[len(EVENT_SLICE_CODE):].split(':')
+    element_type = page_types[page_link[:3]]
+    events = get_element_events(int(page_link[3:]), element_type, everything)
+    return print_event_slice(page_link, events, int(start), everything)
+
 #==============SPLASH PAGE=============
 def build_splash_page(dummy, dummy2):
     string = "<html><head>\
@@ -59,6 +106,27 @@ def build_splash_page(dummy, dummy2):
 
     return string
     
+#==============EVENT SEARCH PAGE=============
+'''
+Given a full-text query (see event_text_index.py), return an HTML page
+listing the best matching events. Each event links to the elements that
+take part in it.
+'''
+def build_event_search_page(query, everything, limit=EVENTS_PER_PAGE):
+    if CSS_STR is None:
+        load_css()
+    results = search_events(query, everything)
+
+    page = get_header()
+    page += "<h1 class='page-title'>" + html.escape(query) + "</h1>\
+            <h3 class='page-description'>" + str(len(results)) + " matching events</h3><hr>"
+    page += "<div class='page-content'>"
+    for event_string in render_events([event_id for event_id, score in results[:limit]], everything):
+        page += "<p>" + event_string + "</p>"
+    page += "</div>"
+    page += get_footer()
+    return page
+
 #==============HF PAGE=============
 '''
 Given an id, return an HTML string describing that historical figure.
@@ -197,33 +265,33 @@ def build_artifact_page(an_id, everything):
  
  #==============ENTITY POP PAGE=============
 def build_entity_population_page(an_id, everything):
-    name = get_name(an_id, 'entity_population', everything)
+    name = get_name(an_id, 'entity_populations', everything)
     page = get_header()
     
     page += " <h1 class='page-title'>" + name + "</h1><hr>"
-    page += str(get_element(an_id, "entity_population", everything))
+    page += str(get_element(an_id, "entity_populations", everything))
     page += print_events(an_id, "entity_populations", everything)
     page += "</body></html>"
     return page
 
 #==============HISTORICAL EVENT PAGE=============
 def build_historical_event_page(an_id, everything):
-    name = get_name(an_id, 'historical_event', everything)
+    name = get_name(an_id, 'historical_events', everything)
     page = get_header()
     
     page += " <h1 class='page-title'>" + name + "</h1><hr>"
-    page += str(get_element(an_id, "historical_event", everything))
+    page += str(get_element(an_id, "historical_events", everything))
     page += print_events(an_id, "historical_events", everything)
     page += "</body></html>"
     return page
 
 #==============HEC PAGE=============
 def build_historical_event_collection_page(an_id, everything):
-    name = get_name(an_id, 'historical_event_collection', everything)
+    name = get_name(an_id, 'historical_event_collections', everything)
     page = get_header()
     
     page += " <h1 class='page-title'>" + name + "</h1><hr>"
-    page += str(get_element(an_id, "historical_event_collection", everything))
+    page += str(get_element(an_id, "historical_event_collections", everything))
     page += print_events(an_id, "historical_event_collections", everything)
     page += "</body></html>"
     return page
@@ -257,9 +325,50 @@ dispatcher = {  'reg' : build_region_page, \
                         'spl' : build_splash_page,
                  }
            
-def dispatch_link(page_link, everything):
+'''
+Return the HTML page for a page link. Pages of a loaded world are kept
+in its page cache, so pages that were seen recently are not built again.
+slices is the number of EVENTS_PER_PAGE slices of the event list to
+show, as when the reader has followed its "more events" links; the page
+is cached for each number of slices.
+'''
+def dispatch_link(page_link, everything, slices=1):
     if CSS_STR is None:
         load_css()
+    if slices > 1:
+        cache_key = page_link + ':' + str(slices)
+    else:
+        cache_key = page_link
+    if everything is None or 'page_cache' not in everything:
+        return build_page_slices(page_link, slices, everything)
+
+    page_cache = everything['page_cache']
+    page = page_cache.get(cache_key)
+    if page is None:
+        page = build_page_slices(page_link, slices, everything)
+        page_cache.put(cache_key, page)
+    return page
+
+'''
+Build a page with the first slices slices of its event list, replacing
+each "more events" link with the events it asks for, as append_events()
+in event_list.js does.
+'''
+def build_page_slices(page_link, slices, everything):
+    if slices <= 1:
+        return build_page(page_link, everything)
+    page = dispatch_link(page_link, everything)
+    for i in range(slices - 1):
+        link_start = page.find("<a id='more-events'")
+        if link_start == -1:
+            break
+        link_end = page.index("</a>", link_start) + len("</a>")
+        href_start = page.index("href='", link_start) + len("href='")
+        slice_link = page[href_start:page.index("'", href_start)]
+        page = page[:link_start] + build_event_slice(slice_link, everything) + page[link_end:]
+    return page
+
+def build_page(page_link, everything):
     code = page_link[:3]
     
     return dispatcher[code](int(page_link[3:]), everything)
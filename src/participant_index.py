@@ -0,0 +1,270 @@
+'''
+Reverse index from the elements of a world to the events they take part in.
+
+Every event field that refers to another element (hfid, civ_id, site_id,
+artifact_id, wc_id...) is an edge from that element to the event. While
+parsing, each worker collects the edges of the events in its byte range
+into EventEdges, a set of parallel arrays. Once every range has been
+merged, the edges are grouped by element into compact arrays for each
+section:
+
+    keys    sorted ids of the elements that take part in events
+    starts  where each element's events begin in events/roles
+    events  event ids, in chronological order for each element
+    roles   the field each edge came from, as an index into ROLES
+
+Structures have no section of their own, and their ids are only unique
+within a site, so they are keyed by structure_key(site_id, structure_id).
+
+Some events only give the coordinates of where they happened. Those are
+collected too, and linked to the site at those coordinates (with the
+'coords' role) once the sites are known, see connect_elements.py.
+'''
+
+from array import array
+from bisect import bisect_left
+
+from spatial_index import parse_coords
+
+#Event fields that refer to another element, and that element's section
+PARTICIPANT_FIELDS = {
+    #historical figures
+    'hfid': 'historical_figures',
+    'hfid_target': 'historical_figures',
+    'slayer_hfid': 'historical_figures',
+    'group_hfid': 'historical_figures',
+    'group_1_hfid': 'historical_figures',
+    'group_2_hfid': 'historical_figures',
+    'woundee_hfid': 'historical_figures',
+    'wounder_hfid': 'historical_figures',
+    'trickster_hfid': 'historical_figures',
+    'cover_hfid': 'historical_figures',
+    'hist_fig_id': 'historical_figures',
+    'hist_figure_id': 'historical_figures',
+    'target_hfid': 'historical_figures',
+    'snatcher_hfid': 'historical_figures',
+    'changee_hfid': 'historical_figures',
+    'changer_hfid': 'historical_figures',
+    'doer_hfid': 'historical_figures',
+    'builder_hfid': 'historical_figures',
+    'new_leader_hfid': 'historical_figures',
+    'attacker_general_hfid': 'historical_figures',
+    'defender_general_hfid': 'historical_figures',
+    'histfig': 'historical_figures',
+    #entities
+    'civ_id': 'entities',
+    'entity_id': 'entities',
+    'site_civ_id': 'entities',
+    'attacker_civ_id': 'entities',
+    'defender_civ_id': 'entities',
+    'new_site_civ_id': 'entities',
+    'entity_id_1': 'entities',
+    'entity_id_2': 'entities',
+    'target_enid': 'entities',
+    'source': 'entities',
+    'destination': 'entities',
+    #sites
+    'site_id': 'sites',
+    'site_id1': 'sites',
+    'site_id2': 'sites',
+    #artifacts
+    'artifact_id': 'artifacts',
+    #regions
+    'subregion_id': 'regions',
+    #world constructions
+    'wc_id': 'world_constructions',
+    'master_wcid': 'world_constructions',
+    #structures, keyed by structure_key()
+    'structure_id': 'structures',
+    #sites found from the coordinates of events without a site_id
+    'coords': 'sites',
+}
+
+ROLES = list(PARTICIPANT_FIELDS)
+ROLE_CODES = {field: code for code, field in enumerate(ROLES)}
+
+SECTIONS = ['historical_figures', 'entities', 'sites', 'artifacts', 'regions',
+            'world_constructions', 'structures']
+SECTION_CODES = {section: code for code, section in enumerate(SECTIONS)}
+
+#(section code, role code) for each field
+FIELD_CODES = {field: (SECTION_CODES[section], ROLE_CODES[field])
+               for field, section in PARTICIPANT_FIELDS.items()}
+
+STRUCTURE_KEY_STRIDE = 4096
+
+'''
+Return the key a structure is indexed under.
+'''
+def structure_key(site_id, structure_id):
+    return site_id * STRUCTURE_KEY_STRIDE + structure_id
+
+'''
+Edges from elements to events, as parallel arrays.
+'''
+class EventEdges():
+
+    def __init__(self):
+        self.sections = array('B')
+        self.targets = array('i')
+        self.events = array('i')
+        self.roles = array('B')
+        #events with coordinates but no site
+        self.coord_events = array('i')
+        self.coord_xs = array('i')
+        self.coord_ys = array('i')
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, field, target, event_id):
+        section_code, role_code = FIELD_CODES[field]
+        self.sections.append(section_code)
+        self.targets.append(target)
+        self.events.append(event_id)
+        self.roles.append(role_code)
+
+    def add_coordinates(self, event_id, x, y):
+        self.coord_events.append(event_id)
+        self.coord_xs.append(x)
+        self.coord_ys.append(y)
+
+    def extend(self, other):
+        self.sections.extend(other.sections)
+        self.targets.extend(other.targets)
+        self.events.extend(other.events)
+        self.roles.extend(other.roles)
+        self.coord_events.extend(other.coord_events)
+        self.coord_xs.extend(other.coord_xs)
+        self.coord_ys.extend(other.coord_ys)
+
+    '''
+    Iterate over (event id, x, y) for the events with coordinates but no site.
+    '''
+    def coordinate_events(self):
+        return zip(self.coord_events, self.coord_xs, self.coord_ys)
+
+'''
+Collect the edges of a list of event dictionaries (None for events that
+were not loaded).
+'''
+def collect_edges(events):
+    edges = EventEdges()
+    for event in events:
+        if event is None:
+            continue
+        event_id = event['id']
+        if 'coords' in event and not 'site_id' in event:
+            coords = parse_coords(event['coords'])
+            if coords is not None:
+                edges.add_coordinates(event_id, coords[0], coords[1])
+        for field, value in event.items():
+            if field not in FIELD_CODES or not isinstance(value, int):
+                continue
+            if field == 'structure_id':
+                if not 'site_id' in event:
+                    continue
+                value = structure_key(event['site_id'], value)
+            edges.add(field, value, event_id)
+    return edges
+
+'''
+The events of every element of one section, grouped by element id.
+'''
+class SectionIndex():
+
+    def __init__(self, keys, starts, events, roles):
+        self.keys = keys
+        self.starts = starts
+        self.events = events
+        self.roles = roles
+
+    def find(self, element_id):
+        i = bisect_left(self.keys, element_id)
+        if i == len(self.keys) or self.keys[i] != element_id:
+            return 0, 0
+        return self.starts[i], self.starts[i + 1]
+
+    def events_for(self, element_id):
+        start, end = self.find(element_id)
+        return self.events[start:end]
+
+    def roles_for(self, element_id):
+        start, end = self.find(element_id)
+        return [ROLES[role] for role in self.roles[start:end]]
+
+'''
+Group one section's edges by element id, with each element's events in
+chronological order, given the timeline of the world (or in file order,
+as event ids only increase through the file, without one).
+'''
+def build_section_index(targets, events, roles, timeline=None):
+    #sort (target, [key,] event, edge) tuples, the edge keeping ties stable
+    if timeline is None or timeline.in_file_order:
+        order = sorted(zip(targets, events, range(len(targets))))
+    else:
+        event_keys = timeline.keys
+        offset = timeline.offset
+        order = sorted(zip(targets, [event_keys[event_id - offset] for event_id in events],
+                           events, range(len(targets))))
+
+    keys = array('i')
+    starts = array('I')
+    sorted_events = array('i')
+    sorted_roles = array('B')
+    for position, edge in enumerate(order):
+        target = edge[0]
+        if not keys or keys[-1] != target:
+            keys.append(target)
+            starts.append(position)
+        sorted_events.append(edge[-2])
+        sorted_roles.append(roles[edge[-1]])
+    starts.append(len(order))
+
+    return SectionIndex(keys, starts, sorted_events, sorted_roles)
+
+class ParticipantIndex():
+
+    def __init__(self):
+        #edges collected while loading, dropped once the index is built
+        self.edges = EventEdges()
+        self.sections = {}
+
+    def add_edges(self, edges):
+        self.edges.extend(edges)
+
+    '''
+    Build the per-section indexes from the collected edges, with the
+    events of each element in the order of the given Timeline.
+    '''
+    def build(self, timeline=None):
+        edges = self.edges
+        by_section = [(array('i'), array('i'), array('B')) for _ in SECTIONS]
+        for section_code, target, event_id, role in zip(edges.sections, edges.targets,
+                                                        edges.events, edges.roles):
+            targets, events, roles = by_section[section_code]
+            targets.append(target)
+            events.append(event_id)
+            roles.append(role)
+
+        for section, (targets, events, roles) in zip(SECTIONS, by_section):
+            self.sections[section] = build_section_index(targets, events, roles, timeline)
+        self.edges = EventEdges()
+
+    '''
+    Return the ids of the events an element takes part in.
+    '''
+    def events_for(self, section, element_id):
+        if section not in self.sections:
+            return array('i')
+        return self.sections[section].events_for(element_id)
+
+    '''
+    Return (event id, field) for each event an element takes part in,
+    where field is the event field that refers to the element.
+    '''
+    def roles_for(self, section, element_id):
+        if section not in self.sections:
+            return []
+        index = self.sections[section]
+        return list(zip(index.events_for(element_id), index.roles_for(element_id)))
@@ -0,0 +1,183 @@
+'''
+Compact records for historical figures.
+
+A world can have hundreds of thousands of historical figures, so instead
+of a dict per figure (with a list of events and a small dict per link),
+each figure is a HistFigure with __slots__ fields. Its links are packed
+into integer arrays, with link types stored as small codes:
+
+    hf_links      array('i') of (type code, hfid) pairs
+    entity_links  array('i') of (type code, entity id, strength) triples
+
+A figure's events are not stored on it, see participant_index.py.
+
+A HistFigure can still be read like the dictionary it replaces, e.g.
+hf['name'] or hf['hf_links'], which returns the links as small dicts.
+'''
+
+from array import array
+from collections.abc import Mapping
+import sys
+
+#Link types, by code. Types not listed here are kept by name in the
+#figure's extra fields and get a code of UNKNOWN_LINK_TYPE or above.
+HF_LINK_TYPES = ('mother', 'father', 'child', 'spouse', 'former spouse', 'deceased spouse',
+                 'lover', 'former lover', 'deity', 'master', 'apprentice', 'former master',
+                 'former apprentice', 'companion', 'former companion', 'prisoner', 'imprisoner',
+                 'pet owner')
+ENTITY_LINK_TYPES = ('member', 'former member', 'mercenary', 'former mercenary', 'slave',
+                     'former slave', 'prisoner', 'former prisoner', 'enemy', 'criminal', 'hero',
+                     'position', 'former position', 'squad', 'former squad', 'occupation',
+                     'former occupation')
+HF_LINK_CODES = {link_type: code for code, link_type in enumerate(HF_LINK_TYPES)}
+ENTITY_LINK_CODES = {link_type: code for code, link_type in enumerate(ENTITY_LINK_TYPES)}
+UNKNOWN_LINK_TYPE = 1000
+
+#Attributes with their own slot. Anything else goes in the extra dict.
+HF_FIELDS = ('id', 'name', 'race', 'caste', 'appeared', 'birth_year', 'birth_seconds72',
+             'death_year', 'death_seconds72', 'associated_type', 'deity', 'animated',
+             'animated_string', 'ent_pop_id', 'current_identity_id', 'used_identity_id')
+
+#Slots holding array('i') values
+ARRAY_SLOTS = ('hf_link_data', 'entity_link_data')
+
+'''
+Marks a slot with no value in a pickled HistFigure.
+'''
+class Unset():
+    pass
+
+class HistFigure(Mapping):
+    __slots__ = HF_FIELDS + ('spheres', 'hf_link_data', 'entity_link_data', 'extra')
+
+    def __init__(self):
+        self.hf_link_data = None
+        self.entity_link_data = None
+        self.spheres = None
+        self.extra = None
+
+    #==============LINKS=============
+
+    def add_hf_link(self, link_type, hfid):
+        if self.hf_link_data is None:
+            self.hf_link_data = array('i')
+        self.hf_link_data.extend((self.link_type_code(link_type, HF_LINK_CODES), hfid))
+
+    def add_entity_link(self, link_type, entity_id, strength=-1):
+        if self.entity_link_data is None:
+            self.entity_link_data = array('i')
+        self.entity_link_data.extend((self.link_type_code(link_type, ENTITY_LINK_CODES), entity_id, strength))
+
+    def link_type_code(self, link_type, codes):
+        code = codes.get(link_type)
+        if code is not None:
+            return code
+        if self.extra is None:
+            self.extra = {}
+        unknown_types = self.extra.setdefault('unknown_link_types', [])
+        if link_type not in unknown_types:
+            unknown_types.append(sys.intern(link_type))
+        return UNKNOWN_LINK_TYPE + unknown_types.index(link_type)
+
+    def link_type_name(self, code, link_types):
+        if code < UNKNOWN_LINK_TYPE:
+            return link_types[code]
+        return self.extra['unknown_link_types'][code - UNKNOWN_LINK_TYPE]
+
+    '''
+    Iterate over (type, hfid) for each link to another historical figure.
+    '''
+    def iter_hf_links(self):
+        data = self.hf_link_data or ()
+        for i in range(0, len(data), 2):
+            yield self.link_type_name(data[i], HF_LINK_TYPES), data[i + 1]
+
+    '''
+    Iterate over (type, entity id, strength) for each entity link.
+    Strength is -1 when the export does not give one.
+    '''
+    def iter_entity_links(self):
+        data = self.entity_link_data or ()
+        for i in range(0, len(data), 3):
+            yield self.link_type_name(data[i], ENTITY_LINK_TYPES), data[i + 1], data[i + 2]
+
+    #==============DICTIONARY ACCESS=============
+
+    def __getitem__(self, key):
+        if key == 'hf_links':
+            return [{'type': link_type, 'id': hfid} for link_type, hfid in self.iter_hf_links()]
+        if key == 'entity_links':
+            links = []
+            for link_type, entity_id, strength in self.iter_entity_links():
+                link = {'type': link_type, 'id': entity_id}
+                if strength != -1:
+                    link['strength'] = strength
+                links.append(link)
+            return links
+        if key == 'sphere' and self.spheres:
+            return self.spheres[-1]
+        if key in HF_FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is not None and key in self.extra and key != 'unknown_link_types':
+            return self.extra[key]
+        raise KeyError(key)
+
+    '''
+    Set an attribute. Attributes that can appear more than once (spheres)
+    are collected rather than overwritten.
+    '''
+    def __setitem__(self, key, value):
+        if key == 'sphere':
+            self.spheres = (self.spheres or ()) + (value,)
+        elif key in HF_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __iter__(self):
+        for key in HF_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.spheres:
+            yield 'sphere'
+        if self.extra is not None:
+            for key in self.extra:
+                if key != 'unknown_link_types':
+                    yield key
+        yield 'hf_links'
+        yield 'entity_links'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    #==============PICKLING=============
+
+    #Pickle as a plain tuple of slot values instead of a dict of slot
+    #names, with the arrays as raw bytes, which keeps worker results and
+    #snapshots small.
+    def __getstate__(self):
+        state = []
+        for slot in HistFigure.__slots__:
+            value = getattr(self, slot, Unset)
+            if slot in ARRAY_SLOTS and value is not None:
+                value = value.tobytes()
+            state.append(value)
+        return tuple(state)
+
+    def __setstate__(self, state):
+        for slot, value in zip(HistFigure.__slots__, state):
+            if value is Unset:
+                continue
+            if slot in ARRAY_SLOTS and value is not None:
+                packed = array('i')
+                packed.frombytes(value)
+                value = packed
+            setattr(self, slot, value)
@@ -0,0 +1,98 @@
+'''
+Search bar queries (see facet_index.search_elements) run by one long-lived
+background thread.
+
+Each query submitted gets a generation number, one more than the last, and
+only the latest query matters: the thread skips the queries that were
+superseded before it got to them, abandons a scan as soon as a newer query
+is submitted, and only hands results to the callback if their query is
+still the latest. Results can still be superseded between the check and
+the callback (e.g. while they wait in a GUI event queue), so clients check
+is_current(generation) before showing them.
+
+The next page of the results of the latest query is searched by the same
+thread, without superseding the query: fetch_more takes the query's
+generation, and is ignored if a newer query was submitted since.
+
+    service = SearchService(everything, show_results, 100)
+    generation = service.submit('urist')
+    #later, in the service's thread:
+    #show_results(generation, 'urist', 0, rows, more)
+    service.fetch_more(generation, 'urist', 100)
+    #show_results(generation, 'urist', 100, rows, more)
+'''
+
+import threading
+
+from facet_index import search_elements
+
+class SearchService():
+
+    def __init__(self, everything, callback, count):
+        self.everything = everything
+        self.callback = callback
+        #names in the first page of results
+        self.count = count
+
+        self.generation = 0
+        #the (generation, text, start) waiting to be searched, if any
+        self.query = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='search service', daemon=True)
+        self.thread.start()
+
+    '''
+    Search for a text, superseding the previous queries. Returns the
+    generation of the query.
+    '''
+    def submit(self, text):
+        with self.condition:
+            self.generation += 1
+            self.query = (self.generation, text, 0)
+            self.condition.notify()
+            return self.generation
+
+    '''
+    Search for the page of the results of the latest query that starts
+    with the start-th name. Ignored if the query is no longer the latest.
+    '''
+    def fetch_more(self, generation, text, start):
+        with self.condition:
+            if generation != self.generation:
+                return
+            self.query = (generation, text, start)
+            self.condition.notify()
+
+    '''
+    Supersede the previous queries without searching for anything.
+    '''
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.query = None
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def stop(self):
+        with self.condition:
+            self.generation += 1
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.query is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                generation, text, start = self.query
+                self.query = None
+
+            results = search_elements(text, self.count, start, self.everything,
+                                      cancelled=lambda: not self.is_current(generation))
+            if results is not None and self.is_current(generation):
+                self.callback(generation, text, start, results[0], results[1])
@@ -0,0 +1,87 @@
+'''
+Cheap pre-scan of a memory-mapped legends export.
+
+Instead of building a tree for every top-level section, the file is
+searched for the opening and closing tags of each section, and large
+sections are cut into byte ranges that start at an element's opening
+tag. The ranges can then be handed to worker processes, which parse
+them straight from their own mapping of the file.
+'''
+
+from global_vars import TAG_MAP
+
+'''
+Return a list of (upper_level_tag, start, end) tuples, one for each
+top-level section in the mapped file, where [start, end) is the byte
+range of the section's contents. Empty sections (<tag/>) have
+start == end.
+'''
+def find_sections(mapped):
+    sections = []
+    position = 0
+
+    for upper_level_tag in TAG_MAP.values():
+        tag = upper_level_tag.encode()
+        open_tag = b'<' + tag + b'>'
+        empty_tag = b'<' + tag + b'/>'
+
+        #Sections come in a fixed order, so search from the end of the
+        #previous one first. Fall back to the whole file just in case.
+        start = mapped.find(open_tag, position)
+        if start == -1:
+            start = mapped.find(open_tag)
+
+        if start == -1:
+            empty = mapped.find(empty_tag)
+            if empty != -1:
+                sections.append((upper_level_tag, empty, empty))
+            continue
+
+        start += len(open_tag)
+        end = mapped.find(b'</' + tag + b'>', start)
+        if end == -1:
+            #Unterminated section, e.g. a truncated export.
+            end = len(mapped)
+
+        sections.append((upper_level_tag, start, end))
+        position = end
+
+    sections.sort(key=lambda section: section[1])
+    return sections
+
+'''
+Split the contents of a section into element-aligned byte ranges of
+roughly chunk_size bytes. Every range begins with the opening tag of
+a lower-level element; the last one runs to the end of the section.
+'''
+def split_section(mapped, lower_level_tag, start, end, chunk_size):
+    open_tag = b'<' + lower_level_tag.encode() + b'>'
+
+    chunks = []
+    chunk_start = mapped.find(open_tag, start, end)
+    if chunk_start == -1:
+        #Section has no elements
+        return chunks
+
+    while True:
+        chunk_end = mapped.find(open_tag, chunk_start + chunk_size, end)
+        if chunk_end == -1:
+            chunks.append((chunk_start, end))
+            break
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    return chunks
+
+'''
+Pre-scan the mapped file, returning a list of
+(upper_level_tag, [(start, end), ...]) for every section, in file order.
+'''
+def scan_file(mapped, chunk_size):
+    lower_level_tags = {upper: lower for lower, upper in TAG_MAP.items()}
+
+    scanned = []
+    for upper_level_tag, start, end in find_sections(mapped):
+        chunks = split_section(mapped, lower_level_tags[upper_level_tag], start, end, chunk_size)
+        scanned.append((upper_level_tag, chunks))
+    return scanned
@@ -0,0 +1,306 @@
+'''
+Binary snapshots of a loaded world.
+
+After the first load of a legends export, the whole everything dict
+(elements, *_names, *_offset and the event links) is pickled into a
+snapshot file in the user's cache directory, named after the XML file's
+path. The snapshot header records the size, modification time and SHA-1
+hash of the XML file it was built from, plus the layout and HMAC-SHA256
+of the rest of the file:
+
+    magic | version | xml size | xml mtime (ns) | xml sha1 | payload length | buffer count | hmac
+    payload | buffer table | buffers
+
+Arrays of at least MAPPED_ARRAY_BYTES (the event columns, the participant
+and timeline indexes, the longer name and word postings...) are not in the
+pickled payload. Their contents are stored after it, out of band, each at
+an offset aligned to BUFFER_ALIGNMENT that the buffer table gives with its
+length.
+
+Unpickling runs code named by the data, so a snapshot is only loaded if
+its HMAC matches the one computed with this user's secret key, which is
+created in the cache directory on first use and only readable by the
+user. A snapshot made elsewhere, or tampered with, is never unpickled.
+
+Reopening the same file maps the snapshot into memory, skipping XML
+parsing entirely. The out of band arrays are not copied: they come back
+as read-only memoryviews of the mapping, cast to the array's type, which
+can be indexed, sliced, iterated and searched like the arrays, and whose
+pages are shared with the OS's file cache. The rest of the world (records,
+dicts, strings and short arrays) is unpickled into new objects as usual.
+A snapshot whose key does not match the XML file, or that fails its HMAC,
+is ignored so that the world is parsed and the snapshot rebuilt.
+'''
+
+from array import array
+import copyreg
+import hashlib
+import hmac
+import io
+import mmap
+import os
+import pickle
+import struct
+
+SNAPSHOT_MAGIC = b'DFTSNAP\x00'
+
+#Bump this whenever the layout of the everything dict changes, so old
+#snapshots are rebuilt instead of being loaded into newer code.
+SNAPSHOT_VERSION = 14
+
+SNAPSHOT_EXTENSION = '.snapshot'
+
+HEADER = struct.Struct('<8sIQq20sQQ32s')
+
+#(offset, length) of each out of band buffer, after the payload
+BUFFER_ENTRY = struct.Struct('<QQ')
+
+#Arrays this big or bigger are mapped instead of unpickled
+MAPPED_ARRAY_BYTES = 4096
+
+#Alignment of the out of band buffers in the file, enough for any array type
+BUFFER_ALIGNMENT = 8
+
+HASH_BLOCKSIZE = 1048576 # one megabyte
+
+KEY_FILENAME = 'snapshot.key'
+KEY_BYTES = 32
+
+'''
+Return the directory snapshots are kept in, creating it if needed:
+%LOCALAPPDATA%/dorftome on Windows, $XDG_CACHE_HOME/dorftome or
+~/.cache/dorftome elsewhere.
+'''
+def cache_directory():
+    base = os.environ.get('LOCALAPPDATA') if os.name == 'nt' else os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    directory = os.path.join(base, 'dorftome')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+'''
+Return the snapshot filename used for a given XML file: its name, after
+a hash of its absolute path, so that exports with the same name in
+different folders get different snapshots.
+'''
+def snapshot_filename(filename):
+    path = os.path.abspath(filename)
+    path_hash = hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    return os.path.join(cache_directory(), path_hash + '-' + os.path.basename(path) + SNAPSHOT_EXTENSION)
+
+'''
+Return this user's secret key for authenticating snapshots, creating it
+the first time.
+'''
+def snapshot_key():
+    key_file = os.path.join(cache_directory(), KEY_FILENAME)
+    try:
+        with open(key_file, 'rb') as f:
+            key = f.read()
+        if len(key) == KEY_BYTES:
+            return key
+    except OSError:
+        pass
+
+    key = os.urandom(KEY_BYTES)
+    temp_file = key_file + '.tmp'
+    fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    os.replace(temp_file, key_file)
+    return key
+
+'''
+Return the HMAC of the parts of a snapshot after its header.
+'''
+def payload_hmac(key, parts):
+    mac = hmac.new(key, digestmod=hashlib.sha256)
+    for part in parts:
+        mac.update(part)
+    return mac.digest()
+
+#==============OUT OF BAND ARRAYS=============
+
+'''
+Return a read-only view of an out of band buffer as items of a type code,
+which is what a mapped array is unpickled as.
+'''
+def mapped_array(typecode, buffer):
+    return memoryview(buffer).cast(typecode)
+
+'''
+Pickle an array. Big ones are pickled out of band, and so are the mapped
+arrays of a loaded snapshot, which are memoryviews.
+'''
+def reduce_array(values):
+    typecode = values.format if isinstance(values, memoryview) else values.typecode
+    if len(values) * values.itemsize < MAPPED_ARRAY_BYTES:
+        if isinstance(values, memoryview):
+            values = array(typecode, values)
+        return values.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+    return mapped_array, (typecode, pickle.PickleBuffer(values))
+
+#How the snapshot pickler saves arrays; everything else is saved as usual
+SNAPSHOT_DISPATCH = copyreg.dispatch_table.copy()
+SNAPSHOT_DISPATCH[array] = reduce_array
+SNAPSHOT_DISPATCH[memoryview] = reduce_array
+
+'''
+Return the SHA-1 digest of a file's contents.
+'''
+def hash_file(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCKSIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.digest()
+
+'''
+Return the (size, mtime) part of the snapshot key for an XML file.
+'''
+def file_key(filename):
+    statinfo = os.stat(filename)
+    return statinfo.st_size, statinfo.st_mtime_ns
+
+'''
+Load the snapshot for the given XML file. Returns the everything dict,
+or None if there is no usable snapshot. The mapping of a loaded snapshot
+stays open for as long as its mapped arrays are in use.
+'''
+def load_snapshot(filename):
+    try:
+        snapshot_file = snapshot_filename(filename)
+    except OSError:
+        return None
+    if not os.path.exists(snapshot_file):
+        return None
+
+    with open(snapshot_file, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #empty file
+            print("Ignoring empty snapshot: " + snapshot_file)
+            return None
+
+    everything = read_snapshot(mapped, filename, snapshot_file)
+    if everything is None:
+        try:
+            mapped.close()
+        except BufferError:
+            #views made before unpickling failed; the mapping is closed
+            #once they are collected
+            pass
+    return everything
+
+'''
+Check a mapped snapshot against the XML file and its HMAC, and unpickle
+it. Returns the everything dict, or None after printing why the snapshot
+can't be used.
+'''
+def read_snapshot(mapped, filename, snapshot_file):
+    if len(mapped) < HEADER.size:
+        print("Ignoring truncated snapshot: " + snapshot_file)
+        return None
+
+    magic, version, snap_size, snap_mtime, snap_hash, payload_length, buffer_count, mac = \
+        HEADER.unpack_from(mapped, 0)
+
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        print("Ignoring snapshot from another version: " + snapshot_file)
+        return None
+
+    size, mtime = file_key(filename)
+    if snap_size != size:
+        print("Ignoring stale snapshot: " + snapshot_file)
+        return None
+
+    #Only rehash the file if it was touched since the snapshot was made;
+    #a copied or re-saved export with the same contents is still valid.
+    if snap_mtime != mtime and hash_file(filename) != snap_hash:
+        print("Ignoring stale snapshot: " + snapshot_file)
+        return None
+
+    table_start = HEADER.size + payload_length
+    table_end = table_start + BUFFER_ENTRY.size * buffer_count
+    if table_end > len(mapped):
+        print("Ignoring truncated snapshot: " + snapshot_file)
+        return None
+
+    view = memoryview(mapped)
+    if not hmac.compare_digest(payload_hmac(snapshot_key(), [view[HEADER.size:]]), mac):
+        print("Ignoring unauthenticated snapshot: " + snapshot_file)
+        return None
+
+    buffers = []
+    for i in range(buffer_count):
+        offset, length = BUFFER_ENTRY.unpack_from(mapped, table_start + BUFFER_ENTRY.size * i)
+        if offset < table_end or offset + length > len(mapped):
+            print("Ignoring corrupt snapshot: " + snapshot_file)
+            return None
+        buffers.append(view[offset:offset + length])
+
+    try:
+        return pickle.loads(view[HEADER.size:table_start], buffers=buffers)
+    except Exception as e:
+        print("Ignoring corrupt snapshot: " + snapshot_file + " (" + str(e) + ")")
+        return None
+
+'''
+Write a snapshot of everything for the given XML file. The snapshot is
+written to a temporary file first and then moved into place, so an
+interrupted write never leaves a half-written snapshot behind.
+'''
+def write_snapshot(filename, everything):
+    try:
+        snapshot_file = snapshot_filename(filename)
+    except OSError as e:
+        print("Could not create the snapshot directory: " + str(e))
+        return False
+    temp_file = snapshot_file + '.tmp'
+
+    size, mtime = file_key(filename)
+    file_hash = hash_file(filename)
+
+    buffers = []
+    stream = io.BytesIO()
+    pickler = pickle.Pickler(stream, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=buffers.append)
+    pickler.dispatch_table = SNAPSHOT_DISPATCH
+    pickler.dump(everything)
+    payload = stream.getbuffer()
+
+    #lay the buffers out after the payload and the table of their offsets
+    table = bytearray()
+    parts = [payload, table]
+    position = HEADER.size + len(payload) + BUFFER_ENTRY.size * len(buffers)
+    for buffer in buffers:
+        raw = buffer.raw()
+        padding = -position % BUFFER_ALIGNMENT
+        position += padding
+        table += BUFFER_ENTRY.pack(position, raw.nbytes)
+        parts.append(bytes(padding))
+        parts.append(raw)
+        position += raw.nbytes
+
+    try:
+        header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, size, mtime, file_hash,
+                             len(payload), len(buffers), payload_hmac(snapshot_key(), parts))
+        with open(temp_file, 'wb') as f:
+            f.write(header)
+            for part in parts:
+                f.write(part)
+        os.replace(temp_file, snapshot_file)
+    except OSError as e:
+        print("Could not write snapshot " + snapshot_file + ": " + str(e))
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        return False
+
+    print("Wrote snapshot: " + snapshot_file)
+    return True
@@ -0,0 +1,172 @@
+'''
+Spatial indexes over the coordinates of sites and regions.
+
+Coordinates are world tiles, written as "x,y" in the export (regions list
+all their tiles as "x,y|x,y|..."). A SpatialIndex stores them as integer
+points in a grid of square cells, so exact lookups are a dict access and
+nearest and radius queries only look at the cells around the point.
+'''
+
+from array import array
+
+#Width of a grid cell, in world tiles
+CELL_SIZE = 16
+
+#Sections the spatial indexes are built from
+COORDS_SECTIONS = ['sites', 'regions']
+
+'''
+Return the (x, y) integer pair of a "x,y" coordinates string, or None if
+there are no valid coordinates.
+'''
+def parse_coords(coords):
+    try:
+        x, y = coords.split(',')
+        return int(x), int(y)
+    except (AttributeError, ValueError):
+        return None
+
+'''
+Return the cells at a distance of exactly ring cells (in either axis)
+from the cell (cx, cy).
+'''
+def ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield cx, cy
+        return
+    for dx in range(-ring, ring + 1):
+        yield cx + dx, cy - ring
+        yield cx + dx, cy + ring
+    for dy in range(-ring + 1, ring):
+        yield cx - ring, cy + dy
+        yield cx + ring, cy + dy
+
+class SpatialIndex():
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        #points, in the order they were added
+        self.xs = array('i')
+        self.ys = array('i')
+        self.ids = array('i')
+        #points in each cell, and the first element at each tile
+        self.cells = {}
+        self.exact_ids = {}
+        #bounds of the occupied cells
+        self.min_cell = None
+        self.max_cell = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, x, y, element_id):
+        point = len(self.ids)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.ids.append(element_id)
+
+        cell = (x // self.cell_size, y // self.cell_size)
+        if cell not in self.cells:
+            self.cells[cell] = array('I')
+        self.cells[cell].append(point)
+        self.exact_ids.setdefault((x, y), element_id)
+
+        if self.min_cell is None:
+            self.min_cell = cell
+            self.max_cell = cell
+        else:
+            self.min_cell = (min(self.min_cell[0], cell[0]), min(self.min_cell[1], cell[1]))
+            self.max_cell = (max(self.max_cell[0], cell[0]), max(self.max_cell[1], cell[1]))
+
+    def distance_squared(self, point, x, y):
+        dx = self.xs[point] - x
+        dy = self.ys[point] - y
+        return dx * dx + dy * dy
+
+    '''
+    Return the id of the first element at exactly (x, y), or -1.
+    '''
+    def exact(self, x, y):
+        return self.exact_ids.get((x, y), -1)
+
+    '''
+    Return the id of the element nearest to (x, y), or -1 if the index is
+    empty. Ties go to the element added first.
+    '''
+    def nearest(self, x, y):
+        if not self.ids:
+            return -1
+        cx = x // self.cell_size
+        cy = y // self.cell_size
+        max_ring = max(abs(cx - self.min_cell[0]), abs(cx - self.max_cell[0]),
+                       abs(cy - self.min_cell[1]), abs(cy - self.max_cell[1]))
+
+        best = None
+        for ring in range(max_ring + 1):
+            for cell in ring_cells(cx, cy, ring):
+                for point in self.cells.get(cell, ()):
+                    candidate = (self.distance_squared(point, x, y), point)
+                    if best is None or candidate < best:
+                        best = candidate
+            #every point in the next ring is at least this far away
+            reach = ring * self.cell_size
+            if best is not None and best[0] <= reach * reach:
+                break
+        return self.ids[best[1]]
+
+    '''
+    Return the ids of every element within radius tiles of (x, y), nearest
+    first.
+    '''
+    def within(self, x, y, radius):
+        found = []
+        first_cx = (x - radius) // self.cell_size
+        last_cx = (x + radius) // self.cell_size
+        first_cy = (y - radius) // self.cell_size
+        last_cy = (y + radius) // self.cell_size
+        for cx in range(first_cx, last_cx + 1):
+            for cy in range(first_cy, last_cy + 1):
+                for point in self.cells.get((cx, cy), ()):
+                    distance = self.distance_squared(point, x, y)
+                    if distance <= radius * radius:
+                        found.append((distance, point))
+        found.sort()
+        return [self.ids[point] for _, point in found]
+
+'''
+Return the (id, coords string) of the elements of a section, by id. In
+lazy loading mode the coords were read when the file was indexed, so the
+elements are not parsed for them.
+'''
+def section_coords(section, everything):
+    if section + '_coords' in everything:
+        return sorted(everything[section + '_coords'].items())
+    return [(element['id'], element.get('coords')) for element in everything.get(section, ())
+            if element is not None]
+
+'''
+Build the spatial index of the sites of a world.
+'''
+def build_site_index(everything):
+    index = SpatialIndex()
+    for site_id, site_coords in section_coords('sites', everything):
+        coords = parse_coords(site_coords)
+        if coords is not None:
+            index.add(coords[0], coords[1], site_id)
+    return index
+
+'''
+Build an index of the tiles of each region, so that exact(x, y) gives the
+region a tile is in. Only some exports list the tiles of regions; for the
+others the index is empty.
+'''
+def build_region_index(everything):
+    index = SpatialIndex()
+    for region_id, region_coords in section_coords('regions', everything):
+        if not isinstance(region_coords, str):
+            continue
+        for tile in region_coords.split('|'):
+            coords = parse_coords(tile)
+            if coords is not None:
+                index.add(coords[0], coords[1], region_id)
+    return index
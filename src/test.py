@@ -1,23 +1,13 @@
 #!/usr/bin/env python3
-from xml_parsing import XML_Parser
+from world import World
 from family_tree_gen import build_tree_from_hf
-from attribute_getters import *
 
 def main():
 
     xml_file = 'dwarf.xml'
     
-    parser = XML_Parser()
-    try:
-        everything = parser.load_dict(xml_file)
-    except Exception as e:
-        print(e)
-        everything = None
-    
-    if everything == None:
-        new_filename = parser.handle_invalid_file(xml_file)
-        everything = parser.load_dict(new_filename)
+    world = World.load(xml_file)
             
-    build_tree_from_hf(get_element(5461, 'historical_figures', everything), everything, 0)
+    build_tree_from_hf(world.get('historical_figures', 5461), world.everything, 0)
             
 main()
@@ -0,0 +1,160 @@
+'''
+Chronological index of the historical events of a world.
+
+Each event gets a sort key, year * SECONDS_PER_YEAR + seconds72, so that
+comparing keys compares dates. Events at the beginning of the world (year
+-1) or without a time of year sort first in their year. The Timeline keeps
+the key of every event, by event id, and the ids of all events sorted by
+key, so that the events between two dates are found with a binary search
+and read off in order. Events that were not loaded have no key.
+
+The historical eras of a world are consecutive year ranges, each from its
+start_year to the start of the next era, so an era's events are the events
+of its years.
+'''
+
+from array import array
+from bisect import bisect_left
+
+#There are 403200 seconds in a DF year.
+SECONDS_PER_YEAR = 403200
+
+#Key of the events that were not loaded
+NO_KEY = -2**63
+
+'''
+Return the sort key of an event given its year and seconds72 (either may
+be None).
+'''
+def event_key(year, seconds72):
+    if year is None:
+        year = -1
+    if seconds72 is None or seconds72 < 0:
+        seconds72 = 0
+    return year * SECONDS_PER_YEAR + seconds72
+
+'''
+Return the keys of the events in an EventStore, by index in the store.
+'''
+def store_keys(events):
+    years = [None] * len(events)
+    seconds = [None] * len(events)
+    for index, year in events.scan('year'):
+        years[index] = year
+    for index, seconds72 in events.scan('seconds72'):
+        seconds[index] = seconds72
+
+    keys = array('q', [NO_KEY]) * len(events)
+    for index, type_code in enumerate(events.types):
+        if type_code != 0:
+            keys[index] = event_key(years[index], seconds[index])
+    return keys
+
+class Timeline():
+
+    def __init__(self, offset, keys):
+        #id of the first event, and each event's key by index (id - offset)
+        self.offset = offset
+        self.keys = keys
+
+        #ids of the events, sorted by key then id, with their keys
+        stored = [index for index in range(len(keys)) if keys[index] != NO_KEY]
+        indices = sorted(stored, key=keys.__getitem__)
+        self.order = array('i', (index + offset for index in indices))
+        #whether the file lists the events in chronological order, as
+        #Dwarf Fortress writes them
+        self.in_file_order = (indices == stored)
+        self.sorted_keys = array('q', (keys[index] for index in indices))
+
+        #start_year of each era, by index (id - era offset)
+        self.era_offset = 0
+        self.era_years = []
+
+    def __len__(self):
+        return len(self.order)
+
+    '''
+    Return the sort key of an event, or NO_KEY if it was not loaded.
+    '''
+    def key(self, event_id):
+        index = event_id - self.offset
+        if index < 0 or index >= len(self.keys):
+            return NO_KEY
+        return self.keys[index]
+
+    '''
+    Return the ids of the events with first_key <= key < end_key, in
+    chronological order.
+    '''
+    def between_keys(self, first_key, end_key):
+        start = bisect_left(self.sorted_keys, first_key)
+        end = bisect_left(self.sorted_keys, end_key, start)
+        return self.order[start:end]
+
+    '''
+    Return the ids of the events from first_year to last_year (both
+    included), in chronological order.
+    '''
+    def between_years(self, first_year, last_year):
+        return self.between_keys(first_year * SECONDS_PER_YEAR, (last_year + 1) * SECONDS_PER_YEAR)
+
+    '''
+    Return the ids of the events from one date to another (both
+    included), in chronological order. Dates are (year, seconds72) pairs.
+    '''
+    def between_dates(self, first_date, last_date):
+        return self.between_keys(event_key(*first_date), event_key(*last_date) + 1)
+
+    '''
+    Return a list of event ids sorted chronologically. Events with the
+    same date keep their order.
+    '''
+    def sort_events(self, event_ids):
+        return sorted(event_ids, key=self.key)
+
+    def set_eras(self, era_offset, era_years):
+        self.era_offset = era_offset
+        self.era_years = era_years
+
+    '''
+    Return the (first year, last year) of an era. The last year of the
+    last era is None.
+    '''
+    def era_range(self, era_id):
+        first_year = self.era_years[era_id - self.era_offset]
+        later_years = [year for year in self.era_years if year > first_year]
+        if not later_years:
+            return first_year, None
+        return first_year, min(later_years) - 1
+
+    '''
+    Return the ids of the events of an era, in chronological order.
+    '''
+    def era_events(self, era_id):
+        first_year, last_year = self.era_range(era_id)
+        if last_year is None:
+            return self.between_keys(first_year * SECONDS_PER_YEAR, 2**63 - 1)
+        return self.between_years(first_year, last_year)
+
+'''
+Build the timeline of a world. In lazy loading mode the keys were already
+read while indexing the file, as everything['event_keys'].
+'''
+def build_timeline(everything):
+    if 'event_keys' in everything:
+        keys = everything.pop('event_keys')
+    elif 'historical_events' in everything:
+        keys = store_keys(everything['historical_events'])
+    else:
+        keys = array('q')
+    timeline = Timeline(max(everything.get('historical_events_offset', 0), 0), keys)
+
+    eras = everything.get('historical_eras')
+    if eras:
+        era_years = []
+        for era in eras:
+            start_year = era.get('start_year') if era is not None else None
+            era_years.append(start_year if isinstance(start_year, int) else -1)
+        timeline.set_eras(max(everything['historical_eras_offset'], 0), era_years)
+
+    return timeline
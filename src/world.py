@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''
+Headless API for loading and browsing a world, without Qt.
+
+    from world import World
+    world = World.load('region1-legends.xml')
+    world.get('historical_figures', 12)
+    world.render('hif12')
+    world.search('urist')
+
+Modules are only imported when first needed, so loading a world costs
+only the loader's own imports, and nothing from the GUI is ever imported.
+The GUI is a client of this API too.
+
+Run as a script to load (and time) a file from the command line:
+
+    python3 world.py region1-legends.xml --threads 0 --page hif12
+'''
+import time
+
+class World():
+
+    def __init__(self, everything, filename=None):
+        self.everything = everything
+        self.filename = filename
+
+    '''
+    Load a world from a legends export. settings overrides values from
+    legend_reader.cfg, as a dict like {'default': {'lazy_loading': 'True'}}.
+    '''
+    @classmethod
+    def load(cls, filename, settings=None):
+        import xml_parsing
+        return cls(xml_parsing.load_dict(filename, settings), filename)
+
+    '''
+    Return an element given its type (e.g. 'historical_figures') and id.
+    '''
+    def get(self, a_type, an_id):
+        from attribute_getters import get_element
+        return get_element(an_id, a_type, self.everything)
+
+    '''
+    Return the capitalized name of an element.
+    '''
+    def name(self, a_type, an_id):
+        from attribute_getters import get_name
+        return get_name(an_id, a_type, self.everything)
+
+    '''
+    Return every (type, id) pair of the elements with the given name.
+    '''
+    def find(self, name):
+        from attribute_getters import get_ids_and_types
+        return get_ids_and_types(name, self.everything)
+
+    '''
+    Return the ids of the events an element takes part in, in
+    chronological order.
+    '''
+    def events(self, a_type, an_id):
+        from attribute_getters import get_element_events
+        return get_element_events(an_id, a_type, self.everything)
+
+    '''
+    Return the ids of the events from first_year to last_year (both
+    included), in chronological order.
+    '''
+    def events_between(self, first_year, last_year):
+        from attribute_getters import get_events_between
+        return get_events_between(first_year, last_year, self.everything)
+
+    '''
+    Return the HTML page for a page link, such as 'hif12' or 'sit4'.
+    slices is the number of slices of its event list to show.
+    '''
+    def render(self, page_link, slices=1):
+        import page_builders
+        return page_builders.dispatch_link(page_link, self.everything, slices)
+
+    '''
+    Return the HTML of the next events of a partly shown event list,
+    given the link at its end (e.g. 'evlhif12:200'). It ends with the
+    link to the events after those, if there are more.
+    '''
+    def render_event_slice(self, slice_link):
+        import page_builders
+        return page_builders.build_event_slice(slice_link, self.everything)
+
+    '''
+    Return the capitalized names containing the given text, with matches
+    at the start of a word first. At most limit names are returned, if
+    limit is given.
+    '''
+    def search(self, text, limit=None):
+        return self.everything['name_search'].search(text, limit)
+
+    '''
+    Return a page of the results of a search bar query, as (name, type,
+    id) rows for the elements of count names from the start-th on, and
+    whether there are more. Queries can have facets, e.g.
+    'race:dwarf associated_type:vampire' or 'type:tower', and then count
+    elements are returned.
+    '''
+    def search_elements(self, text, count, start=0):
+        from facet_index import search_elements
+        return search_elements(text, count, start, self.everything)
+
+    '''
+    Return the (type, id) of the elements that match every facet of a
+    query and whose names contain the rest of it.
+    '''
+    def search_facets(self, query):
+        from facet_index import parse_facets, search_facets
+        facets, text = parse_facets(query)
+        return search_facets(facets, text, self.everything)
+
+    '''
+    Return the (event id, score) pairs of the events matching a
+    full-text query, such as 'necromancer', '"old age"' or
+    'struck OR shot -goblin', best first.
+    '''
+    def search_events(self, query, limit=None):
+        from event_text_index import search_events
+        return search_events(query, self.everything, limit)
+
+    '''
+    Return the HTML page of the events matching a full-text query.
+    '''
+    def render_event_search(self, query):
+        import page_builders
+        return page_builders.build_event_search_page(query, self.everything)
+
+    '''
+    Return the hit rates and sizes of the display name table, the link
+    cache and the page cache, for tuning link_cache_size and
+    page_cache_megabytes.
+    '''
+    def cache_stats(self):
+        stats = self.everything['display_cache'].stats()
+        stats['pages'] = self.everything['page_cache'].stats()
+        return stats
+
+    '''
+    Return the sorted, lower case names of every element with a name.
+    '''
+    def name_list(self):
+        return self.everything['name_index'].name_list()
+
+'''
+Load a file from the command line, print how long it took, and optionally
+render a page or run a search.
+'''
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Load a Dwarf Fortress legends export without the GUI.")
+    parser.add_argument('filename', help="legends XML file")
+    parser.add_argument('--threads', help="parsing processes (0 for the main process only)")
+    parser.add_argument('--lazy', action='store_true', help="only index the file")
+    parser.add_argument('--no-snapshot', action='store_true', help="don't read or write a snapshot")
+    parser.add_argument('--profile', action='store_true', help="print a JSON profile of the load")
+    parser.add_argument('--page', action='append', default=[], help="render a page, e.g. hif12")
+    parser.add_argument('--search', action='append', default=[], help="search for names")
+    parser.add_argument('--events', action='append', default=[], help="search the text of events")
+    args = parser.parse_args()
+
+    settings = {'default': {}, 'cache': {}, 'profiling': {}}
+    if args.threads is not None:
+        settings['default']['num_parsing_threads'] = args.threads
+    if args.lazy:
+        settings['default']['lazy_loading'] = 'True'
+    if args.no_snapshot:
+        settings['cache']['use_snapshots'] = 'False'
+    if args.profile:
+        settings['profiling']['profile_loading'] = 'True'
+
+    start_time = time.perf_counter()
+    world = World.load(args.filename, settings)
+    print("Loaded in %.2fs" % (time.perf_counter() - start_time))
+
+    for page_link in args.page:
+        start_time = time.perf_counter()
+        html = world.render(page_link)
+        print("Rendered %s (%d characters) in %.3fs" % (page_link, len(html), time.perf_counter() - start_time))
+    if args.page:
+        print("Caches: " + str(world.cache_stats()))
+
+    for text in args.search:
+        start_time = time.perf_counter()
+        results = world.search(text)
+        print("Found %d names for '%s' in %.3fs" % (len(results), text, time.perf_counter() - start_time))
+        for name in results[:10]:
+            print("  " + name)
+
+    for query in args.events:
+        start_time = time.perf_counter()
+        results = world.search_events(query)
+        print("Found %d events for '%s' in %.3fs" % (len(results), query, time.perf_counter() - start_time))
+        for event_id, score in results[:10]:
+            print("  %d (%.2f) %s" % (event_id, score, world.get('historical_events', event_id)['type']))
+
+if __name__ == '__main__':
+    main()
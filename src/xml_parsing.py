@@ -1,199 +1,183 @@
 #!/usr/bin/env python3
-from lxml import etree
-from lxml.etree import iterparse
-
-from attribute_getters import *
 from global_vars import *
-from event_processing import event_type_dispatcher
-from dict_loading import load_element, parse_file
-from connect_elements import parse_historical_events
-
-import functools
+from dict_loading import parse_file, load_range_timed, open_mapped_file, new_everything, start_section, add_timed_range
+from section_scan import scan_file
+from connect_elements import parse_historical_events, build_indexes
+from snapshot import load_snapshot, write_snapshot
+from lazy_loading import index_file
+from load_profiler import LoadProfiler
+from display_cache import DisplayCache
+from event_text_index import build_event_text_index
+from facet_index import build_facet_index
+from helpers import LRUCache
+
+import collections
+import mmap
 import os
-import codecs
 import time
+import sys
 import configparser
 
-from multiprocessing import Pool
-
-class ProfilerStruct:
-    PROFILE_TIME=False
-    PROFILE_MEMORY=False
-    time_array=[]
-    memory_array=[]
-    start_time=0
-
-'''
-Process an XML file with invalid characters and replace them with 
-question marks.
-'''
-def handle_invalid_file(filename):
-    print("Attempting to fix invalid file: " + filename)
-    BLOCKSIZE = 1048576 # one megabyte
-    
-    tempfile = filename.replace(".xml", "-fixed.xml")
-
-    statinfo = os.stat(filename)
-    print("File size: " + str(statinfo.st_size) + " bytes")
-
-    counter = 0
-
-    with codecs.open(filename, "r", 'us-ascii', errors='replace') as sourceFile:
-        with open(tempfile, "w") as targetFile:
-            while True:
-                counter += BLOCKSIZE
-                percent_done = counter / statinfo.st_size
-                if counter % (10 * BLOCKSIZE) < BLOCKSIZE:
-                    print("\r" + str(percent_done))
-                contents = sourceFile.read(BLOCKSIZE)
-                
-                if "�" in contents:
-                    contents = contents.replace("�", "?")
-                    
-                if not contents:
-                    break
-                    
-                targetFile.write(contents)
-
-    print("Fixed file")
-    return tempfile
+from multiprocessing import Pool, cpu_count
 
 '''
 Parse the entire XML file 
-'''
-def load_dict(filename):
-    profiler = ProfilerStruct()
 
+settings overrides values from legend_reader.cfg, as a dict like
+{'default': {'num_parsing_threads': '0'}}.
+'''
+def load_dict(filename, settings=None):
     cfg = configparser.ConfigParser()
     cfg.read(os.path.join(RESOURCES_DIR, 'legend_reader.cfg'))
-    num_parsing_threads = int(cfg.get('default',"num_parsing_threads"))
+    if settings is not None:
+        cfg.read_dict(settings)
     
-    profiler.PROFILE_TIME = (cfg.get('profiling',"print_parsing_timing") == "True")
-    profiler.PROFILE_MEMORY = (cfg.get('profiling',"print_parsing_memory") == "True")
-
-    try:
-        from pympler.asizeof import asizeof
-    except ImportError:
-        profiler.PROFILE_MEMORY = False
-        profiler.PROFILE_TIME = False
-
-    everything = {}
+    everything = load_everything(filename, cfg)
     
+    #caches of names, links and pages. They start empty for every load,
+    #and are never saved in snapshots.
+    everything['display_cache'] = DisplayCache(int(cfg.get('cache',"link_cache_size")))
+    page_cache_bytes = int(float(cfg.get('cache',"page_cache_megabytes")) * 2**20)
+    everything['page_cache'] = LRUCache(page_cache_bytes, sys.getsizeof)
+    
+    return everything
+
+'''
+Load the world from a snapshot, the lazy index or by parsing the file,
+depending on the configuration.
+'''
+def load_everything(filename, cfg):
+    num_parsing_threads = int(cfg.get('default',"num_parsing_threads"))
+    parse_chunk_size = int(cfg.get('default',"parse_chunk_kb")) * 1024
+    xml_encoding = cfg.get('default',"xml_encoding")
+    
+    use_snapshots = (cfg.get('cache',"use_snapshots") == "True")
+    lazy_loading = (cfg.get('default',"lazy_loading") == "True")
+    lazy_cache_size = int(cfg.get('cache',"lazy_cache_size"))
+    event_text_index = (cfg.get('search',"event_text_index") == "True")
+    
+    profiler = LoadProfiler(cfg.get('profiling',"profile_loading") == "True",
+                            cfg.get('profiling',"profile_memory") == "True")
+    profile_output = cfg.get('profiling',"profile_output")
+
+    #Only index the file, and parse elements when they are first used
+    if lazy_loading:
+        print("Indexing file: " + filename)
+        profiler.start_load(filename, 'lazy')
+        with profiler.phase('index'):
+            everything = index_file(filename, xml_encoding, lazy_cache_size)
+        with profiler.phase('link'):
+            parse_historical_events(everything)
+        with profiler.phase('indexes'):
+            build_indexes(everything)
+        print("Finished indexing")
+        profiler.emit(profile_output)
+        return everything
+
+    #Reuse the snapshot of a previous load of this file if there is one
+    if use_snapshots:
+        profiler.start_load(filename, 'snapshot')
+        with profiler.phase('snapshot load'):
+            everything = load_snapshot(filename)
+        if everything is not None:
+            print("Loaded snapshot of file: " + filename)
+            profiler.emit(profile_output)
+            return everything
 
     print("Loading file: " + filename)
     
-    tag_mapping = {'region': 'regions', \
-                   'underground_region': 'underground_regions', \
-                   'site': 'sites', \
-                   'world_construction': 'world_constructions', \
-                   'artifact':'artifacts', \
-                   'historical_figure': 'historical_figures', \
-                   'entity_population': 'entity_populations',\
-                   'entity': 'entities',\
-                   'historical_event': 'historical_events',\
-                   'historical_event_collection': 'historical_event_collections',\
-                   'historical_era':'historical_eras'}
-
-    lower_level_tags = tag_mapping.keys()
-    upper_level_tags = tag_mapping.values()
-    
-    #PROFILING
-    if profiler.PROFILE_TIME:
-        profiler.time_array = []
-        profiler.start_time = time.time()
-    
-    if profiler.PROFILE_MEMORY:
-        profiler.memory_array = []
-        profiler.memory_array.append(("At beginning : ", asizeof(everything)))
-    
-    #set up thread pool
-    if num_parsing_threads < 0:
-        #create num threads = cpu count
-        pool = Pool()
-    elif num_parsing_threads > 0:
-        #create required size pool
-        pool = Pool(num_parsing_threads)
-    else:
-        pool = None
-    
     #using multi-threading to parse file
-    if pool:
-        for _, element in etree.iterparse(filename):
-            if element.tag in upper_level_tags:
-                #Use partial from functools to create something we can call back to while
-                #passing the everything dict.
-                add_elements_callback = functools.partial(add_elements, profiler=profiler, everything=everything)
-
-                #Call parser to process the element
-                #The element must be sent as a string
-                #Will callback to add elements to actually add to everything dict
-                pool.apply_async(load_element, 
-                                 args=(etree.tostring(element), element.tag), 
-                                 callback = add_elements_callback)
-                close_element(element)
-        #wait for all threads to stop
-        pool.close()
-        pool.join()
+    if num_parsing_threads != 0:
+        if num_parsing_threads < 0:
+            #create num processes = cpu count
+            num_parsing_threads = cpu_count()
+        profiler.start_load(filename, 'parallel', num_parsing_threads)
+        everything = parse_file_parallel(filename, num_parsing_threads, parse_chunk_size, xml_encoding, profiler)
         
     #using only main thread to parse file
     else:
-        #use parser object to parse file
-        everything = parse_file(filename)
+        profiler.start_load(filename, 'serial', 1)
+        everything = parse_file(filename, xml_encoding, parse_chunk_size, profiler)
     
     print("Finished parsing")
     
-    if profiler.PROFILE_TIME:
-        profiler.time_array.append(['waiting to finish parsing', time.time() - profiler.start_time])
-        profiler.start_time = time.time()
-        
-    parse_historical_events(everything)
-    
-    if profiler.PROFILE_TIME:
-        profiler.time_array.append(['parsing historical events', time.time() - profiler.start_time])
+    if everything['quarantine']:
+        print("Skipped " + str(len(everything['quarantine'])) + " malformed elements:")
+        for tag, element_id, message in everything['quarantine'][:10]:
+            print("  " + tag + " " + str(element_id) + ": " + message)
     
-    if profiler.PROFILE_MEMORY:
-        profiler.memory_array.append(("After parsing historical events: ", asizeof(everything)))
+    with profiler.phase('link'):
+        parse_historical_events(everything)
+
+    with profiler.phase('indexes'):
+        build_indexes(everything)
+        everything['facet_index'] = build_facet_index(everything)
+
+    if event_text_index:
+        with profiler.phase('event text index'):
+            everything['event_text_index'] = build_event_text_index(everything, num_parsing_threads)
+
+    if use_snapshots:
+        with profiler.phase('snapshot write'):
+            write_snapshot(filename, everything)
     
-    #PRINT PROFILING INFO
-    if profiler.PROFILE_TIME:
-        total_time = 0
-        print("\n\nTIMING INFO:")
-        for e, t in profiler.time_array:
-            print("Time taken for " + e + ": %.2fs" % t)
-            total_time += t
-        print("Total time: %.2fs" % total_time)
-        
-    if profiler.PROFILE_MEMORY:
-        print("\n\nMEMORY INFO:")
-        for i in range(0, len(profiler.memory_array)):
-            difference = 0
-            if (i >= 1):
-                difference = profiler.memory_array[i][1] - profiler.memory_array[i-1][1]
-            print(profiler.memory_array[i][0] + " : " + str(profiler.memory_array[i][1]/1024) + " KB || Difference: " + str(difference/1024) + " KB")
+    profiler.emit(profile_output)
             
     return everything
 
-def close_element(element):
-    element.clear()                 # clean up children
-    while element.getprevious() is not None:
-        del element.getparent()[0]  # clean up preceding siblings
-  
+'''
+Parse the file using a pool of worker processes. The file is memory-mapped
+and pre-scanned for section and element boundaries, and each worker parses
+byte ranges from its own mapping of the file, so no section is ever built
+or serialized in the main process. At most two ranges per worker are in
+flight at once, and results are merged in file order as they arrive.
+'''
+def parse_file_parallel(filename, num_parsing_threads, chunk_size, encoding, profiler):
+    everything = new_everything()
+
+    with profiler.phase('pre-scan'):
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with mapped:
+            sections = scan_file(mapped, chunk_size)
+            profiler.add_bytes_read(len(mapped))
+
+    with profiler.phase('parse'):
+        #set up process pool
+        pool = Pool(num_parsing_threads, initializer=open_mapped_file, initargs=(filename, encoding))
+        max_in_flight = 2 * num_parsing_threads
+
+        pending = collections.deque()
+        try:
+            for upper_level_tag, chunks in sections:
+                start_section(upper_level_tag, everything)
+
+                for start, end in chunks:
+                    #wait for the oldest range before queueing more
+                    if len(pending) >= max_in_flight:
+                        add_elements(pending.popleft(), profiler, everything)
+
+                    result = pool.apply_async(load_range_timed, args=(upper_level_tag, start, end))
+                    pending.append((end - start, result))
+
+            while pending:
+                add_elements(pending.popleft(), profiler, everything)
+
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return everything
   
-#add the elements to the everything dict
-def add_elements(packed_elements, profiler, everything):
+#add the elements of a parsed byte range to the everything dict
+def add_elements(pending_range, profiler, everything):
+    num_bytes, result = pending_range
     
-    #only one object can be sent in the callback
-    #unpack this object
-    upper_level_tag, offset, element_array, element_names = packed_elements
-    packed_elements = None
+    start_time = time.perf_counter()
+    loaded_range, busy_seconds = result.get()
+    profiler.add_transfer_time(time.perf_counter() - start_time)
     
-    everything[upper_level_tag] = element_array
-    everything[upper_level_tag + "_names"] = element_names
-    everything[upper_level_tag + "_offset"] = offset
-    
-    if profiler.PROFILE_TIME:
-        profiler.time_array.append([upper_level_tag, time.time() - profiler.start_time])
-        profiler.start_time = time.time() #measure time until next high-level tag is finished
-        
-    if profiler.PROFILE_MEMORY:
-        profiler.memory_array.append(("Finishing " + upper_level_tag + ": ", asizeof(everything)))
+    add_timed_range(loaded_range, num_bytes, busy_seconds, profiler, everything)
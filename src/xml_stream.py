@@ -0,0 +1,20 @@
+'''
+Streaming transcoding of legends exports.
+
+Dwarf Fortress declares its exports as UTF-8 but actually writes them in
+Code Page 437, so any accented letter in a name makes the file invalid
+UTF-8. The exports can also contain control characters that XML does not
+allow. Rather than rewriting the file before parsing, each byte range the
+parser reads is decoded from the export's real encoding, cleaned of
+invalid characters and re-encoded as UTF-8 on the fly.
+'''
+
+#Control characters that are not allowed in XML 1.0 are replaced with
+#question marks. Tabs and line breaks are allowed.
+INVALID_XML_CHARS = {c: '?' for c in range(0x20) if c not in (0x09, 0x0A, 0x0D)}
+
+'''
+Transcode a block of bytes from the given encoding to clean UTF-8.
+'''
+def transcode(data, encoding):
+    return data.decode(encoding, errors='replace').translate(INVALID_XML_CHARS).encode('utf-8')
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for loading and browsing a world.
+
+Generates a synthetic world with world_gen.py (once, it is kept in the
+world directory), then times, and measures the peak memory of:
+
+    load_dict, in serial and pooled mode
+    parse_historical_events
+    dispatch_link, for a sample of pages of each type
+    build_name_search_index, NameSearchIndex.search and search_elements,
+    for a set of queries
+    build_facet_index and search_facets, for a set of faceted queries
+    build_event_text_index, in serial and pooled mode, and search_events,
+    for a set of queries
+
+Results are compared with the stored baseline for the same scale, and
+stages that got slower or use more memory than the tolerance allows, or
+pages that failed to render, are reported as regressions (with an exit
+status of 1). A baseline is not saved while pages fail. Timings are the best
+of --repeat runs. Peak memory is measured in a separate run with
+tracemalloc, and only covers the main process.
+
+Usage: benchmark.py [--scale small|medium|large|<MB>] [--save-baseline] ...
+Run benchmark.py --help for all options.
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TEST_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import world_gen
+from xml_parsing import load_dict
+from dict_loading import parse_file
+from connect_elements import parse_historical_events
+from participant_index import ParticipantIndex
+from load_profiler import LoadProfiler
+from page_builders import dispatch_link
+from event_text_index import build_event_text_index, search_events
+from name_search import build_name_search_index
+from facet_index import build_facet_index, parse_facets, search_facets
+
+#Page types and the sections their ids come from
+PAGE_SECTIONS = {'reg': 'regions',
+                 'urg': 'underground_regions',
+                 'sit': 'sites',
+                 'woc': 'world_constructions',
+                 'art': 'artifacts',
+                 'hif': 'historical_figures',
+                 'enp': 'entity_populations',
+                 'ent': 'entities',
+                 'evt': 'historical_events',
+                 'hec': 'historical_event_collections',
+                 'era': 'historical_eras'}
+
+SEARCH_QUERIES = ['ur', 'dol', 'fath', 'the mighty', 'stukdak', 'zzz']
+
+#Names in a page of search results, as shown by the search bar
+SEARCH_PAGE_SIZE = 100
+
+FACET_QUERIES = ['race:dwarf associated_type:vampire', 'type:tower', 'deity: sphere:death',
+                 'race:goblin caste:female the']
+
+EVENT_QUERIES = ['died', '"old age"', 'struck OR drowned', 'settled -wandering', 'the mighty', 'zzz']
+
+#Stages faster than this are too noisy to report time regressions for
+MIN_SECONDS = 0.005
+
+DEFAULT_BASELINE = os.path.join(TEST_DIR, 'benchmark_baseline.json')
+DEFAULT_WORLD_DIR = os.path.join(TEST_DIR, 'worlds')
+
+'''
+Run function repeat times and return the best time in seconds. It is run
+once before that without being timed, so that even a single timed run
+does not include warming up, and results do not depend on repeat. If
+trace_memory is set, run it once more with tracemalloc and also return
+the peak memory allocated during that run, in bytes.
+'''
+def measure(function, repeat, trace_memory):
+    function()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+
+    result = {'seconds': best}
+    if trace_memory:
+        tracemalloc.start()
+        function()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+'''
+Return the synthetic world file for a scale and seed, generating it if
+it does not exist yet.
+'''
+def get_world_file(world_dir, scale, seed):
+    size_mb = world_gen.SCALES[scale] if scale in world_gen.SCALES else int(scale)
+    filename = os.path.join(world_dir, 'world_%s_%d.xml' % (scale, seed))
+    if not os.path.exists(filename):
+        os.makedirs(world_dir, exist_ok=True)
+        print("Generating %d MB world: %s" % (size_mb, filename))
+        world_gen.generate(filename, size_mb, seed)
+    return filename
+
+'''
+Return load_dict settings for a load without snapshots, lazy loading
+or profiling output, with the given number of parsing processes.
+'''
+def load_settings(num_parsing_threads):
+    return {'default': {'num_parsing_threads': str(num_parsing_threads), 'lazy_loading': 'False'},
+            'cache': {'use_snapshots': 'False'},
+            'profiling': {'profile_loading': 'False'}}
+
+'''
+Load a world quietly, without load_dict's progress output.
+'''
+def quiet_load(filename, num_parsing_threads):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return load_dict(filename, load_settings(num_parsing_threads))
+
+def bench_loading(filename, args, stages):
+    print("load_dict (serial)")
+    stages['load_dict serial'] = measure(lambda: quiet_load(filename, 0), args.repeat, args.memory)
+
+    print("load_dict (pooled, %d workers)" % args.workers)
+    stages['load_dict pooled'] = measure(lambda: quiet_load(filename, args.workers), args.repeat, args.memory)
+
+'''
+Time linking the events of a parsed world. Each run gets a fresh
+participant index with the edges collected while parsing.
+'''
+def bench_linking(filename, args, stages):
+    print("parse_historical_events")
+    chunk_size = 4096 * 1024
+    everything = parse_file(filename, 'cp437', chunk_size, LoadProfiler())
+    edges = everything['participant_index'].edges
+
+    def link():
+        index = ParticipantIndex()
+        index.add_edges(edges)
+        everything['participant_index'] = index
+        parse_historical_events(everything)
+
+    stages['parse_historical_events'] = measure(link, args.repeat, args.memory)
+
+'''
+Time rendering a random sample of pages of each type. Pages that fail
+to render are counted, and reported as regressions once every stage has
+run.
+'''
+def bench_pages(everything, args, stages):
+    rng = random.Random(args.seed)
+    for code, section in PAGE_SECTIONS.items():
+        if not everything.get(section):
+            continue
+        offset = max(everything[section + '_offset'], 0)
+        ids = list(range(offset, offset + len(everything[section])))
+        sample = rng.sample(ids, min(args.pages, len(ids)))
+        errors = []
+
+        def render():
+            del errors[:]
+            #time building the pages, not reading them (or the names and
+            #links in them) from the caches filled by the previous run
+            everything['page_cache'].clear()
+            everything['display_cache'].clear()
+            for an_id in sample:
+                try:
+                    dispatch_link(code + str(an_id), everything)
+                except Exception:
+                    errors.append(an_id)
+
+        print("dispatch_link %s (%d pages)" % (code, len(sample)))
+        result = measure(render, args.repeat, args.memory)
+        result['pages'] = len(sample)
+        result['errors'] = len(errors)
+        stages['dispatch_link ' + code] = result
+
+def bench_search(everything, args, stages):
+    print("build_name_search_index")
+    stages['build_name_search_index'] = measure(lambda: build_name_search_index(everything), args.repeat, args.memory)
+
+    index = everything['name_search']
+
+    #every run starts without the matches cached by the previous one
+    def search():
+        index.refinements.clear()
+        for query in SEARCH_QUERIES:
+            index.search(query)
+
+    print("NameSearchIndex.search (%d queries, %d names)" % (len(SEARCH_QUERIES), len(index)))
+    stages['search'] = measure(search, args.repeat, args.memory)
+
+    def search_page():
+        index.refinements.clear()
+        for query in SEARCH_QUERIES:
+            index.search_elements(query, SEARCH_PAGE_SIZE)
+
+    print("NameSearchIndex.search_elements (%d queries, %d results)" % (len(SEARCH_QUERIES), SEARCH_PAGE_SIZE))
+    stages['search_elements'] = measure(search_page, args.repeat, args.memory)
+
+    print("build_facet_index")
+    stages['build_facet_index'] = measure(lambda: build_facet_index(everything), args.repeat, args.memory)
+
+    def search_by_facets():
+        for query in FACET_QUERIES:
+            facets, text = parse_facets(query)
+            search_facets(facets, text, everything)
+
+    print("search_facets (%d queries)" % len(FACET_QUERIES))
+    stages['search_facets'] = measure(search_by_facets, args.repeat, args.memory)
+
+'''
+Time building the full-text index of events, in this process and with
+worker processes as when a world is loaded, and running full-text
+queries on the built index.
+'''
+def bench_event_search(everything, args, stages):
+    print("build_event_text_index (serial)")
+    stages['build_event_text_index serial'] = \
+        measure(lambda: build_event_text_index(everything), args.repeat, args.memory)
+
+    print("build_event_text_index (pooled, %d workers)" % args.workers)
+    stages['build_event_text_index pooled'] = \
+        measure(lambda: build_event_text_index(everything, args.workers), args.repeat, args.memory)
+
+    #the queries only time searching, not building the index
+    everything['event_text_index'] = build_event_text_index(everything, args.workers)
+
+    #phrase queries render events, which reads names from the display cache
+    def search():
+        everything['display_cache'].clear()
+        for query in EVENT_QUERIES:
+            search_events(query, everything)
+
+    print("search_events (%d queries)" % len(EVENT_QUERIES))
+    stages['search_events'] = measure(search, args.repeat, args.memory)
+
+'''
+Compare results with a baseline. Returns the stages that regressed,
+including those with pages that failed to render.
+'''
+def compare(stages, baseline, tolerance):
+    regressions = []
+    print("\n%-30s %12s %12s %8s %14s %14s" % ('stage', 'seconds', 'baseline', 'ratio', 'peak KB', 'baseline KB'))
+    for name, result in stages.items():
+        old = baseline.get(name, {})
+        line = "%-30s %12.4f" % (name, result['seconds'])
+        if 'seconds' in old and old['seconds'] > 0:
+            ratio = result['seconds'] / old['seconds']
+            line += " %12.4f %8.2f" % (old['seconds'], ratio)
+            if ratio > 1 + tolerance and result['seconds'] > MIN_SECONDS:
+                regressions.append(name + " time")
+        else:
+            line += " %12s %8s" % ('-', '-')
+        if 'peak_bytes' in result:
+            line += " %14d" % (result['peak_bytes'] // 1024)
+            if old.get('peak_bytes'):
+                line += " %14d" % (old['peak_bytes'] // 1024)
+                if result['peak_bytes'] / old['peak_bytes'] > 1 + tolerance:
+                    regressions.append(name + " memory")
+        if result.get('errors'):
+            line += "  (%d of %d pages failed)" % (result['errors'], result['pages'])
+            regressions.append(name + " errors")
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading and browsing a synthetic world.")
+    parser.add_argument('--scale', default='small',
+                        help="small (~10 MB), medium (~250 MB), large (~2 GB) or a size in MB")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the world and page samples")
+    parser.add_argument('--world-dir', default=DEFAULT_WORLD_DIR, help="where generated worlds are kept")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each stage, the best is kept")
+    parser.add_argument('--workers', type=int, default=4, help="processes for the pooled load")
+    parser.add_argument('--pages', type=int, default=200, help="pages of each type to render")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="skip the tracemalloc runs")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline results file")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the baseline for this scale")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown or memory growth before a stage counts as a regression")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    filename = get_world_file(args.world_dir, args.scale, args.seed)
+    stages = {}
+
+    bench_loading(filename, args, stages)
+    bench_linking(filename, args, stages)
+
+    everything = quiet_load(filename, 0)
+    bench_pages(everything, args, stages)
+    bench_search(everything, args, stages)
+    bench_event_search(everything, args, stages)
+
+    results = {'file': os.path.basename(filename), 'file_bytes': os.path.getsize(filename),
+               'python': sys.version.split()[0], 'stages': stages}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    regressions = compare(stages, baselines.get(args.scale, {}).get('stages', {}), args.tolerance)
+
+    failures = [name for name, result in stages.items() if result.get('errors')]
+    if args.save_baseline and failures:
+        print("\nNot saving a baseline, pages failed to render: " + ", ".join(failures))
+        sys.exit(1)
+    elif args.save_baseline:
+        baselines[args.scale] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("\nSaved baseline for scale " + args.scale + ": " + args.baseline)
+    elif regressions:
+        print("\nRegressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
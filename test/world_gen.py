@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+'''
+Generate a synthetic Dwarf Fortress legends export.
+
+The output follows the layout of a real legends XML file: the same
+top-level sections in the same order, the same element and attribute
+tags, "-1" placeholders for unset values and Code Page 437 bytes in
+names behind a UTF-8 declaration, just like Dwarf Fortress writes them.
+A fixed seed always produces the same file.
+
+Usage: world_gen.py <scale> <output file> [seed]
+Scales: small (~10 MB), medium (~250 MB), large (~2 GB), or a size
+in megabytes.
+'''
+import random
+import sys
+
+SCALES = {'small': 10, 'medium': 250, 'large': 2048}
+
+#Roughly how the bytes of a real export are distributed
+SECTION_SHARES = {'regions': 0.005,
+                  'underground_regions': 0.001,
+                  'sites': 0.01,
+                  'world_constructions': 0.002,
+                  'artifacts': 0.005,
+                  'historical_figures': 0.2,
+                  'entity_populations': 0.001,
+                  'entities': 0.003,
+                  'historical_events': 0.75,
+                  'historical_event_collections': 0.02,
+                  'historical_eras': 0.0}
+
+#Approximate size in bytes of one element in each section
+ELEMENT_SIZES = {'regions': 90,
+                 'underground_regions': 90,
+                 'sites': 130,
+                 'world_constructions': 110,
+                 'artifacts': 110,
+                 'historical_figures': 900,
+                 'entity_populations': 50,
+                 'entities': 70,
+                 'historical_events': 330,
+                 'historical_event_collections': 400}
+
+SYLLABLES = ['ur', 'ist', 'mon', 'ka', 'dol', 'lik', 'ot', 'zan', 'ber', 'osh',
+             'reg', 'tun', 'as', 'bom', 'rek', 'fath', 'kol', 'um', 'sak', 'nil',
+             'ab', 'an', 'vu', 'cog', 'dak', 'stuk', 'bes', 'mat', 'dum', 'shor']
+#Code Page 437 letters that show up in translated names
+ACCENTED = ['â', 'ë', 'ï', 'ô', 'û', 'á', 'í', 'ó']
+EPITHETS = ['the hall of shadows', 'the bronze fortress', 'the mighty', 'the lost spear',
+            'the vile', 'the silvery', 'the fiery canyon', 'the dark cellar', 'the lances']
+
+RACES = ['dwarf', 'human', 'elf', 'goblin', 'kobold', 'night creature', 'dragon', 'giant']
+CASTES = ['male', 'female', 'default']
+ASSOCIATED_TYPES = ['standard', 'miner', 'peasant', 'axeman', 'necromancer', 'vampire']
+REGION_TYPES = ['grassland', 'wetland', 'forest', 'mountains', 'desert', 'lake', 'ocean']
+SITE_TYPES = ['cave', 'fortress', 'hamlet', 'dark fortress', 'forest retreat', 'tower', 'town']
+SPHERES = ['war', 'death', 'fortresses', 'mountains', 'music', 'night', 'wealth']
+HF_LINK_TYPES = ['mother', 'father', 'child', 'spouse', 'deity', 'lover', 'apprentice', 'master']
+ENTITY_LINK_TYPES = ['member', 'former member', 'enemy', 'criminal', 'prisoner']
+STATES = ['settled', 'wandering', 'refugee', 'visiting']
+CAUSES = ['struck down', 'old age', 'shot and killed', 'drowned', 'murdered', 'burned alive']
+BATTLE_SUBTYPES = ['scuffle', 'attacked', 'ambushed', 'happen upon', 'confront',
+                   '2 lost after receiving wounds', '2 lost after giving wounds']
+
+'''
+Return the type-specific attributes of an event, as (tag, value) pairs.
+'''
+def event_fields(rng, world, event_type):
+    hf = lambda: rng.randrange(world['historical_figures'])
+    site = lambda: rng.randrange(world['sites'])
+    ent = lambda: rng.randrange(world['entities'])
+    location = [('site_id', site()), ('subregion_id', -1), ('feature_layer_id', -1), ('coords', '-1,-1')]
+    if event_type == 'hf died':
+        fields = [('hfid', hf())]
+        if rng.random() < 0.6:
+            fields += [('slayer_hfid', hf()), ('slayer_race', rng.choice(RACES)),
+                       ('slayer_caste', rng.choice(CASTES))]
+        return fields + location + [('cause', rng.choice(CAUSES))]
+    if event_type == 'change hf state':
+        return [('hfid', hf()), ('state', rng.choice(STATES))] + location
+    if event_type == 'change hf job':
+        return [('hfid', hf())] + location
+    if event_type == 'add hf hf link':
+        return [('hfid', hf()), ('hfid_target', hf())]
+    if event_type == 'add hf entity link':
+        return [('civ_id', ent()), ('histfig', hf())]
+    if event_type == 'created site':
+        return [('civ_id', ent()), ('site_civ_id', ent()), ('site_id', site()), ('builder_hfid', hf())]
+    if event_type == 'hf simple battle event':
+        return [('subtype', rng.choice(BATTLE_SUBTYPES)), ('group_1_hfid', hf()),
+                ('group_2_hfid', hf())] + location
+    if event_type == 'hf wounded':
+        return [('woundee_hfid', hf()), ('wounder_hfid', hf())] + location
+    if event_type == 'hf abducted':
+        return [('target_hfid', hf()), ('snatcher_hfid', hf())] + location
+    if event_type == 'entity law':
+        return [('entity_id', ent()), ('hist_figure_id', hf()), ('law_add', 'harsh')]
+    if event_type == 'artifact created':
+        return [('artifact_id', rng.randrange(world['artifacts'])), ('hist_figure_id', hf()),
+                ('site_id', site())]
+    if event_type == 'attacked site':
+        return [('attacker_civ_id', ent()), ('defender_civ_id', ent()), ('site_civ_id', ent()),
+                ('site_id', site()), ('attacker_general_hfid', hf()), ('defender_general_hfid', hf())]
+    if event_type == 'field battle':
+        x, y = world['site_coords'][site()]
+        return [('attacker_civ_id', ent()), ('defender_civ_id', ent()),
+                ('subregion_id', rng.randrange(world['regions'])), ('feature_layer_id', -1),
+                ('coords', '%d,%d' % (x, y)), ('attacker_general_hfid', hf()),
+                ('defender_general_hfid', hf())]
+    if event_type == 'hf travel':
+        return [('group_hfid', hf())] + location
+    if event_type == 'hf does interaction':
+        return [('doer_hfid', hf()), ('target_hfid', hf()), ('interaction', 'DEITY_CURSE_WEREBEAST_1')]
+    if event_type == 'changed creature type':
+        return [('changee_hfid', hf()), ('changer_hfid', hf()), ('old_race', rng.choice(RACES)),
+                ('old_caste', rng.choice(CASTES)), ('new_race', rng.choice(RACES)),
+                ('new_caste', rng.choice(CASTES))]
+    if event_type == 'hf confronted':
+        return [('hfid', hf()), ('situation', 'general suspicion'), ('reason', 'murder')] + location
+    if event_type == 'hf gains secret goal':
+        return [('hfid', hf()), ('secret_goal', 'immortality')]
+    if event_type == 'masterpiece item':
+        return [('hfid', hf()), ('entity_id', ent()), ('site_id', site()), ('skill_at', 'WEAPONSMITH')]
+    if event_type == 'created world construction':
+        return [('civ_id', ent()), ('site_civ_id', ent()),
+                ('wc_id', rng.randrange(world['world_constructions'])), ('master_wcid', -1),
+                ('site_id1', site()), ('site_id2', site())]
+    if event_type == 'created structure':
+        return [('civ_id', ent()), ('site_civ_id', ent()), ('site_id', site()),
+                ('structure_id', rng.randrange(8)), ('builder_hfid', hf())]
+    if event_type == 'hf profaned structure':
+        return [('hist_fig_id', hf()), ('site_id', site()), ('structure_id', rng.randrange(8)),
+                ('action', 0)]
+    if event_type == 'new site leader':
+        return [('attacker_civ_id', ent()), ('new_site_civ_id', ent()), ('defender_civ_id', ent()),
+                ('site_civ_id', ent()), ('site_id', site()), ('new_leader_hfid', hf())]
+    if event_type == 'peace accepted':
+        return [('source', ent()), ('destination', ent()), ('site_id', site())]
+    if event_type == 'creature devoured':
+        return [('site_id', site()), ('subregion_id', -1)]
+    if event_type == 'body abused':
+        x, y = world['site_coords'][site()]
+        return [('site_id', -1), ('subregion_id', -1), ('coords', '%d,%d' % (x, y))]
+    return [('site_id', site())]
+
+#Event types and their relative frequencies
+EVENT_TYPES = [('hf died', 10), ('change hf state', 25), ('change hf job', 8), ('add hf hf link', 8),
+               ('add hf entity link', 6), ('created site', 1), ('hf simple battle event', 5),
+               ('hf wounded', 4), ('hf abducted', 1), ('entity law', 1), ('artifact created', 2),
+               ('attacked site', 1), ('field battle', 2), ('hf travel', 3), ('hf does interaction', 1),
+               ('changed creature type', 1), ('hf confronted', 1), ('hf gains secret goal', 1),
+               ('masterpiece item', 3), ('created world construction', 1), ('created structure', 2),
+               ('hf profaned structure', 1), ('new site leader', 1), ('peace accepted', 1),
+               ('creature devoured', 2), ('body abused', 1), ('site abandoned', 1)]
+
+'''
+Return a name made of random syllables, occasionally with an accented
+letter or an epithet.
+'''
+def random_name(rng, words=2):
+    parts = []
+    for _ in range(words):
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.05:
+            i = rng.randrange(len(word))
+            word = word[:i] + rng.choice(ACCENTED) + word[i + 1:]
+        parts.append(word)
+    if rng.random() < 0.3:
+        parts.append(rng.choice(EPITHETS))
+    return ' '.join(parts)
+
+'''
+Return the XML of an element, given its attributes as (tag, value) pairs.
+A value of None gives an empty tag, and a list of pairs a nested element.
+'''
+def element_xml(tag, fields):
+    lines = ['\t<' + tag + '>']
+    for key, value in fields:
+        if value is None:
+            lines.append('\t\t<' + key + '/>')
+        elif isinstance(value, list):
+            lines.append('\t\t<' + key + '>')
+            for sub_key, sub_value in value:
+                lines.append('\t\t\t<%s>%s</%s>' % (sub_key, sub_value, sub_key))
+            lines.append('\t\t</' + key + '>')
+        else:
+            lines.append('\t\t<%s>%s</%s>' % (key, value, key))
+    lines.append('\t</' + tag + '>\n')
+    return '\n'.join(lines)
+
+def historical_figure_xml(rng, world, hf_id):
+    fields = [('id', hf_id), ('name', random_name(rng)), ('race', rng.choice(RACES).upper()),
+              ('caste', rng.choice(CASTES).upper()), ('appeared', rng.randrange(250)),
+              ('birth_year', rng.randrange(-50, 250)), ('birth_seconds72', rng.randrange(403200)),
+              ('death_year', -1), ('death_seconds72', -1),
+              ('associated_type', rng.choice(ASSOCIATED_TYPES).upper())]
+    if rng.random() < 0.02:
+        fields.append(('deity', None))
+        fields += [('sphere', s) for s in rng.sample(SPHERES, 2)]
+    for _ in range(rng.randrange(4)):
+        fields.append(('entity_link', [('link_type', rng.choice(ENTITY_LINK_TYPES)),
+                                       ('entity_id', rng.randrange(world['entities'])),
+                                       ('link_strength', rng.randrange(100))]))
+    for _ in range(rng.randrange(5)):
+        fields.append(('hf_link', [('link_type', rng.choice(HF_LINK_TYPES)),
+                                   ('hfid', rng.randrange(world['historical_figures']))]))
+    for _ in range(rng.randrange(6)):
+        fields.append(('hf_skill', [('skill', 'MINING'), ('total_ip', rng.randrange(5000))]))
+    return element_xml('historical_figure', fields)
+
+def historical_event_xml(rng, world, event_id, year):
+    event_type = rng.choices(world['event_types'], world['event_weights'])[0]
+    fields = [('id', event_id), ('year', year), ('seconds72', rng.randrange(403200)), ('type', event_type)]
+    return element_xml('historical_event', fields + event_fields(rng, world, event_type))
+
+'''
+Write a synthetic world of roughly size_mb megabytes to filename.
+'''
+def generate(filename, size_mb, seed=0):
+    rng = random.Random(seed)
+    total = size_mb * 1024 * 1024
+    counts = {section: max(1, int(total * share / ELEMENT_SIZES[section]))
+              for section, share in SECTION_SHARES.items() if section in ELEMENT_SIZES}
+    counts['world_constructions'] = max(1, counts['world_constructions'])
+    world = dict(counts)
+    world['site_coords'] = [(rng.randrange(257), rng.randrange(257)) for _ in range(counts['sites'])]
+    world['event_types'] = [t for t, _ in EVENT_TYPES]
+    world['event_weights'] = [w for _, w in EVENT_TYPES]
+
+    with open(filename, 'w', encoding='cp437', newline='\n') as f:
+        f.write("<?xml version=\"1.0\" encoding='UTF-8'?>\n<df_world>\n")
+
+        f.write('<regions>\n')
+        for i in range(counts['regions']):
+            f.write(element_xml('region', [('id', i), ('name', random_name(rng)), ('type', rng.choice(REGION_TYPES))]))
+        f.write('</regions>\n<underground_regions>\n')
+        for i in range(counts['underground_regions']):
+            f.write(element_xml('underground_region', [('id', i), ('type', 'cavern'), ('depth', rng.randint(1, 3))]))
+        f.write('</underground_regions>\n<sites>\n')
+        for i in range(counts['sites']):
+            x, y = world['site_coords'][i]
+            f.write(element_xml('site', [('id', i), ('type', rng.choice(SITE_TYPES)), ('name', random_name(rng)),
+                                      ('coords', '%d,%d' % (x, y))]))
+        f.write('</sites>\n<world_constructions>\n')
+        for i in range(counts['world_constructions']):
+            f.write(element_xml('world_construction', [('id', i), ('name', random_name(rng)), ('type', 'road')]))
+        f.write('</world_constructions>\n<artifacts>\n')
+        for i in range(counts['artifacts']):
+            f.write(element_xml('artifact', [('id', i), ('name', random_name(rng)), ('item', random_name(rng, 1))]))
+        f.write('</artifacts>\n<historical_figures>\n')
+        for i in range(counts['historical_figures']):
+            f.write(historical_figure_xml(rng, world, i))
+        f.write('</historical_figures>\n<entity_populations>\n')
+        for i in range(counts['entity_populations']):
+            f.write(element_xml('entity_population', [('id', i)]))
+        f.write('</entity_populations>\n<entities>\n')
+        for i in range(counts['entities']):
+            f.write(element_xml('entity', [('id', i), ('name', random_name(rng))]))
+        f.write('</entities>\n<historical_events>\n')
+        num_events = counts['historical_events']
+        for i in range(num_events):
+            f.write(historical_event_xml(rng, world, i, i * 250 // num_events))
+        f.write('</historical_events>\n<historical_event_collections>\n')
+        for i in range(counts['historical_event_collections']):
+            start = rng.randrange(num_events)
+            fields = [('id', i), ('start_year', start * 250 // num_events), ('start_seconds72', -1),
+                      ('end_year', -1), ('end_seconds72', -1), ('type', 'war'), ('name', random_name(rng))]
+            fields += [('event', e) for e in range(start, min(num_events, start + 20))]
+            f.write(element_xml('historical_event_collection', fields))
+        f.write('</historical_event_collections>\n<historical_eras>\n')
+        f.write(element_xml('historical_era', [('name', 'age of myth'), ('start_year', -1)]))
+        f.write(element_xml('historical_era', [('name', 'age of legends'), ('start_year', 100)]))
+        f.write('</historical_eras>\n</df_world>\n')
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    scale = sys.argv[1]
+    size_mb = SCALES[scale] if scale in SCALES else int(scale)
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    generate(sys.argv[2], size_mb, seed)
+
+if __name__ == '__main__':
+    main()